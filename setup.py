@@ -25,7 +25,10 @@ setup(
     },
     entry_points={
         'console_scripts': [
-            'structspec = structspec.structspec:main'
+            'structspec = structspec.structspec:main',
+            'structspec-bench = structspec.bench:main',
+            'structspec-capture = structspec.capture:main',
+            'structspec-synthesize = structspec.synthesize:main'
         ]
     },
     classifiers=[
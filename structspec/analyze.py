@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Packet layout analysis
+
+Reports how much of each packet is spent on things other than its
+values: explicit padding, unused bits in bitfield containers and,
+for the C structs, the holes compilers leave to align members. It
+also shows which fields straddle cache lines and suggests an order
+for the items of each packet that packs them more densely.
+
+Run it with:
+    structspec --analyze-layout -s specification.json
+"""
+
+from collections import OrderedDict
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
+from common import writeOut, getPacketLayout, getPacketSize, \
+    flattenLayout, getBitFieldContainerSize
+
+# The size of a cache line in bytes
+cacheLineSize = 64
+
+# The size of the C enum types declared for enumerations, which
+# compilers make int
+enumSize = 4
+
+
+def getCSize(item, specification, layouts=None):
+    """
+    Determines the size of one element of a structure item in C.
+
+    Args:
+        item (dict):          The layout of the structure item.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        The size in bytes, which differs from the packed size
+        for 24-bit integers (held in 32-bit ones), items typed
+        by an enumeration (declared as its C enum type) and
+        substructures (which may have holes of their own).
+
+    Examples:
+        >>> getCSize({'kind': 'field', 'size': 3}, {})
+        4
+        >>> spec = {'enums': {'Kind': {'type': 'uint8_t'}}}
+        >>> getCSize({'kind': 'field', 'size': 1, 'enum': 'Kind'}, spec)
+        4
+    """
+    if item['kind'] == 'substructure':
+        return getCLayout(item['type'], specification, layouts)[0]
+    if item.get('enum') is not None and not specification['enums'][
+            item['enum']].get('preprocessor', False):
+        return enumSize
+    if item['size'] == 3:
+        return 4
+    return item['size']
+
+
+def getAlignment(item, specification, layouts=None):
+    """
+    Determines the alignment a C compiler gives a structure item.
+
+    Items are taken to be naturally aligned, bitfields to the
+    integer holding them and substructures to their most strictly
+    aligned member.
+
+    Args:
+        item (dict):          The layout of the structure item.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        The alignment in bytes.
+
+    Examples:
+        >>> getAlignment({'kind': 'field', 'size': 4}, {})
+        4
+        >>> getAlignment({'kind': 'field', 'size': 0}, {})
+        1
+    """
+    if item['kind'] == 'substructure':
+        return getCLayout(item['type'], specification, layouts)[1]
+    return min(getCSize(item, specification, layouts), 8) or 1
+
+
+def getCLayout(packetName, specification, layouts=None):
+    """
+    Models the layout of the C struct for a packet.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts,
+                              which also keeps the answer.
+
+    Returns:
+        A tuple of the size of the struct in bytes (with items of
+        variable count taken as empty), its alignment and a list
+        of its holes, each a tuple of the name of the item the
+        hole comes before (None for the end) and its size.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': {'msg': {'structure': OrderedDict([
+        ...     ('kind', {'type': 'uint8_t'}),
+        ...     ('ts', {'type': 'uint32_t'}),
+        ...     ('a', {'type': 'uint8_t', 'size': 3}),
+        ...     ('b', {'type': 'uint8_t', 'size': 4})])}}}
+        >>> getCLayout('msg', spec)
+        (12, 4, [('ts', 3), (None, 3)])
+    """
+    if layouts is not None and ('cLayout', packetName) in layouts:
+        return layouts[('cLayout', packetName)]
+    offset = 0
+    alignment = 1
+    holes = []
+    for item in getPacketLayout(packetName, specification, layouts):
+        if item['kind'] == 'bitfield' and item['bitOffset']:
+            continue
+        size = getCSize(item, specification, layouts)
+        itemAlignment = getAlignment(item, specification, layouts)
+        hole = -offset % itemAlignment
+        if hole:
+            holes.append((item['name'], hole))
+        offset += hole + size * (item['count'] or 0)
+        alignment = max(alignment, itemAlignment)
+    hole = -offset % alignment
+    if hole:
+        holes.append((None, hole))
+    cLayout = (offset + hole, alignment, holes)
+    if layouts is not None:
+        layouts[('cLayout', packetName)] = cLayout
+    return cLayout
+
+
+def getWireSize(packetName, specification, layouts=None):
+    """
+    Determines the smallest packed size of a packet.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        The size of the packet in bytes, with any items of
+        variable count taken as empty.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': {'msg': {'structure': OrderedDict([
+        ...     ('n', {'type': 'uint16_t'}),
+        ...     ('data', {'type': 'uint32_t', 'count': 'n'}),
+        ...     ('crc', {'type': 'uint8_t'})])}}}
+        >>> getWireSize('msg', spec)
+        3
+    """
+    size = getPacketSize(packetName, specification, layouts)
+    if size is not None:
+        return size
+    size = 0
+    for item in getPacketLayout(packetName, specification, layouts):
+        if item['kind'] == 'bitfield' and item['bitOffset']:
+            continue
+        if item['kind'] == 'substructure':
+            itemSize = getWireSize(item['type'], specification, layouts)
+        else:
+            itemSize = item['size']
+        size += itemSize * (item['count'] or 0)
+    return size
+
+
+def getBitFieldWaste(packetName, specification, layouts=None):
+    """
+    Determines how well each bitfield container is filled.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        A list with a tuple for each container of the names of
+        the bitfields in it, its size in bits and the number of
+        those bits used.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': {'msg': {'structure': OrderedDict([
+        ...     ('a', {'type': 'uint8_t', 'size': 3}),
+        ...     ('b', {'type': 'uint8_t', 'size': 6}),
+        ...     ('ts', {'type': 'uint32_t'}),
+        ...     ('c', {'type': 'uint8_t', 'size': 5})])}}}
+        >>> getBitFieldWaste('msg', spec)
+        [(['a', 'b'], 16, 9), (['c'], 8, 5)]
+    """
+    containers = []
+    for item in getPacketLayout(packetName, specification, layouts):
+        if item['kind'] != 'bitfield':
+            continue
+        if not item['bitOffset']:
+            containers.append(([], item['size'] * 8, 0))
+        names, containerBits, usedBits = containers[-1]
+        names.append(item['name'])
+        containers[-1] = (names, containerBits, usedBits + item['bitSize'])
+    return containers
+
+
+def getCacheLineCrossings(packetName, specification, layouts=None,
+                          lineSize=cacheLineSize):
+    """
+    Determines how a packet sits across cache lines.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+        lineSize (int):       The size of a cache line in bytes.
+
+    Returns:
+        A tuple of the dotted names of the fields straddling a
+        line boundary in a packet starting on one, and the share
+        of packets laid end to end from a boundary that straddle
+        one (None if the packet varies in size).
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': {'msg': {'structure': OrderedDict([
+        ...     ('name', {'type': 'char', 'count': 62}),
+        ...     ('ts', {'type': 'uint32_t'})])}}}
+        >>> getCacheLineCrossings('msg', spec)
+        (['ts'], 1.0)
+    """
+    crossings = []
+    for item in flattenLayout(packetName, specification, layouts):
+        if item['offset'] is None or item['count'] is None:
+            continue
+        end = item['offset'] + item['size'] * item['count'] - 1
+        if end >= item['offset'] and \
+                item['offset'] // lineSize != end // lineSize:
+            crossings.append(item['name'])
+    size = getPacketSize(packetName, specification, layouts)
+    if not size:
+        return (crossings, None if size is None else 0.0)
+    period = lineSize // gcd(size, lineSize)
+    straddling = len([packetNum for packetNum in range(period)
+                      if packetNum * size % lineSize + size > lineSize])
+    return (crossings, float(straddling) / period)
+
+
+def getSuggestionCandidates(packetName, specification, layouts=None):
+    """
+    Makes up orders for the items of a packet worth comparing.
+
+    Explicit padding is dropped throughout. The original order
+    is one candidate; the others put the items in decreasing order
+    of alignment with the bitfields either kept in their original
+    runs or repacked together. Items counted by others are kept
+    last in their original order, so counts still come first.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        A list of lists of item names.
+    """
+    layout = getPacketLayout(packetName, specification, layouts)
+    original = []
+    fixed = []
+    varying = []
+    runs = []
+    bitFields = OrderedDict()
+    for item in layout:
+        if item['kind'] == 'padding':
+            continue
+        original.append(item['name'])
+        if item['count'] is None:
+            varying.append(item['name'])
+        elif item['kind'] == 'bitfield':
+            if not item['bitOffset']:
+                runs.append((item['size'], []))
+            runs[-1][1].append(item['name'])
+            bitFields.setdefault(item['endianness'], []).append(item)
+        else:
+            fixed.append((getAlignment(item, specification, layouts),
+                          [item['name']]))
+    repacked = []
+    for items in bitFields.values():
+        bins = []
+        for item in sorted(items, key=lambda item: -item['bitSize']):
+            for fillBin in bins:
+                if fillBin[0] + item['bitSize'] <= 64:
+                    fillBin[0] += item['bitSize']
+                    fillBin[1].append(item['name'])
+                    break
+            else:
+                bins.append([item['bitSize'], [item['name']]])
+        repacked.extend([(getBitFieldContainerSize(bits), names)
+                         for bits, names in bins])
+    candidates = [original]
+    for bitFieldUnits in (runs, repacked):
+        units = sorted(fixed + bitFieldUnits, key=lambda unit: -unit[0])
+        candidates.append([name for alignment, names in units
+                           for name in names] + varying)
+    return candidates
+
+
+def suggestOrder(packetName, specification, layouts=None):
+    """
+    Suggests a denser order for the items of a packet.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        A tuple of the suggested item names in order, the smallest
+        packed size and the C struct size they give.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': {'msg': {'structure': OrderedDict([
+        ...     ('kind', {'type': 'uint8_t'}),
+        ...     ('a', {'type': 'uint8_t', 'size': 3}),
+        ...     ('ts', {'type': 'uint32_t'}),
+        ...     ('pad', {'type': 'padding', 'count': 2}),
+        ...     ('b', {'type': 'uint8_t', 'size': 4}),
+        ...     ('n', {'type': 'uint16_t'}),
+        ...     ('data', {'type': 'uint8_t', 'count': 'n'})])}}}
+        >>> suggestOrder('msg', spec)
+        (['ts', 'n', 'kind', 'a', 'b', 'data'], 8, 8)
+    """
+    packet = specification['packets'][packetName]
+    best = None
+    for order in getSuggestionCandidates(packetName, specification, layouts):
+        suggested = dict(specification, packets=dict(
+            specification['packets']))
+        suggested['packets'][packetName] = dict(packet, structure=OrderedDict(
+            [(name, packet['structure'][name]) for name in order]))
+        suggestedLayouts = {}
+        sizes = (getWireSize(packetName, suggested, suggestedLayouts),
+                 getCLayout(packetName, suggested, suggestedLayouts)[0])
+        if best is None or sizes < best[1:]:
+            best = (order,) + sizes
+    return best
+
+
+def countBytes(size):
+    """
+    Describes a number of bytes.
+
+    Args:
+        size (int): The number of bytes.
+
+    Returns:
+        The number followed by the right form of "byte".
+
+    Examples:
+        >>> countBytes(1)
+        '1 byte'
+        >>> countBytes(0)
+        '0 bytes'
+    """
+    return '{} byte{}'.format(size, '' if size == 1 else 's')
+
+
+def outputAnalysis(specification, outFile):
+    """
+    Outputs a report on the layout of every packet.
+
+    Args:
+        specification (dict): The specification object.
+        outFile (file):       A file-like object to which
+                              to write the report.
+
+    Examples:
+        >>> from StringIO import StringIO
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': {'msg': {'structure': OrderedDict([
+        ...     ('kind', {'type': 'uint8_t'}),
+        ...     ('ts', {'type': 'uint32_t'}),
+        ...     ('a', {'type': 'uint8_t', 'size': 3})])}}}
+        >>> outFile = StringIO()
+        >>> outputAnalysis(spec, outFile)
+        >>> print(outFile.getvalue().strip())
+        msg: 6 bytes packed, 12 bytes as a C struct
+          Explicit padding: 0 bytes
+          Alignment holes: 3 bytes before ts, 3 bytes at the end
+          Bitfield containers: a uses 3 of 8 bits
+          Fields crossing 64-byte cache lines: none
+          Packets laid end to end crossing a cache line: 6%
+          Suggested order: ts, kind, a (6 bytes packed, 8 as a C struct)
+    """
+    assert isinstance(specification, dict)
+    assert hasattr(outFile, 'write')
+    prefix = '  '
+    layouts = {}
+    for packetName in specification['packets']:
+        wireSize = getWireSize(packetName, specification, layouts)
+        cSize, alignment, holes = getCLayout(packetName, specification,
+                                             layouts)
+        variable = getPacketSize(packetName, specification, layouts) is None
+        writeOut(outFile, '{}: {}{} bytes packed, {} bytes as a C '
+                 'struct'.format(packetName, 'at least ' if variable else '',
+                                 wireSize, cSize))
+        writeOut(outFile, 'Explicit padding: {}'.format(countBytes(sum(
+            [item['size'] * (item['count'] or 0)
+             for item in getPacketLayout(packetName, specification, layouts)
+             if item['kind'] == 'padding']))), prefix)
+        writeOut(outFile, 'Alignment holes: {}'.format(', '.join([
+            '{} {}'.format(countBytes(size), 'before {}'.format(name)
+                           if name is not None else 'at the end')
+            for name, size in holes]) or 'none'), prefix)
+        containers = getBitFieldWaste(packetName, specification, layouts)
+        if containers:
+            writeOut(outFile, 'Bitfield containers: {}'.format(', '.join([
+                '{} uses {} of {} bits'.format('+'.join(names), usedBits,
+                                               containerBits)
+                for names, containerBits, usedBits in containers])), prefix)
+        crossings, straddling = getCacheLineCrossings(
+            packetName, specification, layouts)
+        writeOut(outFile, 'Fields crossing {}-byte cache lines: {}'.format(
+            cacheLineSize, ', '.join(crossings) or 'none'), prefix)
+        if straddling is not None:
+            writeOut(outFile, 'Packets laid end to end crossing a cache '
+                     'line: {:.0%}'.format(straddling), prefix)
+        order, suggestedWireSize, suggestedCSize = suggestOrder(
+            packetName, specification, layouts)
+        if (suggestedWireSize, suggestedCSize) < (wireSize, cSize):
+            writeOut(outFile, 'Suggested order: {} ({}{} bytes packed, {} '
+                     'as a C struct)'.format(', '.join(order),
+                                             'at least ' if variable else '',
+                                             suggestedWireSize,
+                                             suggestedCSize), prefix)
+        else:
+            writeOut(outFile, 'Suggested order: unchanged', prefix)
+
+
+# Execute the following when run from the command line.
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,656 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmarks for the generated handlers
+
+Generates Python handlers for a set of representative packet
+specifications (flat, nested, bitfield-heavy, count-array and
+mixed-endian) and measures how many pack, unpack and get length
+operations they manage per second. Results are written out as
+JSON and may be compared against an earlier run so that a
+slowdown beyond a given threshold fails the run.
+
+It can instead time loading and validating synthesized specifications
+of growing size and generating each language's handlers for them,
+reporting how the time grows so that worse than linear behaviour
+fails the run, or compare writing a stream of packets one at a time
+against writing them through a PacketWriter.
+
+Run it with:
+    python -m structspec.bench --output results.json
+    python -m structspec.bench --baseline results.json --threshold 0.1
+    python -m structspec.bench --scaling --sizes 100 200 400 800
+    python -m structspec.bench --writer --number 1000000
+"""
+
+from sys import exit, stderr, version_info
+from collections import OrderedDict
+from argparse import ArgumentParser, Namespace
+from functools import partial
+from imp import new_module
+from math import log
+from os import chdir, getcwd
+from os.path import abspath, dirname, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from json import dump as dumpJson, dumps as dumpJsonString, \
+    load as loadJson
+from platform import python_implementation
+from timeit import Timer, default_timer
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+from common import giveUp, isStringType, isFloatType, \
+    isBooleanType, getPacketLayout, getPacketSize, resolveConstraint, \
+    resolveMembers
+from languages import python
+from structspec import loadAndValidateInputs, langModules
+from synthesize import synthesizeSpecification
+from writer import PacketWriter
+
+# Representative specifications to benchmark
+specifications = OrderedDict([
+    ('flat', OrderedDict([
+        ('id', 'flat'),
+        ('title', 'Flat packet of assorted numbers'),
+        ('endianness', 'big'),
+        ('enums', OrderedDict()),
+        ('packets', OrderedDict([
+            ('reading', OrderedDict([
+                ('structure', OrderedDict([
+                    ('sensor', {'type': 'uint32_t'}),
+                    ('x', {'type': 'int16_t'}),
+                    ('y', {'type': 'int16_t'}),
+                    ('z', {'type': 'int16_t'}),
+                    ('flags', {'type': 'uint8_t'}),
+                    ('value', {'type': 'float'}),
+                    ('total', {'type': 'double'}),
+                    ('stamp', {'type': 'int64_t'})
+                ]))
+            ]))
+        ]))
+    ])),
+    ('nested', OrderedDict([
+        ('id', 'nested'),
+        ('title', 'Packet built from substructures'),
+        ('endianness', 'little'),
+        ('enums', OrderedDict()),
+        ('packets', OrderedDict([
+            ('vector', OrderedDict([
+                ('structure', OrderedDict([
+                    ('x', {'type': 'float'}),
+                    ('y', {'type': 'float'}),
+                    ('z', {'type': 'float'})
+                ]))
+            ])),
+            ('stamp', OrderedDict([
+                ('structure', OrderedDict([
+                    ('seconds', {'type': 'uint32_t'}),
+                    ('nanoseconds', {'type': 'uint32_t'})
+                ]))
+            ])),
+            ('track', OrderedDict([
+                ('structure', OrderedDict([
+                    ('track', {'type': 'uint16_t'}),
+                    ('position', {'type': '#/packets/vector'}),
+                    ('velocity', {'type': '#/packets/vector'}),
+                    ('time', {'type': '#/packets/stamp'})
+                ]))
+            ]))
+        ]))
+    ])),
+    ('bitfields', OrderedDict([
+        ('id', 'bitfields'),
+        ('title', 'Packet made mostly of bitfields'),
+        ('endianness', 'big'),
+        ('enums', OrderedDict()),
+        ('packets', OrderedDict([
+            ('status', OrderedDict([
+                ('structure', OrderedDict(
+                    [('flag{}'.format(flagNum), {'type': 'uint8_t', 'size': 1})
+                     for flagNum in range(4)] + [
+                        ('mode', {'type': 'uint8_t', 'size': 4}),
+                        ('level', {'type': 'uint8_t', 'size': 3}),
+                        ('channel', {'type': 'uint8_t', 'size': 5}),
+                        ('gain', {'type': 'uint8_t', 'size': 8}),
+                        ('phase', {'type': 'uint8_t', 'size': 2}),
+                        ('error', {'type': 'uint8_t', 'size': 6}),
+                        ('counter', {'type': 'uint16_t', 'size': 12}),
+                        ('offset', {'type': 'uint32_t', 'size': 20}),
+                        ('checksum', {'type': 'uint16_t'})]))
+            ]))
+        ]))
+    ])),
+    ('arrays', OrderedDict([
+        ('id', 'arrays'),
+        ('title', 'Packet of repeated values'),
+        ('endianness', 'little'),
+        ('enums', OrderedDict([
+            ('Limits', OrderedDict([
+                ('options', OrderedDict([
+                    ('SAMPLE_COUNT', {'value': 16})
+                ]))
+            ]))
+        ])),
+        ('packets', OrderedDict([
+            ('samples', OrderedDict([
+                ('structure', OrderedDict([
+                    ('sequence', {'type': 'uint32_t'}),
+                    ('values', {'type': 'int16_t', 'count':
+                                '#/enums/Limits/options/SAMPLE_COUNT/value'}),
+                    ('gains', {'type': 'float', 'count': 8}),
+                    ('label', {'type': 'string', 'count': 12})
+                ]))
+            ]))
+        ]))
+    ])),
+    ('mixedEndian', OrderedDict([
+        ('id', 'mixedEndian'),
+        ('title', 'Packet switching endianness between fields'),
+        ('endianness', 'little'),
+        ('enums', OrderedDict()),
+        ('packets', OrderedDict([
+            ('frame', OrderedDict([
+                ('structure', OrderedDict([
+                    ('length', {'type': 'uint16_t', 'endianness': 'big'}),
+                    ('sequence', {'type': 'uint32_t'}),
+                    ('address', {'type': 'uint32_t', 'endianness': 'big'}),
+                    ('value', {'type': 'int32_t'}),
+                    ('port', {'type': 'uint16_t', 'endianness': 'big'}),
+                    ('stamp', {'type': 'uint64_t'})
+                ]))
+            ]))
+        ]))
+    ]))
+])
+
+
+def loadCodec(specification):
+    """
+    Generates the Python handlers for a specification as a module.
+
+    Args:
+        specification (dict): The specification object.
+
+    Returns:
+        A module containing the generated handlers.
+
+    Examples:
+        >>> codec = loadCodec(specifications['flat'])
+        >>> codec.get_reading_len()
+        31
+    """
+    pyFile = StringIO()
+    options = {'pyFilename': '{}.py'.format(specification['id']),
+               'verbose': False}
+    python.outputPython(specification, options, pyFile)
+    codec = new_module(str(specification['id']))
+    exec(pyFile.getvalue(), codec.__dict__)
+    return codec
+
+
+def sampleValue(item, specification):
+    """
+    Makes up a valid value for a single structure item.
+
+    Values honour any member, min and max constraints and are
+    otherwise small enough to fit any bitfield.
+
+    Args:
+        item (dict):          The layout of the structure item.
+        specification (dict): The specification object.
+
+    Returns:
+        A value for the item.
+
+    Examples:
+        >>> sampleValue({'type': 'float', 'structure': {}, 'count': 1}, {})
+        1.5
+        >>> sampleValue({'type': 'string', 'structure': {}, 'count': 4}, {})
+        'xxxx'
+        >>> sampleValue({'type': 'int16_t', 'structure': {'min': 7},
+        ...              'count': 1}, {})
+        7
+    """
+    structure = item['structure']
+    if 'member' in structure:
+        return resolveMembers(structure['member'], specification)[0]
+    if 'min' in structure:
+        return resolveConstraint(structure['min'], specification)
+    if item['type'] in ('string', 'str'):
+        return 'x' * item['count']
+    if item['type'] == 'pascal':
+        return 'x' * (item['count'] - 1)
+    if isStringType(item['type']):
+        return 'x'
+    if isFloatType(item['type']):
+        return 1.5
+    if isBooleanType(item['type']):
+        return True
+    return 1
+
+
+def sampleRecord(packetName, specification, layouts=None):
+    """
+    Makes up a valid packet for benchmarking.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        A dictionary suitable for the generated pack function.
+
+    Examples:
+        >>> record = sampleRecord('track', specifications['nested'])
+        >>> record['position']['x'], record['time']['seconds']
+        (1.5, 1)
+    """
+    record = {}
+    for item in getPacketLayout(packetName, specification, layouts):
+        if item['kind'] == 'padding':
+            continue
+        if item['kind'] == 'substructure':
+            record[item['name']] = sampleRecord(item['type'], specification,
+                                                layouts)
+            continue
+        value = sampleValue(item, specification)
+        if item['count'] != 1 and not isinstance(value, str):
+            value = [value] * item['count']
+        record[item['name']] = value
+    return record
+
+
+def timeOperation(operation, number, repeat):
+    """
+    Times the best of several runs of an operation.
+
+    Args:
+        operation (callable): The operation to time.
+        number (int):         How many times to run it per run.
+        repeat (int):         How many runs to make.
+
+    Returns:
+        The number of operations per second in the best run.
+    """
+    best = min(Timer(operation).repeat(repeat, number))
+    return number / max(best, 1e-9)
+
+
+def runBenchmarks(names=None, number=10000, repeat=3):
+    """
+    Runs the benchmarks.
+
+    Args:
+        names (list): The names of the specifications to
+                      benchmark, all of them if None.
+        number (int): How many operations make up a run.
+        repeat (int): How many runs to take the best of.
+
+    Returns:
+        An ordered dictionary of results keyed by specification,
+        packet and operation, each giving operations and MB
+        per second.
+    """
+    results = OrderedDict()
+    for specName, specification in specifications.items():
+        if names is not None and specName not in names:
+            continue
+        codec = loadCodec(specification)
+        layouts = {}
+        for packetName in specification['packets']:
+            packetLen = getPacketSize(packetName, specification, layouts)
+            record = sampleRecord(packetName, specification, layouts)
+            rawData = getattr(codec, 'pack_' + packetName)(record)
+            operations = (
+                ('pack', partial(getattr(codec, 'pack_' + packetName),
+                                 record)),
+                ('unpack', partial(getattr(codec, 'unpack_' + packetName),
+                                   rawData)),
+                ('len', getattr(codec, 'get_{}_len'.format(packetName)))
+            )
+            for operationName, operation in operations:
+                opsPerSecond = timeOperation(operation, number, repeat)
+                results['{}.{}.{}'.format(specName, packetName,
+                                          operationName)] = OrderedDict([
+                    ('opsPerSecond', round(opsPerSecond, 1)),
+                    ('mbPerSecond', round(opsPerSecond * packetLen / 1e6, 3))
+                ])
+    return results
+
+
+def findRegressions(results, baseline, threshold):
+    """
+    Finds the benchmarks that got slower.
+
+    Args:
+        results (dict):    The results of this run.
+        baseline (dict):   The results of an earlier run.
+        threshold (float): The fraction of the baseline speed
+                           that may be lost before it counts.
+
+    Returns:
+        A list of (name, baseline, current) tuples in operations
+        per second for each benchmark that slowed by more than
+        the threshold.
+
+    Examples:
+        >>> baseline = {'a': {'opsPerSecond': 100.0},
+        ...             'b': {'opsPerSecond': 100.0}}
+        >>> results = {'a': {'opsPerSecond': 95.0},
+        ...            'b': {'opsPerSecond': 80.0},
+        ...            'c': {'opsPerSecond': 1.0}}
+        >>> findRegressions(results, baseline, 0.1)
+        [('b', 100.0, 80.0)]
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]['opsPerSecond']
+        after = results[name]['opsPerSecond']
+        if after < before * (1 - threshold):
+            regressions.append((name, before, after))
+    return regressions
+
+
+def scalingExponent(sizes, seconds):
+    """
+    Estimates how time grows with size.
+
+    Fits a straight line to the logarithms of the times against
+    those of the sizes; its slope is about 1 for linear growth and
+    about 2 for quadratic.
+
+    Args:
+        sizes (list):   The sizes measured.
+        seconds (list): The time taken at each size.
+
+    Returns:
+        The exponent of the growth.
+
+    Examples:
+        >>> round(scalingExponent([10, 20, 40], [1.0, 2.0, 4.0]), 2)
+        1.0
+        >>> round(scalingExponent([10, 20, 40], [1.0, 4.0, 16.0]), 2)
+        2.0
+    """
+    logSizes = [log(size) for size in sizes]
+    logSeconds = [log(max(second, 1e-9)) for second in seconds]
+    meanSize = sum(logSizes) / len(logSizes)
+    meanSeconds = sum(logSeconds) / len(logSeconds)
+    spread = sum([(logSize - meanSize) ** 2 for logSize in logSizes])
+    if not spread:
+        return 0.0
+    return sum([(logSize - meanSize) * (logSecond - meanSeconds)
+                for logSize, logSecond in zip(logSizes, logSeconds)]) / spread
+
+
+def runScalingBenchmarks(sizes, languages=None, fieldCount=8, depth=2,
+                         enumCount=2, bitFieldDensity=0.25):
+    """
+    Times handler generation for growing specifications.
+
+    For each size synthesizes a specification with that many
+    packets, then times loading and validating it and generating
+    the handlers for each language.
+
+    Args:
+        sizes (list):            The numbers of packets to try.
+        languages (list):        The languages to generate, all of
+                                 them if None.
+        fieldCount (int):        How many fields each packet has.
+        depth (int):             The deepest substructure nesting.
+        enumCount (int):         How many enumerations to make.
+        bitFieldDensity (float): The share of fields that are
+                                 bitfields.
+
+    Returns:
+        An ordered dictionary keyed by stage giving the time taken
+        at each size and the exponent of its growth.
+    """
+    if languages is None:
+        languages = sorted(langModules.keys())
+    schemaName = join(dirname(abspath(__file__)), 'structspec-schema.json')
+    stages = OrderedDict([(stage, []) for stage in ['load'] + languages])
+    workingDirectory = getcwd()
+    directory = mkdtemp()
+    try:
+        chdir(directory)
+        for size in sizes:
+            specification = synthesizeSpecification(
+                size, fieldCount, depth, enumCount, bitFieldDensity)
+            with open('synthetic.json', 'w') as specificationFile:
+                dumpJson(specification, specificationFile)
+            args = Namespace(specification='synthetic.json',
+                             schema=schemaName, languages=languages,
+                             include=False, benchmark=False,
+                             decodeEnums=False, instrument=False,
+                             runtime=False, test=False, verbose=False)
+            start = default_timer()
+            specification, schema, options = loadAndValidateInputs(args)
+            stages['load'].append(default_timer() - start)
+            for language in languages:
+                start = default_timer()
+                langModules[language].outputForLanguage(specification,
+                                                        options)
+                stages[language].append(default_timer() - start)
+    finally:
+        chdir(workingDirectory)
+        rmtree(directory)
+    results = OrderedDict()
+    for stage, seconds in stages.items():
+        results[stage] = OrderedDict([
+            ('seconds', [round(second, 4) for second in seconds]),
+            ('exponent', round(scalingExponent(sizes, seconds), 2))
+        ])
+    return results
+
+
+def runWriterBenchmarks(number=100000, repeat=3):
+    """
+    Times writing a stream of packets to a file.
+
+    Writes the same packets to a temporary file four ways: packing
+    and writing each one to an unbuffered file (as a socket or pipe
+    would take them), the same with a buffered file, and packing
+    them into a PacketWriter over an unbuffered file one at a time
+    and all at once.
+
+    Args:
+        number (int): How many packets to write per run.
+        repeat (int): How many runs to take the best of.
+
+    Returns:
+        An ordered dictionary keyed by method giving the packets
+        written per second and the write calls made per run.
+    """
+    specification = specifications['flat']
+    codec = loadCodec(specification)
+    record = sampleRecord('reading', specification)
+    pack, packInto = codec.pack_reading, codec.pack_reading_into
+    directory = mkdtemp()
+    path = join(directory, 'packets.bin')
+    writes = {}
+
+    def writeSeparately(buffering):
+        with open(path, 'wb', buffering) as outFile:
+            for count in range(number):
+                outFile.write(pack(record))
+        writes['unbuffered' if buffering == 0 else 'buffered'] = number
+
+    def writeThroughWriter():
+        with open(path, 'wb', 0) as outFile:
+            writer = PacketWriter(outFile)
+            for count in range(number):
+                writer.write(packInto, record)
+            writer.close()
+        writes['writer'] = writer.writes
+
+    def writeAllThroughWriter():
+        with open(path, 'wb', 0) as outFile:
+            writer = PacketWriter(outFile)
+            writer.writeMany(packInto, [record] * number)
+            writer.close()
+        writes['writerMany'] = writer.writes
+
+    methods = OrderedDict([
+        ('unbuffered', partial(writeSeparately, 0)),
+        ('buffered', partial(writeSeparately, -1)),
+        ('writer', writeThroughWriter),
+        ('writerMany', writeAllThroughWriter)
+    ])
+    results = OrderedDict()
+    try:
+        for method, operation in methods.items():
+            best = min(Timer(operation).repeat(repeat, 1))
+            results[method] = OrderedDict([
+                ('packetsPerSecond', round(number / max(best, 1e-9), 1)),
+                ('writes', writes[method])
+            ])
+    finally:
+        rmtree(directory)
+    return results
+
+
+def parseArguments(args=None):
+    """
+    Parse command-line arguments
+
+    Examines the given command-line arguments and returns
+    an object containing the relevant arguments.
+
+    Args:
+        args (list): The command-line arguments to parse.
+
+    Returns:
+        A Namespace object with all the appropriately parsed
+        relevant arguments.
+
+    Examples:
+        >>> parseArguments(['--threshold', '0.2', 'flat']) == Namespace(
+        ...     baseline=None, maxExponent=1.5, number=10000, output=None,
+        ...     repeat=3, scaling=False, sizes=[50, 100, 200, 400],
+        ...     specifications=['flat'], threshold=0.2, writer=False)
+        True
+    """
+    assert args is None or isinstance(args, list)
+    parser = ArgumentParser(
+        description="Benchmark the handlers generated for a set of " +
+        "representative packet specifications."
+    )
+    parser.add_argument(
+        'specifications', nargs='*',
+        help='Specifications to benchmark out of {}; all of them by '
+        'default.'.format(', '.join(specifications.keys()))
+    )
+    parser.add_argument(
+        '--output', '-o',
+        help='File to write the JSON results to instead of standard output.'
+    )
+    parser.add_argument(
+        '--baseline', '-b',
+        help='JSON results of an earlier run to compare against.'
+    )
+    parser.add_argument(
+        '--threshold', '-t', type=float, default=0.1,
+        help='Fraction of the baseline speed that may be lost before ' +
+        'failing; 0.1 by default.'
+    )
+    parser.add_argument(
+        '--number', '-n', type=int, default=10000,
+        help='Operations per timed run; 10000 by default.'
+    )
+    parser.add_argument(
+        '--repeat', '-r', type=int, default=3,
+        help='Timed runs to take the best of; 3 by default.'
+    )
+    parser.add_argument(
+        '--scaling', action='store_true',
+        help='Time handler generation for growing synthesized ' +
+        'specifications instead.'
+    )
+    parser.add_argument(
+        '--writer', action='store_true',
+        help='Time writing a stream of packets separately and through ' +
+        'a PacketWriter instead.'
+    )
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[50, 100, 200, 400],
+        help='Numbers of packets to synthesize when scaling; 50, 100, ' +
+        '200 and 400 by default.'
+    )
+    parser.add_argument(
+        '--max-exponent', type=float, default=1.5, dest='maxExponent',
+        help='Largest acceptable growth exponent when scaling; 1.5 by ' +
+        'default.'
+    )
+    parsedArgs = parser.parse_args(args)
+    for specName in parsedArgs.specifications:
+        if specName not in specifications:
+            parser.error('unknown specification {}'.format(specName))
+    return parsedArgs
+
+
+def main():
+    """
+    The main routine when run from the command line.
+
+    Runs the benchmarks, writes out the results and exits with
+    an error if anything slowed beyond the threshold or grew
+    faster than the largest acceptable exponent.
+    """
+    args = parseArguments()
+    report = OrderedDict([
+        ('python', '{} {}'.format(python_implementation(),
+                                  '.'.join(map(str, version_info[:3]))))
+    ])
+    if args.scaling:
+        report['sizes'] = args.sizes
+        report['stages'] = runScalingBenchmarks(args.sizes)
+    elif args.writer:
+        report['number'] = args.number
+        report['repeat'] = args.repeat
+        report['writers'] = runWriterBenchmarks(args.number, args.repeat)
+    else:
+        report['number'] = args.number
+        report['repeat'] = args.repeat
+        report['results'] = runBenchmarks(args.specifications or None,
+                                          args.number, args.repeat)
+    try:
+        if args.output:
+            with open(args.output, 'w') as outFile:
+                dumpJson(report, outFile, indent=2)
+        else:
+            print(dumpJsonString(report, indent=2))
+    except EnvironmentError as envErr:
+        giveUp("Output environment error", envErr)
+    failed = False
+    if args.scaling:
+        for stage, result in report['stages'].items():
+            if result['exponent'] > args.maxExponent:
+                stderr.write('{} grows with exponent {}.\n'.format(
+                    stage, result['exponent']))
+                failed = True
+    elif args.baseline and not args.writer:
+        try:
+            with open(args.baseline) as baselineFile:
+                baseline = loadJson(baselineFile)
+        except EnvironmentError as envErr:
+            giveUp("Baseline environment error", envErr)
+        regressions = findRegressions(report['results'],
+                                      baseline.get('results', {}),
+                                      args.threshold)
+        for name, before, after in regressions:
+            stderr.write('{} slowed from {} to {} operations/s.\n'.format(
+                name, before, after))
+            failed = True
+    if failed:
+        exit(1)
+
+
+# Execute the following when run from the command line.
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic capture file generator
+
+Writes large files of random but valid binary packets for load
+testing whatever consumes them. Values honour the min, max and
+member constraints and enumerations given in the specification
+and are packed by the generated Python handlers. A capture may
+hold a single packet type or a mix of them, in which case the
+consumer tells them apart by their identifying fields.
+
+The capture is made in chunks, each generated on its own from
+the seed and its position, so that chunks may be generated in
+parallel across processes and the same seed always gives the
+same file however many processes are used.
+
+Run it with:
+    python -m structspec.capture -s specification.json --gigabytes 1
+    python -m structspec.capture -s spec.json -p reading point -j 4
+"""
+
+from collections import OrderedDict
+from argparse import ArgumentParser, Namespace
+from multiprocessing import Pool, cpu_count
+from random import Random
+from string import ascii_letters
+from struct import pack, unpack
+try:
+    from simplejson.decoder import JSONDecodeError
+    from simplejson import load as loadJson
+except ImportError:
+    from json.decoder import JSONDecodeError
+    from json import load as loadJson
+from six import string_types
+from common import giveUp, typeSizes, isStringType, isFloatType, \
+    isBooleanType, getPacketLayout, getEnumValues, resolveConstraint, \
+    resolveMembers
+from bench import loadCodec
+
+# How much of the capture each job generates, in bytes
+defaultChunkSize = 16 * 2 ** 20
+
+# How many records are generated before packing them all at once
+batchSize = 1024
+
+# The largest value generated for an item holding another's count,
+# so that records stay of a reasonable size however wide it is
+maxCount = 255
+
+# The state of a process generating chunks
+_generator = {}
+
+
+def getValueRange(item):
+    """
+    Determines the values a structure item can hold.
+
+    Args:
+        item (dict): The layout of the structure item.
+
+    Returns:
+        A tuple of the smallest and largest values it can hold.
+
+    Examples:
+        >>> getValueRange({'type': 'int16_t', 'kind': 'field'})
+        (-32768, 32767)
+        >>> getValueRange({'type': 'unsigned short', 'kind': 'field'})
+        (0, 65535)
+        >>> getValueRange({'type': 'int8_t', 'kind': 'bitfield',
+        ...                'bitSize': 3})
+        (0, 7)
+        >>> getValueRange({'type': 'float', 'kind': 'field'})
+        (-1000000.0, 1000000.0)
+    """
+    if isFloatType(item['type']):
+        return (-1e6, 1e6)
+    if item['kind'] == 'bitfield':
+        return (0, 2 ** item['bitSize'] - 1)
+    bits = typeSizes.get(item['type'], 8)
+    if item['type'].startswith('u') or item['type'] in ('pointer', 'void'):
+        return (0, 2 ** bits - 1)
+    return (-2 ** (bits - 1), 2 ** (bits - 1) - 1)
+
+
+def makeValueSource(item, specification, maxValue=None):
+    """
+    Makes a function giving random values for a structure item.
+
+    The values are drawn from the members or enumeration of the
+    item if it has them, and otherwise from between its min and
+    max within what its type can hold. A string whose length is
+    held by another item gives a single character at a time.
+
+    Args:
+        item (dict):          The layout of the structure item.
+        specification (dict): The specification object.
+        maxValue (int):       A further limit on the values, if any.
+
+    Returns:
+        A function taking a Random and giving a single value.
+
+    Examples:
+        >>> source = makeValueSource({'type': 'uint8_t', 'kind': 'field',
+        ...     'enum': None, 'structure': {'min': 3, 'max': 5}}, {})
+        >>> sorted(set([source(Random(seed)) for seed in range(50)]))
+        [3, 4, 5]
+        >>> source = makeValueSource({'type': 'uint16_t', 'kind': 'field',
+        ...     'enum': None, 'structure': {'member': [2, 9]}}, {})
+        >>> sorted(set([source(Random(seed)) for seed in range(50)]))
+        [2, 9]
+        >>> source = makeValueSource({'type': 'string', 'kind': 'field',
+        ...     'enum': None, 'count': 4, 'structure': {}}, {})
+        >>> len(source(Random(0)))
+        4
+        >>> source = makeValueSource({'type': 'string', 'kind': 'field',
+        ...     'enum': None, 'count': None, 'structure': {}}, {})
+        >>> len(source(Random(0)))
+        1
+        >>> source = makeValueSource({'type': 'uint16_t', 'kind': 'field',
+        ...     'enum': None, 'structure': {}}, {}, 3)
+        >>> sorted(set([source(Random(seed)) for seed in range(50)]))
+        [0, 1, 2, 3]
+    """
+    structure = item['structure']
+    if 'member' in structure:
+        members = resolveMembers(structure['member'], specification)
+        return lambda random: random.choice(members)
+    if item['enum'] is not None:
+        members = list(getEnumValues(
+            specification['enums'][item['enum']]).values())
+        return lambda random: random.choice(members)
+    if item['type'] in ('string', 'str') and item['count'] is not None:
+        return lambda random: ''.join([random.choice(ascii_letters)
+                                       for letter in range(item['count'])])
+    if item['type'] == 'pascal' and item['count'] is not None:
+        return lambda random: ''.join([random.choice(ascii_letters)
+                                       for letter in range(item['count'] - 1)])
+    if isStringType(item['type']):
+        return lambda random: random.choice(ascii_letters)
+    if isBooleanType(item['type']):
+        return lambda random: random.random() < 0.5
+    lowest, highest = getValueRange(item)
+    minimum = resolveConstraint(structure.get('min', lowest), specification)
+    maximum = resolveConstraint(structure.get('max', highest), specification)
+    # Constraints given as expressions cannot be honoured here
+    if isinstance(minimum, string_types):
+        minimum = lowest
+    if isinstance(maximum, string_types):
+        maximum = highest
+    minimum = max(minimum, lowest)
+    maximum = min(maximum, highest)
+    if maxValue is not None:
+        maximum = max(minimum, min(maximum, maxValue))
+    if isFloatType(item['type']):
+        if item['type'] == 'float':
+            # Keep to values a single precision float holds exactly
+            return lambda random: unpack('f', pack(
+                'f', random.uniform(minimum, maximum)))[0]
+        return lambda random: random.uniform(minimum, maximum)
+    return lambda random: random.randint(minimum, maximum)
+
+
+def makeRecordSource(packetName, specification, layouts=None):
+    """
+    Makes a function giving random valid packets.
+
+    Items holding the count of another item are kept to at most
+    maxCount, and items counted by another are sized by it.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        A function taking a Random and giving a dictionary
+        suitable for the generated pack function.
+
+    Examples:
+        >>> from bench import specifications
+        >>> source = makeRecordSource('track', specifications['nested'])
+        >>> record = source(Random(0))
+        >>> sorted(record['time'].keys())
+        ['nanoseconds', 'seconds']
+        >>> record == source(Random(0))
+        True
+    """
+    sources = []
+    layout = getPacketLayout(packetName, specification, layouts)
+    countLabels = set([item['countLabel'] for item in layout
+                       if item['count'] is None])
+    for item in layout:
+        if item['kind'] == 'padding':
+            continue
+        if item['kind'] == 'substructure':
+            sources.append((item['name'], None, makeRecordSource(
+                item['type'], specification, layouts)))
+            continue
+        isArray = item['count'] is None or \
+            item['count'] != 1 and not isStringType(item['type'])
+        sources.append((item['name'], isArray and item, makeValueSource(
+            item, specification,
+            maxCount if item['name'] in countLabels else None)))
+
+    def makeRecord(random):
+        record = {}
+        for name, arrayItem, source in sources:
+            if not arrayItem:
+                record[name] = source(random)
+                continue
+            count = arrayItem['count']
+            if count is None:
+                count = record.get(arrayItem['countLabel'], 0)
+            if not isStringType(arrayItem['type']):
+                record[name] = [source(random) for element in range(count)]
+            elif arrayItem['type'] == 'pascal':
+                record[name] = ''.join([source(random)
+                                        for letter in range(count - 1)])
+            else:
+                record[name] = ''.join([source(random)
+                                        for letter in range(count)])
+        return record
+    return makeRecord
+
+
+def _startGenerator(specification, packetNames, seed):
+    """
+    Readies a process to generate chunks of a capture.
+
+    Args:
+        specification (dict): The specification object.
+        packetNames (list):   The packets to generate.
+        seed (int):           The seed for the whole capture.
+    """
+    codec = loadCodec(specification)
+    layouts = {}
+    _generator.clear()
+    _generator.update({
+        'codec': codec,
+        'makers': [(makeRecordSource(packetName, specification, layouts),
+                    getattr(codec, 'pack_' + packetName))
+                   for packetName in packetNames],
+        'seed': seed
+    })
+
+
+def generateChunk(job):
+    """
+    Generates a single chunk of a capture.
+
+    Records are made a batch at a time and packed together. The
+    chunk ends with the first packet reaching its size, so it
+    holds only whole packets.
+
+    Args:
+        job (tuple): The position of the chunk in the capture
+                     and its size in bytes.
+
+    Returns:
+        A tuple of the number of packets and the packed bytes.
+    """
+    chunkNum, chunkSize = job
+    random = Random(_generator['seed'] * 1000003 + chunkNum)
+    makers = _generator['makers']
+    pieces = []
+    size = 0
+    packetCount = 0
+    while size < chunkSize:
+        batch = []
+        for recordNum in range(batchSize):
+            makeRecord, packRecord = random.choice(makers)
+            batch.append(packRecord(makeRecord(random)))
+            size += len(batch[-1])
+            if size >= chunkSize:
+                break
+        pieces.append(b''.join(batch))
+        packetCount += len(batch)
+    return (packetCount, b''.join(pieces))
+
+
+def writeCapture(specification, packetNames, totalSize, outFile, seed=0,
+                 processes=1, chunkSize=defaultChunkSize):
+    """
+    Writes a capture of random valid packets.
+
+    Args:
+        specification (dict): The specification object.
+        packetNames (list):   The packets to generate; more than
+                              one gives a mixed stream.
+        totalSize (int):      The size of the capture in bytes,
+                              which is rounded up to whole packets.
+        outFile (file):       A file-like object to write it to.
+        seed (int):           Seed for the random values.
+        processes (int):      How many processes generate chunks.
+        chunkSize (int):      How many bytes each job generates.
+
+    Returns:
+        A tuple of the number of packets and bytes written.
+
+    Examples:
+        >>> from io import BytesIO
+        >>> from bench import specifications
+        >>> outFile = BytesIO()
+        >>> writeCapture(specifications['flat'], ['reading'], 1000,
+        ...              outFile, chunkSize=300)
+        (34, 1054)
+        >>> again = BytesIO()
+        >>> writeCapture(specifications['flat'], ['reading'], 1000,
+        ...              again, chunkSize=300)[1]
+        1054
+        >>> outFile.getvalue() == again.getvalue()
+        True
+    """
+    assert hasattr(outFile, 'write')
+    jobs = [(chunkNum, min(chunkSize, totalSize - chunkNum * chunkSize))
+            for chunkNum in range(max(1, -(-totalSize // chunkSize)))]
+    initArgs = (specification, packetNames, seed)
+    pool = None
+    if processes > 1 and len(jobs) > 1:
+        pool = Pool(processes, _startGenerator, initArgs)
+        chunks = pool.imap(generateChunk, jobs)
+    else:
+        _startGenerator(*initArgs)
+        chunks = (generateChunk(job) for job in jobs)
+    packetCount = byteCount = 0
+    try:
+        for chunkPackets, chunk in chunks:
+            outFile.write(chunk)
+            packetCount += chunkPackets
+            byteCount += len(chunk)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return (packetCount, byteCount)
+
+
+def parseArguments(args=None):
+    """
+    Parse command-line arguments
+
+    Examines the given command-line arguments and returns
+    an object containing the relevant arguments.
+
+    Args:
+        args (list): The command-line arguments to parse.
+
+    Returns:
+        A Namespace object with all the appropriately parsed
+        relevant arguments.
+
+    Examples:
+        >>> parseArguments(['-s', 'my.json', '-p', 'a', 'b']) == Namespace(
+        ...     chunkMegabytes=16, gigabytes=1.0, output='capture.bin',
+        ...     packets=['a', 'b'], processes=None, seed=0,
+        ...     specification='my.json')
+        True
+    """
+    assert args is None or isinstance(args, list)
+    parser = ArgumentParser(
+        description="Write a capture file of random but valid binary " +
+        "packets for load testing."
+    )
+    parser.add_argument(
+        '--specification', '-s', default='specification.json',
+        help='Specification file defining binary packet formats; ' +
+        'specification.json by default.'
+    )
+    parser.add_argument(
+        '--packets', '-p', nargs='+',
+        help='Packets to generate, mixed at random if more than one; ' +
+        'all those not marked intermediate by default.'
+    )
+    parser.add_argument(
+        '--gigabytes', '-g', type=float, default=1.0,
+        help='Size of the capture in gigabytes; 1 by default.'
+    )
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed for the random values; 0 by default.'
+    )
+    parser.add_argument(
+        '--processes', '-j', type=int,
+        help='Processes generating the capture; one per CPU by default.'
+    )
+    parser.add_argument(
+        '--chunk-megabytes', type=int, default=16, dest='chunkMegabytes',
+        help='Megabytes generated by each job; 16 by default.'
+    )
+    parser.add_argument(
+        '--output', '-o', default='capture.bin',
+        help='File to write the capture to; capture.bin by default.'
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    """
+    The main routine when run from the command line.
+
+    Loads the specification and writes out the capture.
+    """
+    args = parseArguments()
+    try:
+        with open(args.specification) as specificationFile:
+            specification = loadJson(specificationFile,
+                                     object_pairs_hook=OrderedDict)
+    except EnvironmentError as envErr:
+        giveUp("Specification environment error", envErr)
+    except JSONDecodeError as jsonErr:
+        giveUp("Specification JSON decode error", jsonErr)
+    packetNames = args.packets or [
+        packetName for packetName, packet in
+        specification['packets'].items() if not packet.get('intermediate')]
+    for packetName in packetNames:
+        if packetName not in specification['packets']:
+            giveUp("Unknown packet", KeyError(packetName))
+    try:
+        with open(args.output, 'wb') as outFile:
+            packetCount, byteCount = writeCapture(
+                specification, packetNames, int(args.gigabytes * 2 ** 30),
+                outFile, args.seed, args.processes or cpu_count(),
+                args.chunkMegabytes * 2 ** 20)
+    except EnvironmentError as envErr:
+        giveUp("Output environment error", envErr)
+    print("Wrote {} packets in {} bytes to {}.".format(
+          packetCount, byteCount, args.output))
+
+
+# Execute the following when run from the command line.
+if __name__ == "__main__":
+    main()
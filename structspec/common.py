@@ -7,6 +7,7 @@ This file includes a handful of routines of general use that
 are needed by multiple portions of structspec.
 """
 
+from collections import OrderedDict
 from sys import exit
 from os import linesep
 from six import string_types
@@ -310,6 +311,664 @@ def getJsonPointer():
     return resolveJsonPointer
 
 
+resolveJsonPointer = getJsonPointer()
+
+
+def getTypeName(typeRef):
+    """
+    Gets the bare name of a type.
+
+    Given a type as found in a specification returns its name,
+    stripping the leading portion of any JSON Pointer.
+
+    Args:
+        typeRef (str): The type or JSON Pointer to a type.
+
+    Returns:
+        The name of the type.
+
+    Examples:
+        >>> getTypeName('uint16_t')
+        'uint16_t'
+        >>> getTypeName('#/packets/header')
+        'header'
+    """
+    if typeRef.startswith('#/'):
+        return typeRef[typeRef.rfind('/') + 1:]
+    return typeRef
+
+
+def isEnumType(typeRef):
+    """
+    Determines whether or not a type refers to an enumeration.
+
+    Args:
+        typeRef (str): The type or JSON Pointer to a type.
+
+    Returns:
+        True if it points at an enumeration, False otherwise.
+
+    Examples:
+        >>> isEnumType('#/enums/Kind')
+        True
+        >>> isEnumType('#/packets/header')
+        False
+        >>> isEnumType('uint8_t')
+        False
+    """
+    return typeRef.startswith('#/enums/')
+
+
+def getEnumType(typeRef, specification):
+    """
+    Gets the type used to hold the values of an enumeration.
+
+    Args:
+        typeRef (str):        The JSON Pointer to the enumeration.
+        specification (dict): The specification object.
+
+    Returns:
+        The name of the type, int if none was given.
+
+    Examples:
+        >>> spec = {'enums': {'Kind': {'type': 'uint8_t'}, 'Other': {}}}
+        >>> getEnumType('#/enums/Kind', spec)
+        'uint8_t'
+        >>> getEnumType('#/enums/Other', spec)
+        'int'
+    """
+    enumeration = resolveJsonPointer(specification, typeRef[1:])
+    return str(enumeration.get('type', 'int'))
+
+
+def getEndianness(structure, packet, specification):
+    """
+    Determines the endianness of a structure item.
+
+    The endianness of an item is that given for the item itself,
+    failing that the one given for its packet, and failing that
+    the one given for the whole specification.
+
+    Args:
+        structure (dict):     The definition of the item.
+        packet (dict):        The definition of the packet.
+        specification (dict): The specification object.
+
+    Returns:
+        The name of the endianness or an empty string if none.
+
+    Examples:
+        >>> getEndianness({}, {}, {'endianness': 'big'})
+        'big'
+        >>> getEndianness({}, {'endianness': 'little'}, {'endianness': 'big'})
+        'little'
+        >>> getEndianness({'endianness': 'network'}, {}, {})
+        'network'
+        >>> getEndianness({}, {}, {})
+        ''
+    """
+    return str(structure.get('endianness', packet.get('endianness',
+               specification.get('endianness', ''))))
+
+
+def getLabel(reference):
+    """
+    Gets the label a size or count reference goes by.
+
+    Sizes and counts may be given as JSON Pointers to values; the
+    label is the name of the item holding the value.
+
+    Args:
+        reference (str): The size or count as given.
+
+    Returns:
+        The label for the reference.
+
+    Examples:
+        >>> getLabel('#/enums/Limits/options/MAX_LEN/value')
+        'MAX_LEN'
+        >>> getLabel('sampleCount')
+        'sampleCount'
+    """
+    if reference.startswith('#/'):
+        reference = reference[:-len(schemaVal)]
+        return reference[reference.rfind('/') + 1:]
+    return reference
+
+
+def getEnumValues(enumeration):
+    """
+    Gets the values of the options of an enumeration.
+
+    Options without a value of their own take the value after
+    that of the option before them, starting from zero.
+
+    Args:
+        enumeration (dict): The definition of the enumeration.
+
+    Returns:
+        An ordered dictionary mapping option names to values.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> enum = {'options': OrderedDict([
+        ...     ('RED', {}), ('GREEN', {'value': 4}), ('BLUE', {})])}
+        >>> list(getEnumValues(enum).items())
+        [('RED', 0), ('GREEN', 4), ('BLUE', 5)]
+    """
+    values = OrderedDict()
+    value = None
+    for optionName, option in enumeration['options'].items():
+        if 'value' in option:
+            value = option['value']
+        elif isinstance(value, int):
+            value += 1
+        else:
+            value = 0
+        values[str(optionName)] = value
+    return values
+
+
+def resolveCount(structure, packet, specification):
+    """
+    Determines the repeat count of a structure item.
+
+    Counts may be given directly, as JSON Pointers to constant
+    values, as the names of enumeration options, or as the name of
+    an earlier item of the same packet in which case the count is
+    only known once that item has been read.
+
+    Args:
+        structure (dict):     The definition of the item.
+        packet (dict):        The definition of the packet.
+        specification (dict): The specification object.
+
+    Returns:
+        A tuple containing the count (None if variable) and the
+        label of the item holding a variable count (None if fixed).
+
+    Examples:
+        >>> spec = {'enums': {'Limits': {'options': {'MAX': {'value': 4}}}}}
+        >>> packet = {'structure': {'n': {'type': 'uint8_t'}}}
+        >>> resolveCount({'type': 'char'}, packet, spec)
+        (1, None)
+        >>> resolveCount({'count': 3}, packet, spec)
+        (3, None)
+        >>> resolveCount({'count': '12'}, packet, spec)
+        (12, None)
+        >>> resolveCount({'count': '#/enums/Limits/options/MAX/value'},
+        ...              packet, spec)
+        (4, None)
+        >>> resolveCount({'count': 'MAX'}, packet, spec)
+        (4, None)
+        >>> resolveCount({'count': 'n'}, packet, spec)
+        (None, 'n')
+    """
+    count = structure.get('count', 1)
+    if isinstance(count, int):
+        return (count, None)
+    if count.isdigit():
+        return (int(count), None)
+    if count.startswith('#/'):
+        try:
+            return (int(resolveJsonPointer(specification, count[1:])), None)
+        except Exception:
+            pass
+    label = str(getLabel(count))
+    if label not in packet.get('structure', {}):
+        for enumeration in specification.get('enums', {}).values():
+            option = enumeration['options'].get(label, {})
+            if isinstance(option.get('value', None), int):
+                return (option['value'], None)
+    return (None, label)
+
+
+def resolveConstraint(constraint, specification):
+    """
+    Determines the value of a min or max constraint.
+
+    Constraints may be given directly, as JSON Pointers to
+    constant values or as the names of enumeration options.
+
+    Args:
+        constraint:           The constraint as given.
+        specification (dict): The specification object.
+
+    Returns:
+        The value of the constraint, or the constraint unchanged
+        if it is an expression that could not be resolved.
+
+    Examples:
+        >>> spec = {'enums': {'Limits': {'options': {'MAX': {'value': 9}}}}}
+        >>> resolveConstraint(3, spec)
+        3
+        >>> resolveConstraint('#/enums/Limits/options/MAX/value', spec)
+        9
+        >>> resolveConstraint('MAX', spec)
+        9
+        >>> resolveConstraint('MAX - 1', spec)
+        'MAX - 1'
+    """
+    if not isinstance(constraint, string_types):
+        return constraint
+    if constraint.startswith('#/'):
+        try:
+            return resolveJsonPointer(specification, constraint[1:])
+        except Exception:
+            pass
+    label = str(getLabel(constraint))
+    for enumeration in specification.get('enums', {}).values():
+        values = getEnumValues(enumeration)
+        if label in values:
+            return values[label]
+    return constraint
+
+
+def resolveMembers(member, specification):
+    """
+    Determines the values permitted by a member constraint.
+
+    Members may be given as a list of values or as a JSON Pointer
+    to such a list or to an enumeration, in which case the values
+    of all its options are permitted.
+
+    Args:
+        member:               The member constraint as given.
+        specification (dict): The specification object.
+
+    Returns:
+        A list of the permitted values.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'enums': {'Kind': {'options': OrderedDict([
+        ...     ('A', {'value': 1}), ('B', {})])}}}
+        >>> resolveMembers([1, 2, 4], spec)
+        [1, 2, 4]
+        >>> resolveMembers('#/enums/Kind', spec)
+        [1, 2]
+        >>> resolveMembers('#/enums/Kind/options', spec)
+        [1, 2]
+    """
+    if not isinstance(member, string_types):
+        return list(member)
+    target = resolveJsonPointer(specification, member[1:])
+    if isinstance(target, dict):
+        if 'options' not in target:
+            target = {'options': target}
+        return list(getEnumValues(target).values())
+    return list(target)
+
+
+def resolveBitSize(structure, specification):
+    """
+    Determines the size in bits given for a structure item.
+
+    Args:
+        structure (dict):     The definition of the item.
+        specification (dict): The specification object.
+
+    Returns:
+        The explicitly given size in bits or None if no size
+        was given (or it could not be determined).
+
+    Examples:
+        >>> resolveBitSize({'size': 3}, {})
+        3
+        >>> resolveBitSize({'size': '5'}, {})
+        5
+        >>> resolveBitSize({'size': '#/enums/E/options/W/value'},
+        ...                {'enums': {'E': {'options': {'W': {'value': 7}}}}})
+        7
+        >>> resolveBitSize({}, {}) is None
+        True
+    """
+    if 'size' not in structure:
+        return None
+    size = structure['size']
+    if isinstance(size, int):
+        return size
+    try:
+        if size.startswith('#/'):
+            return int(resolveJsonPointer(specification, size[1:]))
+        return int(size)
+    except Exception:
+        return None
+
+
+def isBitField(structure, specification):
+    """
+    Determines whether or not a structure item is a bitfield.
+
+    An item is a bitfield when it is given a size that is not the
+    natural size of its type or is not a whole number of bytes.
+
+    Args:
+        structure (dict):     The definition of the item.
+        specification (dict): The specification object.
+
+    Returns:
+        True if it is a bitfield, False otherwise.
+
+    Examples:
+        >>> isBitField({'type': 'uint8_t', 'size': 3}, {})
+        True
+        >>> isBitField({'type': 'uint16_t', 'size': 16}, {})
+        False
+        >>> isBitField({'type': 'uint16_t', 'size': 8}, {})
+        True
+        >>> isBitField({'type': 'uint16_t'}, {})
+        False
+    """
+    sizeInBits = resolveBitSize(structure, specification)
+    if sizeInBits is None and 'size' not in structure:
+        return False
+    typeName = structure['type']
+    if isEnumType(typeName):
+        typeName = getEnumType(typeName, specification)
+    return sizeInBits != typeSizes.get(typeName, -1) or \
+        not sizeInBits or sizeInBits % 8 != 0
+
+
+def getBitFieldContainerSize(bitFieldLen):
+    """
+    Determines the number of bytes holding a run of bitfields.
+
+    Args:
+        bitFieldLen (int): The total length of the run in bits.
+
+    Returns:
+        The size of the containing integer in bytes.
+
+    Examples:
+        >>> getBitFieldContainerSize(3)
+        1
+        >>> getBitFieldContainerSize(9)
+        2
+        >>> getBitFieldContainerSize(17)
+        4
+        >>> getBitFieldContainerSize(33)
+        8
+    """
+    for containerSize in (1, 2, 4):
+        if bitFieldLen <= containerSize * 8:
+            return containerSize
+    return 8
+
+
+def getPacketLayout(packetName, specification, layouts=None):
+    """
+    Determines the wire layout of a packet.
+
+    Walks the structure of the named packet and works out where
+    each of its items lives in the packed binary form. Consecutive
+    bitfields of the same endianness share a containing integer
+    sized to hold them all, with the first bitfield in the least
+    significant bits. Substructures are not expanded; see
+    flattenLayout for that.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of previously
+                              determined layouts by packet name.
+
+    Returns:
+        A list of dictionaries, one per item, giving its name,
+        type, kind ('field', 'bitfield', 'padding' or
+        'substructure'), byte offset (None when it follows a
+        variable-length item), element size in bytes (the
+        container size for bitfields), count, count label,
+        bit offset and bit size (for bitfields), endianness,
+        enumeration (for items typed by one) and original
+        definition.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'endianness': 'big', 'packets': OrderedDict([
+        ...     ('hdr', {'structure': OrderedDict([
+        ...         ('kind', {'type': 'uint8_t'}),
+        ...         ('len', {'type': 'uint16_t'})])}),
+        ...     ('msg', {'structure': OrderedDict([
+        ...         ('head', {'type': '#/packets/hdr'}),
+        ...         ('a', {'type': 'uint8_t', 'size': 3}),
+        ...         ('b', {'type': 'uint8_t', 'size': 6}),
+        ...         ('vals', {'type': 'int16_t', 'count': 2}),
+        ...         ('n', {'type': 'uint8_t'}),
+        ...         ('data', {'type': 'uint8_t', 'count': 'n'})])})])}
+        >>> for item in getPacketLayout('msg', spec):
+        ...     print('{name} {kind} {offset} {size} {count} {bitOffset}'.format(
+        ...           **item))
+        head substructure 0 3 1 None
+        a bitfield 3 2 1 0
+        b bitfield 3 2 1 3
+        vals field 5 2 2 None
+        n field 9 1 1 None
+        data field 10 1 None None
+    """
+    assert isinstance(specification, dict)
+    if layouts is not None and packetName in layouts:
+        return layouts[packetName]
+    packet = specification['packets'][packetName]
+    layout = []
+    offset = 0
+    bitFieldRun = []
+
+    def endBitFieldRun(offset):
+        if not bitFieldRun:
+            return offset
+        containerSize = getBitFieldContainerSize(
+            sum([item['bitSize'] for item in bitFieldRun]))
+        for item in bitFieldRun:
+            item['offset'] = offset
+            item['size'] = containerSize
+        del bitFieldRun[:]
+        if offset is None:
+            return None
+        return offset + containerSize
+
+    for structureName, structure in packet['structure'].items():
+        endianness = getEndianness(structure, packet, specification)
+        typeName = str(getTypeName(structure['type']))
+        enumName = None
+        if isEnumType(structure['type']):
+            enumName = typeName
+            typeName = getEnumType(structure['type'], specification)
+        count, countLabel = resolveCount(structure, packet, specification)
+        item = {
+            'name': str(structureName),
+            'type': typeName,
+            'enum': enumName,
+            'offset': offset,
+            'count': count,
+            'countLabel': countLabel,
+            'bitOffset': None,
+            'bitSize': None,
+            'endianness': endianness,
+            'structure': structure
+        }
+        if bitFieldRun and (not isBitField(structure, specification) or
+                            bitFieldRun[-1]['endianness'] != endianness or
+                            bitFieldRun[-1]['bitOffset'] +
+                            bitFieldRun[-1]['bitSize'] +
+                            (resolveBitSize(structure, specification) or 0) >
+                            64):
+            offset = item['offset'] = endBitFieldRun(offset)
+        if structure['type'].startswith('#/') and enumName is None:
+            item['kind'] = 'substructure'
+            item['size'] = getPacketSize(typeName, specification, layouts)
+        elif isBitField(structure, specification):
+            item['kind'] = 'bitfield'
+            item['bitSize'] = resolveBitSize(structure, specification) or 0
+            if bitFieldRun:
+                item['bitOffset'] = bitFieldRun[-1]['bitOffset'] + \
+                    bitFieldRun[-1]['bitSize']
+            else:
+                item['bitOffset'] = 0
+            bitFieldRun.append(item)
+        else:
+            item['kind'] = 'padding' if isPadding(typeName) else 'field'
+            item['size'] = typeSizes.get(typeName, 0) // 8
+        layout.append(item)
+        if item['kind'] != 'bitfield' and offset is not None:
+            if item['size'] is None or item['count'] is None:
+                offset = None
+            else:
+                offset += item['size'] * item['count']
+    endBitFieldRun(offset)
+    if layouts is not None:
+        layouts[packetName] = layout
+    return layout
+
+
+def getPacketSize(packetName, specification, layouts=None):
+    """
+    Determines the packed size of a packet.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of previously
+                              determined layouts by packet name.
+
+    Returns:
+        The size of the packet in bytes, or None if its size
+        varies from packet to packet.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': {
+        ...     'fixed': {'structure': OrderedDict([
+        ...         ('a', {'type': 'uint32_t'}),
+        ...         ('b', {'type': 'uint8_t', 'size': 4}),
+        ...         ('c', {'type': 'char', 'count': 6})])},
+        ...     'varying': {'structure': OrderedDict([
+        ...         ('n', {'type': 'uint8_t'}),
+        ...         ('c', {'type': 'char', 'count': 'n'})])}}}
+        >>> getPacketSize('fixed', spec)
+        11
+        >>> getPacketSize('varying', spec) is None
+        True
+    """
+    layout = getPacketLayout(packetName, specification, layouts)
+    if not layout:
+        return 0
+    last = layout[-1]
+    if last['offset'] is None or last['size'] is None or \
+            last['count'] is None:
+        return None
+    return last['offset'] + last['size'] * last['count']
+
+
+def flattenLayout(packetName, specification, layouts=None):
+    """
+    Determines the wire layout of a packet down to its leaves.
+
+    Like getPacketLayout but with every substructure replaced by
+    the items it contains, named with dotted paths and placed at
+    their offsets within the outer packet.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of previously
+                              determined layouts by packet name.
+
+    Returns:
+        A list of dictionaries as given by getPacketLayout, but
+        without any substructure items.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': OrderedDict([
+        ...     ('hdr', {'structure': OrderedDict([
+        ...         ('kind', {'type': 'uint8_t'}),
+        ...         ('len', {'type': 'uint16_t'})])}),
+        ...     ('msg', {'structure': OrderedDict([
+        ...         ('ts', {'type': 'uint32_t'}),
+        ...         ('head', {'type': '#/packets/hdr'})])})])}
+        >>> [(item['name'], item['offset'])
+        ...  for item in flattenLayout('msg', spec)]
+        [('ts', 0), ('head.kind', 4), ('head.len', 5)]
+    """
+    leaves = []
+    for item in getPacketLayout(packetName, specification, layouts):
+        if item['kind'] != 'substructure':
+            leaves.append(item)
+            continue
+        for subItem in flattenLayout(item['type'], specification, layouts):
+            subItem = dict(subItem)
+            subItem['name'] = '{}.{}'.format(item['name'], subItem['name'])
+            if item['offset'] is None or subItem['offset'] is None:
+                subItem['offset'] = None
+            else:
+                subItem['offset'] += item['offset']
+            leaves.append(subItem)
+    return leaves
+
+
+def getFieldOffsets(packetName, specification, layouts=None):
+    """
+    Determines where every field of a packet lives on the wire.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of previously
+                              determined layouts by packet name.
+
+    Returns:
+        An ordered dictionary keyed by the dotted names of all the
+        fields and substructures of the packet (nested ones too),
+        each giving its byte offset, a tuple of the byte offset of
+        its container and its bit offset within it for bitfields,
+        or None if it follows an item of variable size.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': OrderedDict([
+        ...     ('hdr', {'structure': OrderedDict([
+        ...         ('kind', {'type': 'uint8_t', 'size': 3}),
+        ...         ('flag', {'type': 'uint8_t', 'size': 1}),
+        ...         ('len', {'type': 'uint16_t'})])}),
+        ...     ('msg', {'structure': OrderedDict([
+        ...         ('ts', {'type': 'uint32_t'}),
+        ...         ('head', {'type': '#/packets/hdr'}),
+        ...         ('data', {'type': 'uint8_t', 'count': 'ts'}),
+        ...         ('crc', {'type': 'uint16_t'})])})])}
+        >>> for name, offset in getFieldOffsets('msg', spec).items():
+        ...     print('{} {}'.format(name, offset))
+        ts 0
+        head 4
+        head.kind (4, 0)
+        head.flag (4, 3)
+        head.len 5
+        data 7
+        crc None
+    """
+    offsets = OrderedDict()
+    for item in getPacketLayout(packetName, specification, layouts):
+        if item['kind'] == 'padding':
+            continue
+        offset = item['offset']
+        if item['kind'] == 'bitfield' and offset is not None:
+            offsets[item['name']] = (offset, item['bitOffset'])
+        else:
+            offsets[item['name']] = offset
+        if item['kind'] != 'substructure':
+            continue
+        for subName, subOffset in getFieldOffsets(
+                item['type'], specification, layouts).items():
+            if offset is None or subOffset is None:
+                subOffset = None
+            elif isinstance(subOffset, tuple):
+                subOffset = (offset + subOffset[0], subOffset[1])
+            else:
+                subOffset += offset
+            offsets['{}.{}'.format(item['name'], subName)] = subOffset
+    return offsets
+
+
 def giveUp(category, err):
     """
     Aborts the program with a useful message.
@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Indexed packet containers
+
+Stores a recorded stream of packets in blocks that can each be found,
+checked and decoded on their own, so that a reader can go straight
+to the packets it wants rather than scanning the whole stream.
+
+A container is laid out as:
+
+    header  'SSPC', the format version, the format of the packets'
+            keys and the specification id, version and SHA-256 hash
+            of its content
+    blocks  whole packets back to back up to a set size, each block
+            compressed or not on its own
+    index   for each block its offset, stored and unpacked sizes,
+            compression, CRC-32 of the unpacked data, packet count
+            and smallest and largest packet keys
+    footer  the offset and CRC-32 of the index and 'SSPE'
+
+All numbers are little-endian. Keys (such as timestamps) are given
+by the writer for each packet; blocks covering a range of keys are
+found from the index alone.
+"""
+
+from binascii import crc32
+from bz2 import compress as bz2Compress, decompress as bz2Decompress
+from hashlib import sha256
+from json import dumps as dumpJsonString
+from struct import calcsize, pack, unpack, unpack_from
+from zlib import compress as zlibCompress, decompress as zlibDecompress
+try:
+    from lzma import compress as lzmaCompress, \
+        decompress as lzmaDecompress
+except ImportError:
+    lzmaCompress = lzmaDecompress = None
+
+containerMagic = b'SSPC'
+footerMagic = b'SSPE'
+formatVersion = 1
+
+# The fixed part of the header: magic, format version, key format
+# and the lengths of the specification id and version that follow
+headerFmt = '<4sHcxHH'
+hashSize = 32
+
+# Each index entry: offset, stored size, unpacked size, compression,
+# CRC-32, packet count and smallest and largest keys (whose format
+# is filled in from the header)
+indexEntryFmt = '<QIIBIQ{0}{0}'
+
+# The footer: index offset, index CRC-32 and magic
+footerFmt = '<QI4s'
+
+# The codes, compressors and decompressors for each compression
+compressions = {
+    None: (0, None, None),
+    'zlib': (1, zlibCompress, zlibDecompress),
+    'bz2': (2, bz2Compress, bz2Decompress),
+    'lzma': (3, lzmaCompress, lzmaDecompress)
+}
+decompressors = dict((code, decompress) for code, compress, decompress
+                     in compressions.values())
+
+# The default amount of packet data in each block, in bytes
+defaultBlockSize = 1 << 20
+
+
+def getSpecificationHash(specification):
+    """
+    Hashes the content of a specification.
+
+    The hash does not depend on the order of keys or the layout of
+    the file the specification came from.
+
+    Args:
+        specification (dict): The specification object.
+
+    Returns:
+        The SHA-256 digest of the specification.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> getSpecificationHash({'id': 'a', 'title': 'b'}) == \\
+        ...     getSpecificationHash(OrderedDict([('title', 'b'),
+        ...                                       ('id', 'a')]))
+        True
+    """
+    return sha256(dumpJsonString(specification, sort_keys=True,
+                                 separators=(',', ':')).encode('utf8')
+                  ).digest()
+
+
+def getChecksum(rawData):
+    """
+    Gets the CRC-32 used to check a block or the index.
+
+    Examples:
+        >>> getChecksum(b'123456789') == 0xcbf43926
+        True
+    """
+    return crc32(rawData) & 0xffffffff
+
+
+class ContainerWriter(object):
+    """
+    Writes packets into a container.
+
+    Examples:
+        >>> from io import BytesIO
+        >>> outFile = BytesIO()
+        >>> writer = ContainerWriter(outFile, {'id': 'demo'}, 8, None)
+        >>> for key, packet in enumerate((b'abcd', b'efgh', b'ijkl')):
+        ...     writer.write(packet, key)
+        >>> writer.close()
+        >>> reader = ContainerReader(BytesIO(outFile.getvalue()))
+        >>> len(reader.blocks), reader.specificationId == 'demo'
+        (2, True)
+        >>> reader.readBlock(1) == b'ijkl'
+        True
+    """
+
+    def __init__(self, outFile, specification, blockSize=defaultBlockSize,
+                 compression='zlib', keyFormat='q'):
+        """
+        Starts a container, writing its header.
+
+        Args:
+            outFile (file):       A binary file to write to.
+            specification (dict): The specification of the packets.
+            blockSize (int):      The most packet data to put in a
+                                  block, unless a single packet is
+                                  bigger.
+            compression (str):    How to compress blocks: 'zlib',
+                                  'bz2', 'lzma' or None. A block is
+                                  only stored compressed if that
+                                  makes it smaller.
+            keyFormat (str):      The struct format character of the
+                                  packets' keys.
+
+        Raises:
+            ValueError: If the compression is unknown or unavailable.
+        """
+        if compression not in compressions or \
+                compressions[compression][1] is None and \
+                compression is not None:
+            raise ValueError('Unsupported compression {}'.format(
+                compression))
+        self.outFile = outFile
+        self.blockSize = blockSize
+        self.compressionCode, self.compress = compressions[compression][:2]
+        self.keyFormat = keyFormat
+        self.indexEntryFmt = indexEntryFmt.format(keyFormat)
+        specificationId = str(specification.get('id', '')).encode('utf8')
+        version = str(specification.get('version', '')).encode('utf8')
+        self.outFile.write(pack(headerFmt, containerMagic, formatVersion,
+                                keyFormat.encode('ascii'),
+                                len(specificationId), len(version)))
+        self.outFile.write(specificationId)
+        self.outFile.write(version)
+        self.outFile.write(getSpecificationHash(specification))
+        self.position = calcsize(headerFmt) + len(specificationId) + \
+            len(version) + hashSize
+        self.packets = []
+        self.pendingSize = 0
+        self.minKey = self.maxKey = None
+        self.index = []
+
+    def write(self, rawData, key=0):
+        """
+        Adds a packed packet to the container.
+
+        Args:
+            rawData (bytes): The packed packet.
+            key:             The packet's key, such as its timestamp.
+        """
+        if self.packets and self.pendingSize + len(rawData) > self.blockSize:
+            self.flush()
+        self.packets.append(rawData)
+        self.pendingSize += len(rawData)
+        if self.minKey is None or key < self.minKey:
+            self.minKey = key
+        if self.maxKey is None or key > self.maxKey:
+            self.maxKey = key
+
+    def flush(self):
+        """Writes out the packets given so far as a block."""
+        if not self.packets:
+            return
+        rawData = b''.join(self.packets)
+        compressionCode = 0
+        stored = rawData
+        if self.compress is not None:
+            compressed = self.compress(rawData)
+            if len(compressed) < len(rawData):
+                compressionCode = self.compressionCode
+                stored = compressed
+        self.outFile.write(stored)
+        self.index.append(pack(self.indexEntryFmt, self.position,
+                               len(stored), len(rawData), compressionCode,
+                               getChecksum(rawData), len(self.packets),
+                               self.minKey, self.maxKey))
+        self.position += len(stored)
+        self.packets = []
+        self.pendingSize = 0
+        self.minKey = self.maxKey = None
+
+    def close(self):
+        """Finishes the container, writing its index and footer."""
+        self.flush()
+        index = pack('<Q', len(self.index)) + b''.join(self.index)
+        self.outFile.write(index)
+        self.outFile.write(pack(footerFmt, self.position,
+                                getChecksum(index), footerMagic))
+        self.index = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+
+class ContainerReader(object):
+    """
+    Reads packets from a container.
+
+    Only the header, footer and index are read on opening; each
+    block is read when asked for.
+    """
+
+    def __init__(self, inFile, specification=None):
+        """
+        Opens a container.
+
+        Args:
+            inFile (file):        A binary file to read from, which
+                                  must be able to seek.
+            specification (dict): The specification the packets
+                                  should follow; if given its hash
+                                  must match the container's.
+
+        Raises:
+            ValueError: If the file is not a container, is damaged
+                        or does not match the specification.
+        """
+        self.inFile = inFile
+        headerSize = calcsize(headerFmt)
+        header = inFile.read(headerSize)
+        if len(header) < headerSize:
+            raise ValueError('Not a packet container')
+        (magic, version, keyFormat, idLength, versionLength
+         ) = unpack(headerFmt, header)
+        if magic != containerMagic:
+            raise ValueError('Not a packet container')
+        if version > formatVersion:
+            raise ValueError('Unsupported container version {}'.format(
+                version))
+        self.keyFormat = keyFormat.decode('ascii')
+        self.specificationId = inFile.read(idLength).decode('utf8')
+        self.specificationVersion = inFile.read(versionLength).decode('utf8')
+        self.specificationHash = inFile.read(hashSize)
+        if specification is not None and self.specificationHash != \
+                getSpecificationHash(specification):
+            raise ValueError('Container does not match specification {}'
+                             .format(specification.get('id', '')))
+        footerSize = calcsize(footerFmt)
+        inFile.seek(-footerSize, 2)
+        indexOffset, indexChecksum, magic = unpack(footerFmt,
+                                                   inFile.read(footerSize))
+        if magic != footerMagic:
+            raise ValueError('Packet container is incomplete')
+        indexEnd = inFile.tell() - footerSize
+        inFile.seek(indexOffset)
+        index = inFile.read(indexEnd - indexOffset)
+        if getChecksum(index) != indexChecksum:
+            raise ValueError('Packet container index is damaged')
+        entryFmt = indexEntryFmt.format(self.keyFormat)
+        entrySize = calcsize(entryFmt)
+        self.blocks = []
+        for entryNum in range(unpack_from('<Q', index)[0]):
+            (offset, storedSize, size, compression, checksum, count,
+             minKey, maxKey) = unpack_from(entryFmt, index,
+                                           8 + entryNum * entrySize)
+            self.blocks.append({
+                'offset': offset,
+                'storedSize': storedSize,
+                'size': size,
+                'compression': compression,
+                'checksum': checksum,
+                'count': count,
+                'minKey': minKey,
+                'maxKey': maxKey
+            })
+
+    def findBlocks(self, start=None, end=None):
+        """
+        Finds the blocks that may hold packets with keys in a range.
+
+        Args:
+            start: The smallest key wanted; unlimited if None.
+            end:   The largest key wanted; unlimited if None.
+
+        Returns:
+            A list of the numbers of those blocks.
+        """
+        return [blockNum for blockNum, block in enumerate(self.blocks)
+                if (start is None or block['maxKey'] >= start) and
+                (end is None or block['minKey'] <= end)]
+
+    def readBlock(self, blockNum):
+        """
+        Reads a block and checks it.
+
+        Args:
+            blockNum (int): The number of the block.
+
+        Returns:
+            The packets in the block, back to back.
+
+        Raises:
+            ValueError: If the block is damaged or compressed in a
+                        way not supported here.
+        """
+        block = self.blocks[blockNum]
+        self.inFile.seek(block['offset'])
+        return decodeBlock(self.inFile.read(block['storedSize']), block)
+
+    def readPackets(self, blockNum, unpackInto):
+        """
+        Unpacks the packets in a block.
+
+        Args:
+            blockNum (int):        The number of the block.
+            unpackInto (function): A function unpacking a packet from
+                                   a buffer at an offset into a record
+                                   and giving its size, such as a
+                                   generated unpack_<packet>_into.
+
+        Returns:
+            A list of the packets as dictionaries.
+        """
+        rawData = self.readBlock(blockNum)
+        packets = []
+        position = 0
+        while position < len(rawData):
+            packet = {}
+            position += unpackInto(rawData, position, packet)
+            packets.append(packet)
+        return packets
+
+    def verify(self):
+        """
+        Checks every block without unpacking any packets.
+
+        Returns:
+            A list of the numbers of any damaged blocks.
+        """
+        damaged = []
+        for blockNum in range(len(self.blocks)):
+            try:
+                self.readBlock(blockNum)
+            except ValueError:
+                damaged.append(blockNum)
+        return damaged
+
+
+def decodeBlock(stored, block):
+    """
+    Decompresses and checks a block as stored.
+
+    Being a plain function this can be used to decode blocks in
+    other processes given the entries from a reader's index.
+
+    Args:
+        stored (bytes): The block as stored in the container.
+        block (dict):   The block's index entry.
+
+    Returns:
+        The packets in the block, back to back.
+
+    Raises:
+        ValueError: If the block is damaged or compressed in a way
+                    not supported here.
+
+    Examples:
+        >>> block = {'compression': 0, 'size': 3,
+        ...          'checksum': getChecksum(b'abc')}
+        >>> decodeBlock(b'abc', block) == b'abc'
+        True
+        >>> decodeBlock(b'abd', block)
+        Traceback (most recent call last):
+        ValueError: Packet container block is damaged
+    """
+    decompress = decompressors.get(block['compression'], False)
+    if decompress is None and block['compression']:
+        raise ValueError('Unsupported block compression {}'.format(
+            block['compression']))
+    if decompress is False:
+        raise ValueError('Packet container block is damaged')
+    try:
+        rawData = stored if decompress is None else decompress(stored)
+    except Exception:
+        raise ValueError('Packet container block is damaged')
+    if len(rawData) != block['size'] or \
+            getChecksum(rawData) != block['checksum']:
+        raise ValueError('Packet container block is damaged')
+    return rawData
+
+
+# Execute the following when run from the command line.
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
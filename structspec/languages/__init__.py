@@ -2,5 +2,5 @@
 """
 Here is where the language-specific implementations belong.
 """
-__all__ = ["c", "python"]
+__all__ = ["c", "cpython", "pyctypes", "python"]
 
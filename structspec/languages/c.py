@@ -10,7 +10,8 @@ binary format in the C programming language.
 from os.path import basename
 from zope.interface import moduleProvides
 from structspec.common import writeOut, writeOutBlock, giveUp,\
-    getJsonPointer, schemaVal, typeSizes
+    getJsonPointer, schemaVal, typeSizes, isStringType, isFloatType, \
+    isBooleanType, getLabel, getPacketLayout, getPacketSize, getFieldOffsets
 from structspec.interfaces import ILanguage
 
 moduleProvides(ILanguage)
@@ -19,13 +20,606 @@ name = "C"
 filenameExtension = ('h', 'c')
 resolveJsonPointer = getJsonPointer()
 
+# Types the C header needs defined beyond those of standard C
+cTypedefs = (
+    ('boolean', 'uint8_t'),
+    ('int24_t', 'int32_t'),
+    ('uint24_t', 'uint32_t'),
+    ('hollerith', 'char'),
+    ('string', 'char'),
+    ('str', 'char'),
+    ('pascal', 'unsigned char'),
+    ('padding', 'uint8_t')
+)
+
+# Byte order helpers shared by all generated pack and unpack functions
+cHelpers = r'''#include <string.h>
+
+#if defined(__BYTE_ORDER__) && __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+#define STRUCTSPEC_HOST_BIG_ENDIAN 1
+#else
+#define STRUCTSPEC_HOST_BIG_ENDIAN 0
+#endif
+#define STRUCTSPEC_SWAP_BIG (!STRUCTSPEC_HOST_BIG_ENDIAN)
+#define STRUCTSPEC_SWAP_LITTLE STRUCTSPEC_HOST_BIG_ENDIAN
+
+#if defined(_MSC_VER)
+#include <stdlib.h>
+#define STRUCTSPEC_BSWAP16(x) _byteswap_ushort(x)
+#define STRUCTSPEC_BSWAP32(x) _byteswap_ulong(x)
+#define STRUCTSPEC_BSWAP64(x) _byteswap_uint64(x)
+#else
+#define STRUCTSPEC_BSWAP16(x) __builtin_bswap16(x)
+#define STRUCTSPEC_BSWAP32(x) __builtin_bswap32(x)
+#define STRUCTSPEC_BSWAP64(x) __builtin_bswap64(x)
+#endif
+
+static inline uint16_t structspec_get16(const uint8_t *p, int swap)
+{
+  uint16_t v;
+  memcpy(&v, p, sizeof(v));
+  return swap ? STRUCTSPEC_BSWAP16(v) : v;
+}
+
+static inline uint32_t structspec_get32(const uint8_t *p, int swap)
+{
+  uint32_t v;
+  memcpy(&v, p, sizeof(v));
+  return swap ? STRUCTSPEC_BSWAP32(v) : v;
+}
+
+static inline uint64_t structspec_get64(const uint8_t *p, int swap)
+{
+  uint64_t v;
+  memcpy(&v, p, sizeof(v));
+  return swap ? STRUCTSPEC_BSWAP64(v) : v;
+}
+
+static inline uint32_t structspec_get24(const uint8_t *p, int bigEndian)
+{
+  if (bigEndian)
+    return ((uint32_t)p[0] << 16) | ((uint32_t)p[1] << 8) | p[2];
+  return ((uint32_t)p[2] << 16) | ((uint32_t)p[1] << 8) | p[0];
+}
+
+static inline int32_t structspec_sext24(uint32_t v)
+{
+  return (int32_t)((v ^ 0x800000u) - 0x800000u);
+}
+
+static inline void structspec_put16(uint8_t *p, uint16_t v, int swap)
+{
+  if (swap)
+    v = STRUCTSPEC_BSWAP16(v);
+  memcpy(p, &v, sizeof(v));
+}
+
+static inline void structspec_put32(uint8_t *p, uint32_t v, int swap)
+{
+  if (swap)
+    v = STRUCTSPEC_BSWAP32(v);
+  memcpy(p, &v, sizeof(v));
+}
+
+static inline void structspec_put64(uint8_t *p, uint64_t v, int swap)
+{
+  if (swap)
+    v = STRUCTSPEC_BSWAP64(v);
+  memcpy(p, &v, sizeof(v));
+}
+
+static inline void structspec_put24(uint8_t *p, uint32_t v, int bigEndian)
+{
+  if (bigEndian) {
+    p[0] = (uint8_t)(v >> 16);
+    p[1] = (uint8_t)(v >> 8);
+    p[2] = (uint8_t)v;
+  } else {
+    p[0] = (uint8_t)v;
+    p[1] = (uint8_t)(v >> 8);
+    p[2] = (uint8_t)(v >> 16);
+  }
+}'''
+
+
+def getSwapExpr(endianness):
+    """
+    Gets the C expression telling whether to swap bytes.
+
+    Args:
+        endianness (str): The endianness of the data on the wire.
+
+    Returns:
+        A C expression that is true when the host byte order
+        differs from the wire byte order.
+
+    Examples:
+        >>> getSwapExpr('big')
+        'STRUCTSPEC_SWAP_BIG'
+        >>> getSwapExpr('network')
+        'STRUCTSPEC_SWAP_BIG'
+        >>> getSwapExpr('little')
+        'STRUCTSPEC_SWAP_LITTLE'
+        >>> getSwapExpr('native')
+        '0'
+    """
+    if endianness in ('big', 'network'):
+        return 'STRUCTSPEC_SWAP_BIG'
+    elif endianness == 'little':
+        return 'STRUCTSPEC_SWAP_LITTLE'
+    return '0'
+
+
+def getBigEndianExpr(endianness):
+    """
+    Gets the C expression telling whether data is big endian.
+
+    Args:
+        endianness (str): The endianness of the data on the wire.
+
+    Returns:
+        A C expression that is true for big endian wire data.
+
+    Examples:
+        >>> getBigEndianExpr('network')
+        '1'
+        >>> getBigEndianExpr('little')
+        '0'
+        >>> getBigEndianExpr('')
+        'STRUCTSPEC_HOST_BIG_ENDIAN'
+    """
+    if endianness in ('big', 'network'):
+        return '1'
+    elif endianness == 'little':
+        return '0'
+    return 'STRUCTSPEC_HOST_BIG_ENDIAN'
+
+
+def isCodecType(typeName):
+    """
+    Determines whether generated C code can pack a type.
+
+    Args:
+        typeName (str): The name of the type to be checked.
+
+    Returns:
+        True if pack and unpack functions can handle it.
+
+    Examples:
+        >>> isCodecType('uint24_t')
+        True
+        >>> isCodecType('double')
+        True
+        >>> isCodecType('long double')
+        False
+        >>> isCodecType('pointer')
+        False
+    """
+    return typeName in typeSizes and \
+        typeName not in ('long double', 'pointer', 'void') and \
+        (typeSizes[typeName] // 8 in (1, 2, 3, 4, 8))
+
+
+def hasCodec(packetName, specification, layouts=None):
+    """
+    Determines whether C pack and unpack functions can be made.
+
+    Only packets of a fixed size built entirely of supported
+    types (directly or through their substructures) get them.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts,
+                              which also keeps the answer so
+                              deep substructure chains are
+                              only walked once.
+
+    Returns:
+        True if the packet can have pack and unpack functions.
+    """
+    if layouts is not None and ('codec', packetName) in layouts:
+        return layouts[('codec', packetName)]
+    codec = getPacketSize(packetName, specification, layouts) is not None
+    if codec:
+        for item in getPacketLayout(packetName, specification, layouts):
+            if item['kind'] == 'substructure':
+                codec = hasCodec(item['type'], specification, layouts)
+            else:
+                codec = isCodecType(item['type'])
+            if not codec:
+                break
+    if layouts is not None:
+        layouts[('codec', packetName)] = codec
+    return codec
+
+
+def getElementCode(item, element, position, packing):
+    """
+    Gets the C statement moving one value to or from the wire.
+
+    Args:
+        item (dict):     The layout of the structure item.
+        element (str):   The C lvalue for the value in the struct.
+        position (str):  The C expression for its wire address.
+        packing (bool):  True to pack into the buffer, False to
+                         unpack from it.
+
+    Returns:
+        A C statement.
+
+    Examples:
+        >>> item = {'type': 'uint16_t', 'size': 2, 'endianness': 'big'}
+        >>> getElementCode(item, 'packet->len', 'buffer + 1', False)
+        'packet->len = (uint16_t)structspec_get16(buffer + 1, STRUCTSPEC_SWAP_BIG);'
+        >>> getElementCode(item, 'packet->len', 'buffer + 1', True)
+        'structspec_put16(buffer + 1, (uint16_t)packet->len, STRUCTSPEC_SWAP_BIG);'
+        >>> item = {'type': 'int24_t', 'size': 3, 'endianness': 'little'}
+        >>> getElementCode(item, 'packet->s', 'buffer', False)
+        'packet->s = structspec_sext24(structspec_get24(buffer, 0));'
+    """
+    typeName = item['type']
+    size = item['size']
+    if isFloatType(typeName):
+        swap = getSwapExpr(item['endianness'])
+        if packing:
+            return '{{ uint{0}_t raw; memcpy(&raw, &{1}, {2}); ' \
+                'structspec_put{0}({3}, raw, {4}); }}'.format(
+                    size * 8, element, size, position, swap)
+        return '{{ uint{0}_t raw = structspec_get{0}({1}, {2}); ' \
+            'memcpy(&{3}, &raw, {4}); }}'.format(
+                size * 8, position, swap, element, size)
+    if size == 3:
+        bigEndian = getBigEndianExpr(item['endianness'])
+        if packing:
+            return 'structspec_put24({}, (uint32_t){}, {});'.format(
+                position, element, bigEndian)
+        if typeName == 'int24_t':
+            return '{} = structspec_sext24(structspec_get24({}, {}));'.format(
+                element, position, bigEndian)
+        return '{} = structspec_get24({}, {});'.format(
+            element, position, bigEndian)
+    if size == 1:
+        if packing:
+            if isBooleanType(typeName):
+                return '*({}) = {} ? 1 : 0;'.format(position, element)
+            return '*({}) = (uint8_t){};'.format(position, element)
+        if isBooleanType(typeName):
+            return '{} = *({}) != 0;'.format(element, position)
+        return '{} = ({})*({});'.format(element, typeName, position)
+    swap = getSwapExpr(item['endianness'])
+    if packing:
+        if isBooleanType(typeName):
+            value = '{} ? 1 : 0'.format(element)
+        else:
+            value = '(uint{}_t){}'.format(size * 8, element)
+        return 'structspec_put{}({}, {}, {});'.format(
+            size * 8, position, value, swap)
+    if isBooleanType(typeName):
+        return '{} = structspec_get{}({}, {}) != 0;'.format(
+            element, size * 8, position, swap)
+    return '{} = ({})structspec_get{}({}, {});'.format(
+        element, typeName, size * 8, position, swap)
+
+
+def outputCodecBody(packetName, specification, cFile, packing,
+                    layouts=None):
+    """
+    Outputs the C code packing or unpacking a packet.
+
+    The body does no bounds checking so that it may be shared by
+    the public per-packet functions, which check once up front,
+    and by the array functions, where keeping the loop body free
+    of branches lets compilers vectorize it.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        cFile (file):         A file-like object to which
+                              to save the C code.
+        packing (bool):       True for the encoder, False
+                              for the decoder.
+        layouts (dict):       Optional cache of packet layouts.
+    """
+    assert isinstance(specification, dict)
+    assert hasattr(cFile, 'write')
+    prefix = '  '
+    layout = getPacketLayout(packetName, specification, layouts)
+    if packing:
+        writeOut(cFile, 'static inline void encode_{0}(const {0} *restrict '
+                 'packet, uint8_t *restrict buffer)'.format(packetName))
+    else:
+        writeOut(cFile, 'static inline void decode_{0}(const uint8_t '
+                 '*restrict buffer, {0} *restrict packet)'.format(packetName))
+    writeOut(cFile, '{')
+    if any([item['kind'] == 'bitfield' for item in layout]):
+        writeOut(cFile, 'uint64_t bits;', prefix)
+    if any([item['count'] > 1 and item['kind'] == 'field' and
+            not isStringType(item['type']) for item in layout]):
+        writeOut(cFile, 'size_t i;', prefix)
+    bitFieldRun = []
+    for itemNum, item in enumerate(layout):
+        element = 'packet->{}'.format(item['name'])
+        position = 'buffer + {}'.format(item['offset'])
+        if item['kind'] == 'bitfield':
+            bitFieldRun.append(item)
+            if itemNum + 1 < len(layout) and \
+                    layout[itemNum + 1]['kind'] == 'bitfield' and \
+                    layout[itemNum + 1]['offset'] == item['offset']:
+                continue
+            container = dict(item, type='uint{}_t'.format(item['size'] * 8))
+            if packing:
+                writeOut(cFile, 'bits = 0;', prefix)
+                for bitField in bitFieldRun:
+                    writeOut(cFile, 'bits |= ((uint64_t)packet->{} & '
+                             'UINT64_C({})) << {};'.format(
+                                 bitField['name'],
+                                 '0x{:x}'.format((1 << bitField['bitSize']) - 1),
+                                 bitField['bitOffset']), prefix)
+                writeOut(cFile, getElementCode(container, 'bits', position,
+                                               True), prefix)
+            else:
+                writeOut(cFile, getElementCode(container, 'bits', position,
+                                               False), prefix)
+                for bitField in bitFieldRun:
+                    writeOut(cFile, 'packet->{} = ({})((bits >> {}) & '
+                             'UINT64_C({}));'.format(
+                                 bitField['name'], bitField['type'],
+                                 bitField['bitOffset'],
+                                 '0x{:x}'.format((1 << bitField['bitSize']) - 1)),
+                             prefix)
+            bitFieldRun = []
+        elif item['kind'] == 'substructure':
+            if packing:
+                writeOut(cFile, 'encode_{}(&{}, {});'.format(
+                    item['type'], element, position), prefix)
+            else:
+                writeOut(cFile, 'decode_{}({}, &{});'.format(
+                    item['type'], position, element), prefix)
+        elif item['kind'] == 'padding':
+            if packing:
+                writeOut(cFile, 'memset({}, 0, {});'.format(
+                    position, item['size'] * item['count']), prefix)
+        elif item['count'] > 1 and isStringType(item['type']):
+            if packing:
+                writeOut(cFile, 'memcpy({}, {}, {});'.format(
+                    position, element, item['count']), prefix)
+            else:
+                writeOut(cFile, 'memcpy({}, {}, {});'.format(
+                    element, position, item['count']), prefix)
+        elif item['count'] > 1:
+            writeOut(cFile, 'for (i = 0; i < {}; i++)'.format(item['count']),
+                     prefix)
+            writeOut(cFile, getElementCode(
+                item, element + '[i]',
+                '{} + i * {}'.format(position, item['size']), packing),
+                2 * prefix)
+        else:
+            writeOut(cFile, getElementCode(item, element, position, packing),
+                     prefix)
+    writeOut(cFile, '}')
+    writeOut(cFile, '')
+
+
+def outputCodecFunction(packetName, cFile, packing):
+    """
+    Outputs a C function packing or unpacking a packet.
+
+    Args:
+        packetName (str):     The name of the packet.
+        cFile (file):         A file-like object to which
+                              to save the C code.
+        packing (bool):       True for the pack function,
+                              False for the unpack function.
+    """
+    assert hasattr(cFile, 'write')
+    prefix = '  '
+    lenName = '{}_LEN'.format(packetName.upper())
+    writeOut(cFile, '/**')
+    if packing:
+        writeOut(cFile, '@brief\tPacks a {} packet.'.format(packetName),
+                 ' * ')
+        writeOut(cFile, ' *')
+        writeOut(cFile, '@param\tpacket\tThe packet to be packed.', ' * ')
+        writeOut(cFile, '@param\tbuffer\tThe buffer to receive the data.',
+                 ' * ')
+        writeOut(cFile, '@param\tlength\tThe size of the buffer.', ' * ')
+        writeOut(cFile, '@return\tThe number of bytes written, or -1 if ' +
+                 'the buffer is too small.', ' * ')
+        writeOut(cFile, ' */')
+        writeOut(cFile, 'int pack_{0}(const {0} *packet, uint8_t *buffer, '
+                 'size_t length)'.format(packetName))
+    else:
+        writeOut(cFile, '@brief\tUnpacks a {} packet.'.format(packetName),
+                 ' * ')
+        writeOut(cFile, ' *')
+        writeOut(cFile, '@param\tbuffer\tThe raw binary data.', ' * ')
+        writeOut(cFile, '@param\tlength\tThe size of the raw data.', ' * ')
+        writeOut(cFile, '@param\tpacket\tThe packet to be filled in.', ' * ')
+        writeOut(cFile, '@return\tThe number of bytes read, or -1 if ' +
+                 'there is too little data.', ' * ')
+        writeOut(cFile, ' */')
+        writeOut(cFile, 'int unpack_{0}(const uint8_t *buffer, size_t length, '
+                 '{0} *packet)'.format(packetName))
+    writeOut(cFile, '{')
+    writeOut(cFile, 'if (length < {})'.format(lenName), prefix)
+    writeOut(cFile, 'return -1;', 2 * prefix)
+    if packing:
+        writeOut(cFile, 'encode_{}(packet, buffer);'.format(packetName),
+                 prefix)
+    else:
+        writeOut(cFile, 'decode_{}(buffer, packet);'.format(packetName),
+                 prefix)
+    writeOut(cFile, 'return {};'.format(lenName), prefix)
+    writeOut(cFile, '}')
+    writeOut(cFile, '')
+
+
+def getMemcpySafeExpr(packetName, specification, layouts=None):
+    """
+    Gets the C expression telling whether a packet may be memcpy'd.
+
+    A packet may be copied straight from the wire into its struct
+    when the struct has exactly the wire layout (no padding, no
+    bitfields, no types whose C size differs from their wire
+    size) and every multi-byte value is in host byte order. The
+    expression is a compile-time constant so the check costs
+    nothing at run time.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        A C constant expression.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': {'sample': {
+        ...     'endianness': 'little', 'structure': OrderedDict([
+        ...         ('ts', {'type': 'uint32_t'}),
+        ...         ('id', {'type': 'uint8_t', 'count': 4})])}}}
+        >>> print(getMemcpySafeExpr('sample', spec))
+        (sizeof(sample) == SAMPLE_LEN && \\
+          offsetof(sample, ts) == 0 && \\
+          sizeof(((sample *)0)->ts) == 4 && !STRUCTSPEC_SWAP_LITTLE && \\
+          offsetof(sample, id) == 4 && \\
+          sizeof(((sample *)0)->id) == 4)
+        >>> spec['packets']['sample']['structure']['id']['size'] = 4
+        >>> getMemcpySafeExpr('sample', spec)
+        '0'
+    """
+    conditions = ['sizeof({}) == {}_LEN'.format(packetName,
+                                                 packetName.upper())]
+    for item in getPacketLayout(packetName, specification, layouts):
+        if item['kind'] == 'bitfield' or item['size'] == 3 or \
+                isBooleanType(item['type']):
+            return '0'
+        conditions.append('offsetof({}, {}) == {}'.format(
+            packetName, item['name'], item['offset']))
+        if item['kind'] == 'substructure':
+            conditions.append('{}_MEMCPY_SAFE'.format(item['type'].upper()))
+            continue
+        condition = 'sizeof((({} *)0)->{}) == {}'.format(
+            packetName, item['name'], item['size'] * item['count'])
+        if item['size'] > 1 and getSwapExpr(item['endianness']) != '0':
+            condition = '{} && !{}'.format(condition,
+                                            getSwapExpr(item['endianness']))
+        conditions.append(condition)
+    return '({})'.format(' && \\\n  '.join(conditions))
+
+
+def outputArrayFunction(packetName, specification, cFile, layouts=None):
+    """
+    Outputs a C function unpacking a run of identical packets.
+
+    When the wire layout matches the struct layout on the host the
+    whole run is a single memcpy; otherwise each record is decoded
+    in a tight loop the compiler is free to vectorize.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        cFile (file):         A file-like object to which
+                              to save the C code.
+        layouts (dict):       Optional cache of packet layouts.
+    """
+    assert isinstance(specification, dict)
+    assert hasattr(cFile, 'write')
+    prefix = '  '
+    lenName = '{}_LEN'.format(packetName.upper())
+    writeOut(cFile, '#define {}_MEMCPY_SAFE {}'.format(
+        packetName.upper(),
+        getMemcpySafeExpr(packetName, specification, layouts)))
+    writeOut(cFile, '')
+    writeOut(cFile, '/**')
+    writeOut(cFile, '@brief\tUnpacks consecutive {} packets.'.format(
+             packetName), ' * ')
+    writeOut(cFile, ' *')
+    writeOut(cFile, '@param\tbuffer\tThe raw binary data, holding at ' +
+             'least count packets.', ' * ')
+    writeOut(cFile, '@param\tcount\tThe number of packets.', ' * ')
+    writeOut(cFile, '@param\tpackets\tThe array to be filled in.', ' * ')
+    writeOut(cFile, '@return\tThe number of bytes read.', ' * ')
+    writeOut(cFile, ' */')
+    writeOut(cFile, 'size_t unpack_{0}_array(const uint8_t *buffer, '
+             'size_t count, {0} *packets)'.format(packetName))
+    writeOut(cFile, '{')
+    writeOut(cFile, 'const uint8_t *restrict in = buffer;', prefix)
+    writeOut(cFile, '{} *restrict out = packets;'.format(packetName), prefix)
+    writeOut(cFile, 'size_t i;', prefix)
+    writeOut(cFile, 'if ({}_MEMCPY_SAFE) {{'.format(packetName.upper()),
+             prefix)
+    writeOut(cFile, 'memcpy(out, in, count * {});'.format(lenName),
+             2 * prefix)
+    writeOut(cFile, 'return count * {};'.format(lenName), 2 * prefix)
+    writeOut(cFile, '}', prefix)
+    writeOut(cFile, 'for (i = 0; i < count; i++)', prefix)
+    writeOut(cFile, 'decode_{}(in + i * {}, out + i);'.format(
+        packetName, lenName), 2 * prefix)
+    writeOut(cFile, 'return count * {};'.format(lenName), prefix)
+    writeOut(cFile, '}')
+    writeOut(cFile, '')
+
+
+def outputOffsets(packetName, specification, hFile, layouts=None):
+    """
+    Outputs constants giving where each field lives on the wire.
+
+    These are offsets within the packed binary packet rather than
+    within its struct, so that readers can pick single fields out
+    of a buffer without unpacking it. Fields after an item of
+    variable size have no constant.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        hFile (file):         A file-like object to which
+                              to save the C header.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> from StringIO import StringIO
+        >>> spec = {'packets': {'sample': {'structure': OrderedDict([
+        ...     ('ts', {'type': 'uint32_t'}),
+        ...     ('a', {'type': 'uint8_t', 'size': 3}),
+        ...     ('b', {'type': 'uint8_t', 'size': 5})])}}}
+        >>> hFile = StringIO()
+        >>> outputOffsets('sample', spec, hFile)
+        >>> print(hFile.getvalue().strip())
+        #define SAMPLE_OFFSET_TS 0
+        #define SAMPLE_OFFSET_A 4
+        #define SAMPLE_BIT_OFFSET_A 0
+        #define SAMPLE_OFFSET_B 4
+        #define SAMPLE_BIT_OFFSET_B 3
+    """
+    assert isinstance(specification, dict)
+    assert hasattr(hFile, 'write')
+    for fieldName, fieldOffset in getFieldOffsets(packetName, specification,
+                                                  layouts).items():
+        if fieldOffset is None:
+            continue
+        constName = '{}_{{}}_{}'.format(packetName.upper(),
+                                       fieldName.replace('.', '_').upper())
+        if isinstance(fieldOffset, tuple):
+            writeOut(hFile, '#define {} {}'.format(
+                constName.format('OFFSET'), fieldOffset[0]))
+            writeOut(hFile, '#define {} {}'.format(
+                constName.format('BIT_OFFSET'), fieldOffset[1]))
+        else:
+            writeOut(hFile, '#define {} {}'.format(
+                constName.format('OFFSET'), fieldOffset))
+
 
 def outputC(specification, options, hFile, cFile):
     """
-    Outputs C header file.
+    Outputs C header and code files.
 
     Given the specification construct a valid C header
-    file that describes all the binary packets.
+    file that describes all the binary packets along with
+    C code to pack and unpack each of them.
 
     Args:
         specification (dict): The specification object.
@@ -35,6 +629,10 @@ def outputC(specification, options, hFile, cFile):
                               to save the header.
         cFile (file):         A file-like object to which
                               to save the C code.
+
+    Packets without pack and unpack functions (those of variable
+    size) are left out of the header entirely if the codecOnly
+    option is set, so that it always compiles.
     """
     assert isinstance(specification, dict)
     assert hasattr(hFile, 'write')
@@ -72,9 +670,23 @@ def outputC(specification, options, hFile, cFile):
                      prefix)
     writeOut((hFile, cFile), ' */')
     writeOut((hFile, cFile), '')
+    writeOut(hFile, '#include <stddef.h>')
     writeOut(hFile, '#include <stdint.h>')
+    writeOut(hFile, '#ifndef __cplusplus')
+    writeOut(hFile, '#include <stdbool.h>')
+    writeOut(hFile, '#endif /* __cplusplus */')
     writeOut(hFile, '')
-    for enumerationName, enumeration in specification['enums'].items():
+    writeOut(hFile, '#ifndef STRUCTSPEC_TYPES')
+    writeOut(hFile, '#define STRUCTSPEC_TYPES')
+    for typeName, cTypeName in cTypedefs:
+        writeOut(hFile, 'typedef {} {};'.format(cTypeName, typeName))
+    writeOut(hFile, '#endif /* STRUCTSPEC_TYPES */')
+    writeOut(hFile, '')
+    writeOut(cFile, cHelpers)
+    writeOut(cFile, '')
+    layouts = {}
+    enumerations = specification.get('enums', {})
+    for enumerationName, enumeration in enumerations.items():
         if not enumeration.get('preprocessor', False):
             writeOut(hFile, '/**')
             writeOut(hFile, '@enum\t{}'.format(enumerationName), ' * ')
@@ -122,6 +734,13 @@ def outputC(specification, options, hFile, cFile):
             writeOut(hFile, "}} {};".format(enumerationName))
         writeOut(hFile, '')
     for packetName, packet in specification['packets'].items():
+        if options.get('codecOnly', False) and \
+                not hasCodec(packetName, specification, layouts):
+            writeOut((hFile, cFile), '/* No {0} structure: {0} is of '
+                     'variable size or has unsupported types. */'.format(
+                         packetName))
+            writeOut((hFile, cFile), '')
+            continue
         writeOut(hFile, "typedef struct {")
         for structureName, structure in packet['structure'].items():
             line = []
@@ -137,20 +756,15 @@ def outputC(specification, options, hFile, cFile):
             line.append(' ')
             line.append(structureName)
             if 'count' in structure:
-                if structure['count'].startswith('#/'):
-                    countLabel = structure['count'][:-len(schemaVal)]
-                    countLabel = countLabel[countLabel.rfind('/') + 1:]
-                else:
-                    countLabel = structure['count']
-                line.append('[{}]'.format(countLabel))
+                line.append('[{}]'.format(getLabel(str(structure['count']))))
             if 'size' in structure:
-                if structure['size'].startswith('#/'):
+                if str(structure['size']).startswith('#/'):
                     sizeLabel = structure['size'][:-len(schemaVal)]
                     sizeLabel = sizeLabel[sizeLabel.rfind('/') + 1:]
                     sizeInBits = resolveJsonPointer(specification,
                                                     structure['size'][1:])
                 else:
-                    sizeLabel = structure['size']
+                    sizeLabel = str(structure['size'])
                     try:
                         sizeInBits = int(sizeLabel)
                     except ValueError:
@@ -162,6 +776,27 @@ def outputC(specification, options, hFile, cFile):
             line.append(';')
             writeOut(hFile, ''.join(line), '  ')
         writeOut(hFile, "}} {};".format(packetName))
+        outputOffsets(packetName, specification, hFile, layouts)
+        if hasCodec(packetName, specification, layouts):
+            writeOut(hFile, '#define {}_LEN {}'.format(
+                packetName.upper(),
+                getPacketSize(packetName, specification, layouts)))
+            writeOut(hFile, 'int pack_{0}(const {0} *packet, uint8_t *buffer, '
+                     'size_t length);'.format(packetName))
+            writeOut(hFile, 'int unpack_{0}(const uint8_t *buffer, '
+                     'size_t length, {0} *packet);'.format(packetName))
+            writeOut(hFile, 'size_t unpack_{0}_array(const uint8_t *buffer, '
+                     'size_t count, {0} *packets);'.format(packetName))
+            outputCodecBody(packetName, specification, cFile, True, layouts)
+            outputCodecBody(packetName, specification, cFile, False, layouts)
+            outputCodecFunction(packetName, cFile, True)
+            outputCodecFunction(packetName, cFile, False)
+            outputArrayFunction(packetName, specification, cFile, layouts)
+        else:
+            writeOut(cFile, '/* No pack_{0} or unpack_{0}: {0} is of '
+                     'variable size or has unsupported types. */'.format(
+                         packetName))
+            writeOut(cFile, '')
         writeOut(hFile, '')
     writeOut(hFile, '#ifdef __cplusplus')
     writeOut(hFile, '}')
@@ -169,6 +804,97 @@ def outputC(specification, options, hFile, cFile):
     writeOut(hFile, '#endif /* {} */'.format(defName))
 
 
+def outputCBenchmark(specification, options, benchFile):
+    """
+    Outputs a C micro-benchmark for the generated functions.
+
+    The benchmark decodes a buffer of pseudo-random records of
+    each packet with both the per-packet and the array functions
+    and reports the number of records decoded per second.
+
+    Args:
+        specification (dict): The specification object.
+        options (dict):       A dictionary of options to
+                              modify output.
+        benchFile (file):     A file-like object to which
+                              to save the benchmark code.
+    """
+    assert isinstance(specification, dict)
+    assert hasattr(benchFile, 'write')
+    prefix = '  '
+    layouts = {}
+    writeOut(benchFile, '/** @file {} */'.format(options['benchFilename']))
+    writeOut(benchFile, '#define _POSIX_C_SOURCE 199309L')
+    writeOut(benchFile, '#include <stdio.h>')
+    writeOut(benchFile, '#include <stdlib.h>')
+    writeOut(benchFile, '#include <time.h>')
+    writeOut(benchFile, '#include "{}"'.format(options['hFilename']))
+    writeOut(benchFile, '')
+    writeOut(benchFile, '#define BENCH_RECORDS 100000')
+    writeOut(benchFile, '#define BENCH_ROUNDS 20')
+    writeOut(benchFile, '')
+    writeOut(benchFile, 'static double now(void)')
+    writeOut(benchFile, '{')
+    writeOut(benchFile, 'struct timespec ts;', prefix)
+    writeOut(benchFile, 'clock_gettime(CLOCK_MONOTONIC, &ts);', prefix)
+    writeOut(benchFile, 'return ts.tv_sec + ts.tv_nsec * 1e-9;', prefix)
+    writeOut(benchFile, '}')
+    writeOut(benchFile, '')
+    writeOut(benchFile, 'static void fill(uint8_t *buffer, size_t length)')
+    writeOut(benchFile, '{')
+    writeOut(benchFile, 'uint32_t state = 12345u;', prefix)
+    writeOut(benchFile, 'size_t i;', prefix)
+    writeOut(benchFile, 'for (i = 0; i < length; i++) {', prefix)
+    writeOut(benchFile, 'state = state * 1103515245u + 12345u;', 2 * prefix)
+    writeOut(benchFile, 'buffer[i] = (uint8_t)(state >> 24);', 2 * prefix)
+    writeOut(benchFile, '}', prefix)
+    writeOut(benchFile, '}')
+    writeOut(benchFile, '')
+    writeOut(benchFile, 'int main(void)')
+    writeOut(benchFile, '{')
+    writeOut(benchFile, 'uint8_t *buffer;', prefix)
+    writeOut(benchFile, 'double start, single, array;', prefix)
+    writeOut(benchFile, 'size_t i;', prefix)
+    writeOut(benchFile, 'int round;', prefix)
+    writeOut(benchFile, 'printf("%-24s %16s %16s\\n", "packet", '
+             '"records/s", "array records/s");', prefix)
+    for packetName in specification['packets']:
+        if not hasCodec(packetName, specification, layouts):
+            continue
+        lenName = '{}_LEN'.format(packetName.upper())
+        writeOut(benchFile, '{', prefix)
+        writeOut(benchFile, '{0} *packets = malloc(BENCH_RECORDS * '
+                 'sizeof({0}));'.format(packetName), 2 * prefix)
+        writeOut(benchFile, 'buffer = malloc(BENCH_RECORDS * {});'.format(
+                 lenName), 2 * prefix)
+        writeOut(benchFile, 'if (!packets || !buffer)', 2 * prefix)
+        writeOut(benchFile, 'return 1;', 3 * prefix)
+        writeOut(benchFile, 'fill(buffer, BENCH_RECORDS * {});'.format(
+                 lenName), 2 * prefix)
+        writeOut(benchFile, 'start = now();', 2 * prefix)
+        writeOut(benchFile, 'for (round = 0; round < BENCH_ROUNDS; round++)',
+                 2 * prefix)
+        writeOut(benchFile, 'for (i = 0; i < BENCH_RECORDS; i++)', 3 * prefix)
+        writeOut(benchFile, 'unpack_{0}(buffer + i * {1}, {1}, packets + i);'
+                 .format(packetName, lenName), 4 * prefix)
+        writeOut(benchFile, 'single = now() - start;', 2 * prefix)
+        writeOut(benchFile, 'start = now();', 2 * prefix)
+        writeOut(benchFile, 'for (round = 0; round < BENCH_ROUNDS; round++)',
+                 2 * prefix)
+        writeOut(benchFile, 'unpack_{}_array(buffer, BENCH_RECORDS, '
+                 'packets);'.format(packetName), 3 * prefix)
+        writeOut(benchFile, 'array = now() - start;', 2 * prefix)
+        writeOut(benchFile, 'printf("%-24s %16.0f %16.0f\\n", "{}", '
+                 'BENCH_RECORDS * (double)BENCH_ROUNDS / single, '
+                 'BENCH_RECORDS * (double)BENCH_ROUNDS / array);'.format(
+                     packetName), 2 * prefix)
+        writeOut(benchFile, 'free(buffer);', 2 * prefix)
+        writeOut(benchFile, 'free(packets);', 2 * prefix)
+        writeOut(benchFile, '}', prefix)
+    writeOut(benchFile, 'return 0;', prefix)
+    writeOut(benchFile, '}')
+
+
 def outputForLanguage(specification, options):
     """
     Outputs handler files for given language.
@@ -198,6 +924,13 @@ def outputForLanguage(specification, options):
         outputC(specification, options, hFile, cFile)
         cFile.close()
         hFile.close()
+        if options.get('benchmark', False):
+            benchFilename = "{}_bench.{}".format(filenameBase,
+                                                 filenameExtension[1])
+            options['benchFilename'] = benchFilename
+            benchFile = open(benchFilename, 'w')
+            outputCBenchmark(specification, options, benchFile)
+            benchFile.close()
     except EnvironmentError as envErr:
         giveUp("Output environment error", envErr)
     if options['verbose']:
@@ -0,0 +1,810 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Support for CPython extension modules
+
+Provides everything needed to output a CPython extension module
+wrapping the generated C handlers, so Python programs can pack
+and unpack packets at C speed. The extension is built from its
+own copy of the C handlers, and the pure Python handlers output
+for the Python language serve as a fallback for when it cannot
+be built or imported.
+"""
+
+from os.path import basename
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+from zope.interface import moduleProvides
+from structspec.common import writeOut, giveUp, isFloatType, \
+    isBooleanType, getPacketLayout
+from structspec.interfaces import ILanguage
+from structspec.languages import c, python
+
+moduleProvides(ILanguage)
+
+name = "CPython"
+filenameExtension = ('c', 'py')
+
+# Conversions between Python objects and C values used by all
+# generated wrappers
+extensionHelpers = r'''#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#if PY_MAJOR_VERSION >= 3
+#define STRUCTSPEC_BUFFER_FORMAT "y#"
+#define STRUCTSPEC_INTERN PyUnicode_InternFromString
+#else
+#define STRUCTSPEC_BUFFER_FORMAT "s#"
+#define STRUCTSPEC_INTERN PyString_InternFromString
+#endif
+
+static PyObject *StructError;
+
+static inline PyObject *structspec_from_signed(long long value)
+{
+#if PY_MAJOR_VERSION < 3
+  if (value >= LONG_MIN && value <= LONG_MAX)
+    return PyInt_FromLong((long)value);
+#endif
+  return PyLong_FromLongLong(value);
+}
+
+static inline PyObject *structspec_from_unsigned(unsigned long long value)
+{
+#if PY_MAJOR_VERSION < 3
+  if (value <= LONG_MAX)
+    return PyInt_FromLong((long)value);
+#endif
+  return PyLong_FromUnsignedLongLong(value);
+}
+
+static inline PyObject *structspec_from_bytes(const void *data,
+                                              Py_ssize_t length)
+{
+  return PyBytes_FromStringAndSize((const char *)data, length);
+}
+
+static inline PyObject *structspec_from_pascal(const unsigned char *data,
+                                               Py_ssize_t length)
+{
+  Py_ssize_t used = data[0];
+  if (used > length - 1)
+    used = length - 1;
+  return PyBytes_FromStringAndSize((const char *)data + 1, used);
+}
+
+static inline int structspec_range_error(void)
+{
+  PyErr_SetString(StructError, "argument out of range");
+  return -1;
+}
+
+static inline int structspec_as_signed(PyObject *object, int bits,
+                                       long long *value)
+{
+  long long limit = bits < 64 ? (1LL << (bits - 1)) : 0;
+  *value = PyLong_AsLongLong(object);
+  if (*value == -1 && PyErr_Occurred()) {
+    if (PyErr_ExceptionMatches(PyExc_OverflowError)) {
+      PyErr_Clear();
+      return structspec_range_error();
+    }
+    return -1;
+  }
+  if (limit && (*value < -limit || *value >= limit))
+    return structspec_range_error();
+  return 0;
+}
+
+static inline int structspec_as_unsigned(PyObject *object, int bits,
+                                         unsigned long long *value)
+{
+  PyObject *number = PyNumber_Long(object);
+  if (!number)
+    return -1;
+  *value = PyLong_AsUnsignedLongLong(number);
+  Py_DECREF(number);
+  if (*value == (unsigned long long)-1 && PyErr_Occurred()) {
+    if (PyErr_ExceptionMatches(PyExc_OverflowError)) {
+      PyErr_Clear();
+      return structspec_range_error();
+    }
+    return -1;
+  }
+  if (bits < 64 && *value >> bits)
+    return structspec_range_error();
+  return 0;
+}
+
+static inline int structspec_as_double(PyObject *object, double *value)
+{
+  *value = PyFloat_AsDouble(object);
+  if (*value == -1.0 && PyErr_Occurred())
+    return -1;
+  return 0;
+}
+
+static inline int structspec_as_bytes(PyObject *object, void *data,
+                                      Py_ssize_t length)
+{
+  char *source;
+  Py_ssize_t sourceLength;
+  if (PyBytes_AsStringAndSize(object, &source, &sourceLength) < 0)
+    return -1;
+  memset(data, 0, length);
+  memcpy(data, source, sourceLength < length ? sourceLength : length);
+  return 0;
+}
+
+static inline int structspec_as_char(PyObject *object, char *value)
+{
+  if (!PyBytes_Check(object) || PyBytes_GET_SIZE(object) != 1) {
+    PyErr_SetString(StructError, "char format requires a bytes object "
+                    "of length 1");
+    return -1;
+  }
+  *value = PyBytes_AS_STRING(object)[0];
+  return 0;
+}
+
+static inline int structspec_as_pascal(PyObject *object,
+                                       unsigned char *data,
+                                       Py_ssize_t length)
+{
+  char *source;
+  Py_ssize_t used;
+  if (PyBytes_AsStringAndSize(object, &source, &used) < 0)
+    return -1;
+  if (used > length - 1)
+    used = length - 1;
+  if (used > 255)
+    used = 255;
+  memset(data, 0, length);
+  data[0] = (unsigned char)used;
+  memcpy(data + 1, source, used);
+  return 0;
+}
+
+static inline PyObject *structspec_get_item(PyObject *dict, PyObject *key)
+{
+  PyObject *value;
+  if (!PyDict_Check(dict)) {
+    PyErr_SetString(PyExc_TypeError, "packet must be a dict");
+    return NULL;
+  }
+  value = PyDict_GetItem(dict, key);
+  if (!value)
+    PyErr_SetObject(PyExc_KeyError, key);
+  return value;
+}
+
+static inline int structspec_set_item(PyObject *dict, PyObject *key,
+                                      PyObject *value)
+{
+  int result;
+  if (!value)
+    return -1;
+  result = PyDict_SetItem(dict, key, value);
+  Py_DECREF(value);
+  return result;
+}'''
+
+
+def getValueKind(typeName):
+    """
+    Classifies a type by how its values look to Python.
+
+    Args:
+        typeName (str): The name of the type.
+
+    Returns:
+        One of 'signed', 'unsigned', 'float', 'bool', 'char',
+        'bytes', 'pascal' or 'padding'.
+
+    Examples:
+        >>> getValueKind('int16_t')
+        'signed'
+        >>> getValueKind('unsigned long')
+        'unsigned'
+        >>> getValueKind('bool')
+        'unsigned'
+        >>> getValueKind('_Bool')
+        'bool'
+        >>> getValueKind('hollerith')
+        'char'
+        >>> getValueKind('string')
+        'bytes'
+        >>> getValueKind('int24_t'), getValueKind('uint24_t')
+        ('signed', 'unsigned')
+    """
+    if typeName in python.int24Signed:
+        return 'signed' if python.int24Signed[typeName] else 'unsigned'
+    formatChar = python.typeFormatChar[typeName]
+    if formatChar == 'x':
+        return 'padding'
+    elif formatChar == '?':
+        return 'bool'
+    elif formatChar == 'c':
+        return 'char'
+    elif formatChar == 's':
+        return 'bytes'
+    elif formatChar == 'p':
+        return 'pascal'
+    elif isFloatType(typeName):
+        return 'float'
+    elif formatChar.isupper() or isBooleanType(typeName) or \
+            typeName.startswith('u'):
+        return 'unsigned'
+    return 'signed'
+
+
+def getToPythonExpr(typeName, element):
+    """
+    Gets the C expression making a Python object of a C value.
+
+    Args:
+        typeName (str): The name of the value's type.
+        element (str):  The C expression for the value.
+
+    Returns:
+        A C expression giving a new reference.
+
+    Examples:
+        >>> getToPythonExpr('int16_t', 'packet->a')
+        'structspec_from_signed((long long)packet->a)'
+        >>> getToPythonExpr('boolean', 'packet->b')
+        'PyBool_FromLong(packet->b)'
+    """
+    valueKind = getValueKind(typeName)
+    if valueKind == 'signed':
+        return 'structspec_from_signed((long long){})'.format(element)
+    elif valueKind == 'unsigned':
+        return 'structspec_from_unsigned((unsigned long long){})'.format(
+            element)
+    elif valueKind == 'float':
+        return 'PyFloat_FromDouble((double){})'.format(element)
+    elif valueKind == 'bool':
+        return 'PyBool_FromLong({})'.format(element)
+    return 'structspec_from_bytes(&{}, 1)'.format(element)
+
+
+def outputFromPython(typeName, bits, element, source, outFile, prefix,
+                     valueKind=None):
+    """
+    Outputs the C code filling a C value from a Python object.
+
+    The generated code returns -1 from the enclosing function
+    when the conversion fails.
+
+    Args:
+        typeName (str):  The name of the value's type.
+        bits (int):      The number of bits available for it.
+        element (str):   The C lvalue to be filled in.
+        source (str):    The C expression for the Python object.
+        outFile (file):  A file-like object to which to save
+                         the C code.
+        prefix (str):    The indentation to use.
+        valueKind (str): How the value looks to Python, if not
+                         as for its type (see getValueKind).
+    """
+    if valueKind is None:
+        valueKind = getValueKind(typeName)
+    if valueKind == 'signed':
+        writeOut(outFile, '{', prefix)
+        writeOut(outFile, 'long long converted;', prefix + '  ')
+        writeOut(outFile, 'if (structspec_as_signed({}, {}, &converted) < 0)'
+                 .format(source, bits), prefix + '  ')
+        writeOut(outFile, 'return -1;', prefix + '    ')
+        writeOut(outFile, '{} = ({})converted;'.format(element, typeName),
+                 prefix + '  ')
+        writeOut(outFile, '}', prefix)
+    elif valueKind == 'unsigned':
+        writeOut(outFile, '{', prefix)
+        writeOut(outFile, 'unsigned long long converted;', prefix + '  ')
+        writeOut(outFile, 'if (structspec_as_unsigned({}, {}, &converted) < 0)'
+                 .format(source, bits), prefix + '  ')
+        writeOut(outFile, 'return -1;', prefix + '    ')
+        writeOut(outFile, '{} = ({})converted;'.format(element, typeName),
+                 prefix + '  ')
+        writeOut(outFile, '}', prefix)
+    elif valueKind == 'float':
+        writeOut(outFile, '{', prefix)
+        writeOut(outFile, 'double converted;', prefix + '  ')
+        writeOut(outFile, 'if (structspec_as_double({}, &converted) < 0)'.format(
+                 source), prefix + '  ')
+        writeOut(outFile, 'return -1;', prefix + '    ')
+        writeOut(outFile, '{} = ({})converted;'.format(element, typeName),
+                 prefix + '  ')
+        writeOut(outFile, '}', prefix)
+    elif valueKind == 'bool':
+        writeOut(outFile, '{', prefix)
+        writeOut(outFile, 'int converted = PyObject_IsTrue({});'.format(source),
+                 prefix + '  ')
+        writeOut(outFile, 'if (converted < 0)', prefix + '  ')
+        writeOut(outFile, 'return -1;', prefix + '    ')
+        writeOut(outFile, '{} = converted;'.format(element), prefix + '  ')
+        writeOut(outFile, '}', prefix)
+    else:
+        writeOut(outFile, 'if (structspec_as_char({}, (char *)&{}) < 0)'
+                 .format(source, element), prefix)
+        writeOut(outFile, 'return -1;', prefix + '  ')
+
+
+def hasExtension(packetName, specification, layouts=None):
+    """
+    Determines whether a packet can be handled by the extension.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts,
+                              which also keeps the answer.
+
+    Returns:
+        True if the extension can pack and unpack the packet.
+    """
+    if layouts is not None and ('extension', packetName) in layouts:
+        return layouts[('extension', packetName)]
+    extension = c.hasCodec(packetName, specification, layouts)
+    if extension:
+        for item in getPacketLayout(packetName, specification, layouts):
+            if item['kind'] == 'substructure':
+                extension = hasExtension(item['type'], specification,
+                                         layouts)
+            else:
+                extension = item['type'] in python.int24Signed or \
+                    item['type'] in python.typeFormatChar and \
+                    len(python.typeFormatChar[item['type']]) == 1
+            if not extension:
+                break
+    if layouts is not None:
+        layouts[('extension', packetName)] = extension
+    return extension
+
+
+def outputConverters(packetName, specification, extFile, keyIndex,
+                     layouts=None):
+    """
+    Outputs the C functions converting a packet to and from a dict.
+
+    Dictionary keys are interned once when the module is loaded
+    and looked up by index, which saves creating and hashing a
+    string for every field of every packet.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        extFile (file):       A file-like object to which
+                              to save the extension code.
+        keyIndex (dict):      The index of each field name in
+                              the table of interned keys; new
+                              names are added to it.
+        layouts (dict):       Optional cache of packet layouts.
+    """
+    assert isinstance(specification, dict)
+    assert hasattr(extFile, 'write')
+    prefix = '  '
+    layout = getPacketLayout(packetName, specification, layouts)
+    for item in layout:
+        keyIndex.setdefault(item['name'], len(keyIndex))
+    arrays = [item for item in layout if item['kind'] == 'field' and
+              item['count'] > 1 and
+              getValueKind(item['type']) not in ('bytes', 'pascal')]
+
+    # Struct to dict
+    writeOut(extFile, 'static PyObject *to_dict_{0}(const {0} *packet)'.format(
+             packetName))
+    writeOut(extFile, '{')
+    writeOut(extFile, 'PyObject *dict = PyDict_New();', prefix)
+    if arrays:
+        writeOut(extFile, 'PyObject *list;', prefix)
+        writeOut(extFile, 'Py_ssize_t i;', prefix)
+    writeOut(extFile, 'if (!dict)', prefix)
+    writeOut(extFile, 'return NULL;', 2 * prefix)
+    for item in layout:
+        element = 'packet->{}'.format(item['name'])
+        bitMaximum = None
+        if item['kind'] == 'bitfield':
+            bitMaximum = python.getBitFieldMaximum(item['type'],
+                                                   item['bitSize'])
+        if item['kind'] == 'substructure':
+            valueExpr = 'to_dict_{}(&{})'.format(item['type'], element)
+        elif item['kind'] == 'padding':
+            continue
+        elif getValueKind(item['type']) == 'bytes':
+            valueExpr = 'structspec_from_bytes({}, {})'.format(
+                element, item['count'])
+        elif getValueKind(item['type']) == 'pascal':
+            valueExpr = 'structspec_from_pascal({}, {})'.format(
+                element, item['count'])
+        elif bitMaximum is not None:
+            # Bitfields are unsigned to Python whatever their type
+            valueExpr = 'structspec_from_unsigned((unsigned long long)' \
+                '({} & {}))'.format(element, bitMaximum)
+        elif item in arrays:
+            writeOut(extFile, 'list = PyList_New({});'.format(item['count']),
+                     prefix)
+            writeOut(extFile, 'if (!list)', prefix)
+            writeOut(extFile, 'goto error;', 2 * prefix)
+            writeOut(extFile, 'for (i = 0; i < {}; i++) {{'.format(
+                     item['count']), prefix)
+            writeOut(extFile, 'PyObject *value = {};'.format(
+                     getToPythonExpr(item['type'], element + '[i]')),
+                     2 * prefix)
+            writeOut(extFile, 'if (!value) {', 2 * prefix)
+            writeOut(extFile, 'Py_DECREF(list);', 3 * prefix)
+            writeOut(extFile, 'goto error;', 3 * prefix)
+            writeOut(extFile, '}', 2 * prefix)
+            writeOut(extFile, 'PyList_SET_ITEM(list, i, value);', 2 * prefix)
+            writeOut(extFile, '}', prefix)
+            valueExpr = 'list'
+        else:
+            valueExpr = getToPythonExpr(item['type'], element)
+        writeOut(extFile, 'if (structspec_set_item(dict, keys[{}], {}) < 0)'
+                 .format(keyIndex[item['name']], valueExpr), prefix)
+        writeOut(extFile, 'goto error;', 2 * prefix)
+    writeOut(extFile, 'return dict;', prefix)
+    writeOut(extFile, 'error:')
+    writeOut(extFile, 'Py_DECREF(dict);', prefix)
+    writeOut(extFile, 'return NULL;', prefix)
+    writeOut(extFile, '}')
+    writeOut(extFile, '')
+
+    # Dict to struct
+    writeOut(extFile, 'static int from_dict_{0}(PyObject *dict, {0} *packet)'
+             .format(packetName))
+    writeOut(extFile, '{')
+    writeOut(extFile, 'PyObject *item;', prefix)
+    if arrays:
+        writeOut(extFile, 'PyObject *sequence;', prefix)
+        writeOut(extFile, 'Py_ssize_t i;', prefix)
+    for item in layout:
+        element = 'packet->{}'.format(item['name'])
+        bitMaximum = None
+        if item['kind'] == 'bitfield':
+            bitMaximum = python.getBitFieldMaximum(item['type'],
+                                                   item['bitSize'])
+        if item['kind'] == 'padding':
+            continue
+        writeOut(extFile, 'item = structspec_get_item(dict, keys[{}]);'
+                 .format(keyIndex[item['name']]), prefix)
+        writeOut(extFile, 'if (!item)', prefix)
+        writeOut(extFile, 'return -1;', 2 * prefix)
+        if item['kind'] == 'substructure':
+            writeOut(extFile, 'if (from_dict_{}(item, &{}) < 0)'.format(
+                     item['type'], element), prefix)
+            writeOut(extFile, 'return -1;', 2 * prefix)
+        elif getValueKind(item['type']) == 'bytes':
+            writeOut(extFile, 'if (structspec_as_bytes(item, {}, {}) < 0)'
+                     .format(element, item['count']), prefix)
+            writeOut(extFile, 'return -1;', 2 * prefix)
+        elif getValueKind(item['type']) == 'pascal':
+            writeOut(extFile, 'if (structspec_as_pascal(item, {}, {}) < 0)'
+                     .format(element, item['count']), prefix)
+            writeOut(extFile, 'return -1;', 2 * prefix)
+        elif item in arrays:
+            writeOut(extFile, 'sequence = PySequence_Fast(item, "{} must be '
+                     'a sequence");'.format(item['name']), prefix)
+            writeOut(extFile, 'if (!sequence)', prefix)
+            writeOut(extFile, 'return -1;', 2 * prefix)
+            writeOut(extFile, 'if (PySequence_Fast_GET_SIZE(sequence) != {}) {{'
+                     .format(item['count']), prefix)
+            writeOut(extFile, 'Py_DECREF(sequence);', 2 * prefix)
+            writeOut(extFile, 'PyErr_SetString(StructError, "{} must have '
+                     '{} items");'.format(item['name'], item['count']),
+                     2 * prefix)
+            writeOut(extFile, 'return -1;', 2 * prefix)
+            writeOut(extFile, '}', prefix)
+            writeOut(extFile, 'for (i = 0; i < {}; i++) {{'.format(
+                     item['count']), prefix)
+            writeOut(extFile, 'PyObject *value = '
+                     'PySequence_Fast_GET_ITEM(sequence, i);', 2 * prefix)
+            fromFile = StringIO()
+            outputFromPython(item['type'], item['size'] * 8, element + '[i]',
+                             'value', fromFile, 2 * prefix)
+            for line in fromFile.getvalue().splitlines():
+                line = line.replace('return -1;', '{ Py_DECREF(sequence); '
+                                    'return -1; }')
+                writeOut(extFile, line)
+            writeOut(extFile, '}', prefix)
+            writeOut(extFile, 'Py_DECREF(sequence);', prefix)
+        elif bitMaximum is not None:
+            outputFromPython(item['type'], item['bitSize'], element, 'item',
+                             extFile, prefix, 'unsigned')
+        else:
+            bits = item['bitSize'] or item['size'] * 8
+            outputFromPython(item['type'], bits, element, 'item', extFile,
+                             prefix)
+    writeOut(extFile, 'return 0;', prefix)
+    writeOut(extFile, '}')
+    writeOut(extFile, '')
+
+
+def outputWrappers(packetName, extFile):
+    """
+    Outputs the Python-callable pack and unpack functions.
+
+    Args:
+        packetName (str): The name of the packet.
+        extFile (file):   A file-like object to which
+                          to save the extension code.
+    """
+    assert hasattr(extFile, 'write')
+    prefix = '  '
+    lenName = '{}_LEN'.format(packetName.upper())
+    writeOut(extFile, 'PyDoc_STRVAR(pack_{0}_doc, "pack_{0}(packet) -> '
+             'bytes\\n\\nPacks a {0} packet.");'.format(packetName))
+    writeOut(extFile, '')
+    writeOut(extFile, 'static PyObject *py_pack_{}(PyObject *self, '
+             'PyObject *args)'.format(packetName))
+    writeOut(extFile, '{')
+    writeOut(extFile, 'PyObject *dict;', prefix)
+    writeOut(extFile, '{} packet;'.format(packetName), prefix)
+    writeOut(extFile, 'uint8_t buffer[{}];'.format(lenName), prefix)
+    writeOut(extFile, 'if (!PyArg_ParseTuple(args, "O:pack_{}", &dict))'
+             .format(packetName), prefix)
+    writeOut(extFile, 'return NULL;', 2 * prefix)
+    writeOut(extFile, 'if (from_dict_{}(dict, &packet) < 0)'.format(
+             packetName), prefix)
+    writeOut(extFile, 'return NULL;', 2 * prefix)
+    writeOut(extFile, 'pack_{}(&packet, buffer, {});'.format(
+             packetName, lenName), prefix)
+    writeOut(extFile, 'return structspec_from_bytes(buffer, {});'.format(
+             lenName), prefix)
+    writeOut(extFile, '}')
+    writeOut(extFile, '')
+    writeOut(extFile, 'PyDoc_STRVAR(unpack_{0}_doc, "unpack_{0}(rawData) -> '
+             'dict\\n\\nUnpacks a {0} packet.");'.format(packetName))
+    writeOut(extFile, '')
+    writeOut(extFile, 'static PyObject *py_unpack_{}(PyObject *self, '
+             'PyObject *args)'.format(packetName))
+    writeOut(extFile, '{')
+    writeOut(extFile, 'const char *rawData;', prefix)
+    writeOut(extFile, 'Py_ssize_t length;', prefix)
+    writeOut(extFile, '{} packet;'.format(packetName), prefix)
+    writeOut(extFile, 'if (!PyArg_ParseTuple(args, STRUCTSPEC_BUFFER_FORMAT '
+             '":unpack_{}", &rawData, &length))'.format(packetName), prefix)
+    writeOut(extFile, 'return NULL;', 2 * prefix)
+    writeOut(extFile, 'if (unpack_{}((const uint8_t *)rawData, '
+             '(size_t)length, &packet) < 0) {{'.format(packetName), prefix)
+    writeOut(extFile, 'PyErr_Format(StructError, "unpack_{} requires a '
+             'buffer of at least %d bytes", {});'.format(packetName, lenName),
+             2 * prefix)
+    writeOut(extFile, 'return NULL;', 2 * prefix)
+    writeOut(extFile, '}', prefix)
+    writeOut(extFile, 'return to_dict_{}(&packet);'.format(packetName), prefix)
+    writeOut(extFile, '}')
+    writeOut(extFile, '')
+
+
+def outputExtension(specification, options, extFile):
+    """
+    Outputs the C source of a CPython extension module.
+
+    Args:
+        specification (dict): The specification object.
+        options (dict):       A dictionary of options to
+                              modify output.
+        extFile (file):       A file-like object to which
+                              to save the extension code.
+    """
+    assert isinstance(specification, dict)
+    assert isinstance(options, dict)
+    assert hasattr(extFile, 'write')
+    prefix = '  '
+    layouts = {}
+    moduleName = options['extensionName']
+    writeOut(extFile, '/** @file {} */'.format(options['extFilename']))
+    writeOut(extFile, '/**')
+    writeOut(extFile, '@brief\tCPython extension for {}'.format(
+             specification['title']), ' * ')
+    writeOut(extFile, ' */')
+    writeOut(extFile, extensionHelpers)
+    writeOut(extFile, '#include "{}"'.format(options['hFilename']))
+    writeOut(extFile, '')
+    packetNames = [packetName for packetName in specification['packets']
+                   if hasExtension(packetName, specification, layouts)]
+    keyIndex = {}
+    for packetName in packetNames:
+        for item in getPacketLayout(packetName, specification, layouts):
+            keyIndex.setdefault(item['name'], len(keyIndex))
+    keyNames = sorted(keyIndex, key=keyIndex.get)
+    writeOut(extFile, 'static const char *keyNames[] = {')
+    for keyName in keyNames:
+        writeOut(extFile, '"{}",'.format(keyName), prefix)
+    writeOut(extFile, 'NULL', prefix)
+    writeOut(extFile, '};')
+    writeOut(extFile, 'static PyObject *keys[{}];'.format(len(keyNames) or 1))
+    writeOut(extFile, '')
+    for packetName in packetNames:
+        outputConverters(packetName, specification, extFile, keyIndex,
+                         layouts)
+        outputWrappers(packetName, extFile)
+    writeOut(extFile, 'static PyMethodDef methods[] = {')
+    for packetName in packetNames:
+        for action in ('pack', 'unpack'):
+            writeOut(extFile, '{{"{0}_{1}", py_{0}_{1}, METH_VARARGS, '
+                     '{0}_{1}_doc}},'.format(action, packetName), prefix)
+    writeOut(extFile, '{NULL, NULL, 0, NULL}', prefix)
+    writeOut(extFile, '};')
+    writeOut(extFile, '')
+    writeOut(extFile, 'static PyObject *create_module(void)')
+    writeOut(extFile, '{')
+    writeOut(extFile, 'PyObject *module;', prefix)
+    writeOut(extFile, 'PyObject *structModule;', prefix)
+    writeOut(extFile, 'int keyNum;', prefix)
+    writeOut(extFile, 'for (keyNum = 0; keyNames[keyNum]; keyNum++)', prefix)
+    writeOut(extFile, 'if (!(keys[keyNum] = STRUCTSPEC_INTERN('
+             'keyNames[keyNum])))', 2 * prefix)
+    writeOut(extFile, 'return NULL;', 3 * prefix)
+    writeOut(extFile, 'structModule = PyImport_ImportModule("struct");',
+             prefix)
+    writeOut(extFile, 'if (!structModule)', prefix)
+    writeOut(extFile, 'return NULL;', 2 * prefix)
+    writeOut(extFile, 'StructError = PyObject_GetAttrString(structModule, '
+             '"error");', prefix)
+    writeOut(extFile, 'Py_DECREF(structModule);', prefix)
+    writeOut(extFile, 'if (!StructError)', prefix)
+    writeOut(extFile, 'return NULL;', 2 * prefix)
+    writeOut(extFile, '#if PY_MAJOR_VERSION >= 3')
+    writeOut(extFile, 'static struct PyModuleDef definition = {', prefix)
+    writeOut(extFile, 'PyModuleDef_HEAD_INIT, "{}", NULL, -1, methods'.format(
+             moduleName), 2 * prefix)
+    writeOut(extFile, '};', prefix)
+    writeOut(extFile, 'module = PyModule_Create(&definition);', prefix)
+    writeOut(extFile, '#else')
+    writeOut(extFile, 'module = Py_InitModule("{}", methods);'.format(
+             moduleName), prefix)
+    writeOut(extFile, '#endif')
+    writeOut(extFile, 'return module;', prefix)
+    writeOut(extFile, '}')
+    writeOut(extFile, '')
+    writeOut(extFile, '#if PY_MAJOR_VERSION >= 3')
+    writeOut(extFile, 'PyMODINIT_FUNC PyInit_{}(void)'.format(moduleName))
+    writeOut(extFile, '{')
+    writeOut(extFile, 'return create_module();', prefix)
+    writeOut(extFile, '}')
+    writeOut(extFile, '#else')
+    writeOut(extFile, 'PyMODINIT_FUNC init{}(void)'.format(moduleName))
+    writeOut(extFile, '{')
+    writeOut(extFile, 'create_module();', prefix)
+    writeOut(extFile, '}')
+    writeOut(extFile, '#endif')
+
+
+def outputSetup(specification, options, setupFile):
+    """
+    Outputs a setuptools script building the extension.
+
+    Args:
+        specification (dict): The specification object.
+        options (dict):       A dictionary of options to
+                              modify output.
+        setupFile (file):     A file-like object to which
+                              to save the setup script.
+    """
+    assert isinstance(specification, dict)
+    assert hasattr(setupFile, 'write')
+    prefix = '    '
+    writeOut(setupFile, '#!/usr/bin/env python')
+    writeOut(setupFile, '# -*- coding: utf-8 -*-')
+    writeOut(setupFile, '"""')
+    writeOut(setupFile, 'Builds the {} extension for {}'.format(
+             options['extensionName'], specification['title']))
+    writeOut(setupFile, '')
+    writeOut(setupFile, 'Run "python {} build_ext --inplace" to build it '
+             'in place.'.format(options['setupFilename']))
+    writeOut(setupFile, '"""')
+    writeOut(setupFile, '')
+    writeOut(setupFile, 'from setuptools import setup, Extension')
+    writeOut(setupFile, '')
+    writeOut(setupFile, 'setup(')
+    writeOut(setupFile, "name='{}',".format(options['extensionName']), prefix)
+    writeOut(setupFile, 'ext_modules=[', prefix)
+    writeOut(setupFile, "Extension('{}', ['{}', '{}'],".format(
+             options['extensionName'], options['extFilename'],
+             options['cFilename']), 2 * prefix)
+    writeOut(setupFile, "extra_compile_args=['-std=c99', '-O2'])",
+             2 * prefix + '          ')
+    writeOut(setupFile, ']', prefix)
+    writeOut(setupFile, ')')
+
+
+def outputLoader(specification, options, loaderFile):
+    """
+    Outputs the module choosing between extension and pure Python.
+
+    Everything comes from the pure Python module; the pack and
+    unpack functions are then replaced by those of the extension
+    if it can be imported.
+
+    Args:
+        specification (dict): The specification object.
+        options (dict):       A dictionary of options to
+                              modify output.
+        loaderFile (file):    A file-like object to which
+                              to save the loader.
+    """
+    assert isinstance(specification, dict)
+    assert hasattr(loaderFile, 'write')
+    prefix = '    '
+    pureName = options['pyFilename'].split('.')[0]
+    writeOut(loaderFile, '#!/usr/bin/env python')
+    writeOut(loaderFile, '# -*- coding: utf-8 -*-')
+    writeOut(loaderFile, '"""')
+    writeOut(loaderFile, specification['title'])
+    writeOut(loaderFile, '')
+    writeOut(loaderFile, 'Uses the {} extension when available and the '
+             'pure Python'.format(options['extensionName']))
+    writeOut(loaderFile, '{} module otherwise.'.format(pureName))
+    writeOut(loaderFile, '"""')
+    writeOut(loaderFile, '')
+    writeOut(loaderFile, 'from {} import *'.format(pureName))
+    writeOut(loaderFile, 'try:')
+    writeOut(loaderFile, 'from {} import *'.format(options['extensionName']),
+             prefix)
+    writeOut(loaderFile, 'accelerated = True', prefix)
+    writeOut(loaderFile, 'except ImportError:')
+    writeOut(loaderFile, 'accelerated = False', prefix)
+
+
+def outputForLanguage(specification, options):
+    """
+    Outputs handler files for given language.
+
+    Creates files to process given specification in given
+    programming language.  Bases output file names on given
+    input specification file.
+
+    Args:
+        specification (dict): The specification object.
+        options (dict):       Command-line options.
+    """
+    assert isinstance(specification, dict)
+    assert isinstance(options, dict)
+    if options['verbose']:
+        print("Processing {}...".format(name))
+    filenameBase = basename(options['specificationName'])
+    if '.' in filenameBase:
+        filenameBase = filenameBase[:filenameBase.rfind('.')]
+    # The extension is built from its own copy of the C code, which
+    # must all compile, so the C backend's files are left alone
+    extensionName = "_{}".format(filenameBase)
+    options = dict(
+        options, codecOnly=True,
+        hFilename="{}_codec.h".format(extensionName),
+        cFilename="{}_codec.c".format(extensionName),
+        pyFilename="{}.py".format(filenameBase),
+        extensionName=extensionName,
+        extFilename="{}.{}".format(extensionName, filenameExtension[0]),
+        setupFilename="setup_{}.{}".format(filenameBase,
+                                           filenameExtension[1]))
+    try:
+        loaderFilename = "{}_accel.{}".format(filenameBase,
+                                              filenameExtension[1])
+        hFile = open(options['hFilename'], 'w')
+        cFile = open(options['cFilename'], 'w')
+        c.outputC(specification, options, hFile, cFile)
+        cFile.close()
+        hFile.close()
+        extFile = open(options['extFilename'], 'w')
+        outputExtension(specification, options, extFile)
+        extFile.close()
+        setupFile = open(options['setupFilename'], 'w')
+        outputSetup(specification, options, setupFile)
+        setupFile.close()
+        loaderFile = open(loaderFilename, 'w')
+        outputLoader(specification, options, loaderFile)
+        loaderFile.close()
+    except EnvironmentError as envErr:
+        giveUp("Output environment error", envErr)
+    if options['verbose']:
+        print("Finished processing {}.".format(name))
+
+
+# Execute the following when run from the command line.
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
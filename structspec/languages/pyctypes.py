@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Support for Python ctypes structures
+
+Provides everything needed to output a Python module of ctypes
+structures laid out exactly like the binary packets. Overlaying
+one on a buffer with from_buffer gives access to the fields of a
+packet without decoding it first.
+"""
+
+from os.path import basename
+from zope.interface import moduleProvides
+from structspec.common import writeOut, writeOutBlock, giveUp, \
+    getPacketLayout, getPacketSize
+from structspec.interfaces import ILanguage
+from structspec.languages.python import endianByteOrder, int24Signed
+
+moduleProvides(ILanguage)
+
+name = "ctypes"
+filenameExtension = 'py'
+
+# The ctypes base classes for each endianness
+endianStructure = {
+    "big": 'BigEndianStructure',
+    "network": 'BigEndianStructure',
+    "little": 'LittleEndianStructure'
+}
+
+# The ctypes types for types with no fixed-size integer equivalent
+typeCtype = {
+    "char": 'c_char',
+    "hollerith": 'c_char',
+    "string": 'c_char',
+    "str": 'c_char',
+    "float": 'c_float',
+    "double": 'c_double',
+    "boolean": 'c_bool',
+    "_Bool": 'c_bool',
+    "bool": 'c_uint16',
+    "pointer": 'c_uint16',
+    "void": 'c_uint16',
+    "padding": 'c_uint8',
+    "pascal": 'c_uint8'
+}
+
+
+# Support for items kept other than as plain fields
+ctypesHelpers = '''def _nestedStructure(baseClass, fields):
+    """Makes a structure for items nested in another structure."""
+    return type(baseClass.__name__, (baseClass,),
+                {'_pack_': 1, '_fields_': fields})
+
+
+def _nestedProperty(storage, name):
+    """Gives a property reaching an item of a nested structure."""
+    def getValue(self):
+        return getattr(getattr(self, storage), name)
+
+    def setValue(self, value):
+        setattr(getattr(self, storage), name, value)
+    return property(getValue, setValue)
+
+
+def _int24Property(storage, count, byteOrder, signed):
+    """Gives a property converting 24-bit integers kept as bytes."""
+    lowest = -(1 << 23) if signed else 0
+
+    def getValue(self):
+        rawData = bytearray(getattr(self, storage))
+        values = []
+        for position in range(0, 3 * count, 3):
+            packed = rawData[position:position + 3]
+            if byteOrder == 'little':
+                packed.reverse()
+            value = packed[0] << 16 | packed[1] << 8 | packed[2]
+            if signed and value & 0x800000:
+                value -= 1 << 24
+            values.append(value)
+        return values[0] if count == 1 else values
+
+    def setValue(self, values):
+        if count == 1:
+            values = [values]
+        if len(values) != count:
+            raise ValueError('Expected {} values'.format(count))
+        rawData = bytearray()
+        for value in values:
+            if not lowest <= value < lowest + (1 << 24):
+                raise ValueError('{} does not fit in 24 bits'.format(value))
+            packed = bytearray([value >> 16 & 0xff, value >> 8 & 0xff,
+                                value & 0xff])
+            if byteOrder == 'little':
+                packed.reverse()
+            rawData.extend(packed)
+        getattr(self, storage)[:] = list(rawData)
+    return property(getValue, setValue)'''
+
+
+def getCtype(item):
+    """
+    Gets the ctypes type for a structure item.
+
+    The type is that of the item in its own byte order; see
+    getFields for items whose byte order differs from that of the
+    structure they are placed in.
+
+    Args:
+        item (dict): The layout of the structure item.
+
+    Returns:
+        A Python expression for the ctypes type.
+
+    Examples:
+        >>> item = {'type': 'uint16_t', 'size': 2, 'count': 1,
+        ...         'kind': 'field', 'endianness': 'big'}
+        >>> getCtype(item)
+        'c_uint16'
+        >>> getCtype(dict(item, type='long', size=4, count=3))
+        'c_int32 * 3'
+        >>> getCtype(dict(item, type='int24_t', size=3))
+        'c_uint8 * 3'
+        >>> getCtype(dict(item, type='header', kind='substructure'))
+        'header'
+    """
+    if item['kind'] == 'substructure':
+        ctype = item['type']
+    elif item['size'] not in (1, 2, 4, 8):
+        return 'c_uint8 * {}'.format(item['size'] * item['count'])
+    elif item['type'] in typeCtype:
+        ctype = typeCtype[item['type']]
+    elif item['type'].startswith('u'):
+        ctype = 'c_uint{}'.format(item['size'] * 8)
+    else:
+        ctype = 'c_int{}'.format(item['size'] * 8)
+    if item['count'] > 1:
+        ctype = '{} * {}'.format(ctype, item['count'])
+    return ctype
+
+
+def isSwapped(item, packetEndianness):
+    """
+    Determines whether an item needs a structure of its own byte order.
+
+    ctypes structures convert every field to their own byte order,
+    even fields declared with an explicitly swapped type, so an item
+    of another byte order is kept in a nested structure instead.
+
+    Args:
+        item (dict):            The layout of the structure item.
+        packetEndianness (str): The endianness of the structure
+                                the item is placed in.
+
+    Returns:
+        True if the item must be nested.
+
+    Examples:
+        >>> item = {'size': 2, 'kind': 'field', 'endianness': 'big'}
+        >>> isSwapped(item, 'network')
+        False
+        >>> isSwapped(item, 'little')
+        True
+        >>> isSwapped(dict(item, size=1), 'little')
+        False
+    """
+    return item['kind'] != 'substructure' and item['size'] > 1 and \
+        endianStructure.get(item['endianness'], 'Structure') != \
+        endianStructure.get(packetEndianness, 'Structure')
+
+
+def hasStructure(packetName, specification, layouts=None):
+    """
+    Determines whether a packet can be given a ctypes structure.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts,
+                              which also keeps the answer.
+
+    Returns:
+        True if the packet is of fixed size and all its
+        substructures can be given ctypes structures too.
+    """
+    if layouts is not None and ('structure', packetName) in layouts:
+        return layouts[('structure', packetName)]
+    structure = getPacketSize(packetName, specification, layouts) is not None
+    if structure:
+        structure = all([hasStructure(item['type'], specification, layouts)
+                         for item in getPacketLayout(packetName,
+                                                     specification, layouts)
+                         if item['kind'] == 'substructure'])
+    if layouts is not None:
+        layouts[('structure', packetName)] = structure
+    return structure
+
+
+def getFields(packetName, specification, layouts=None):
+    """
+    Gets the ctypes field list and properties for a packet.
+
+    Each run of bitfields is declared with the unsigned type of
+    its container so that ctypes packs them together. In big
+    endian structures ctypes fills containers from the most
+    significant bit down, so the run is declared in reverse
+    behind an unnamed filler to keep the first bitfield in the
+    least significant bits as everywhere else.
+
+    Items whose byte order differs from the packet's, and runs of
+    such bitfields, are kept in nested structures of their own
+    byte order, and 24-bit integers as raw bytes; either way they
+    are stored under an underscored name and reached through a
+    property of the item's own name.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        A tuple of two lists of strings, the first the Python source
+        for each entry of _fields_ and the second that for each
+        property.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': {'flags': {
+        ...     'endianness': 'big', 'structure': OrderedDict([
+        ...         ('a', {'type': 'uint8_t', 'size': 3}),
+        ...         ('b', {'type': 'uint8_t', 'size': 6}),
+        ...         ('c', {'type': 'int16_t'}),
+        ...         ('d', {'type': 'int24_t'})])}}}
+        >>> fields, properties = getFields('flags', spec)
+        >>> for field in fields + properties:
+        ...     print(field)
+        ('_fill0', c_uint16, 7)
+        ('b', c_uint16, 6)
+        ('a', c_uint16, 3)
+        ('c', c_int16)
+        ('_d', c_uint8 * 3)
+        d = _int24Property('_d', 1, 'big', True)
+        >>> spec['packets']['flags']['endianness'] = 'little'
+        >>> spec['packets']['flags']['structure']['c']['endianness'] = 'big'
+        >>> fields, properties = getFields('flags', spec)
+        >>> for field in fields + properties:
+        ...     print(field)
+        ('a', c_uint16, 3)
+        ('b', c_uint16, 6)
+        ('_c', _nestedStructure(BigEndianStructure, [('value', c_int16)]))
+        ('_d', c_uint8 * 3)
+        c = _nestedProperty('_c', 'value')
+        d = _int24Property('_d', 1, 'little', True)
+    """
+    packet = specification['packets'][packetName]
+    packetEndianness = packet.get('endianness',
+                                  specification.get('endianness', ''))
+    layout = getPacketLayout(packetName, specification, layouts)
+    fields = []
+    properties = []
+    bitFieldRun = []
+    for itemNum, item in enumerate(layout):
+        if item['kind'] != 'bitfield':
+            if item['type'] in int24Signed and item['kind'] == 'field':
+                fields.append("('_{}', {})".format(item['name'],
+                                                   getCtype(item)))
+                properties.append("{0} = _int24Property('_{0}', {1}, {2}, "
+                                  "{3})".format(
+                                      item['name'], item['count'],
+                                      endianByteOrder.get(item['endianness'],
+                                                          'byteorder'),
+                                      int24Signed[item['type']]))
+            elif isSwapped(item, packetEndianness):
+                fields.append("('_{}', _nestedStructure({}, [('value', "
+                              "{})]))".format(
+                                  item['name'],
+                                  endianStructure[item['endianness']],
+                                  getCtype(item)))
+                properties.append("{0} = _nestedProperty('_{0}', "
+                                  "'value')".format(item['name']))
+            else:
+                fields.append("('{}', {})".format(item['name'],
+                                                  getCtype(item)))
+            continue
+        bitFieldRun.append(item)
+        if itemNum + 1 < len(layout) and \
+                layout[itemNum + 1]['kind'] == 'bitfield' and \
+                layout[itemNum + 1]['offset'] == item['offset']:
+            continue
+        containerType = 'c_uint{}'.format(item['size'] * 8)
+        runFields = []
+        if endianStructure.get(item['endianness'], '').startswith('Big'):
+            fillBits = item['size'] * 8 - item['bitOffset'] - \
+                item['bitSize']
+            if fillBits:
+                runFields.append("('_fill{}', {}, {})".format(
+                    item['offset'], containerType, fillBits))
+            bitFieldRun.reverse()
+        for bitField in bitFieldRun:
+            runFields.append("('{}', {}, {})".format(
+                bitField['name'], containerType, bitField['bitSize']))
+        if isSwapped(item, packetEndianness):
+            fields.append("('_bits{}', _nestedStructure({}, [{}]))".format(
+                item['offset'], endianStructure[item['endianness']],
+                ', '.join(runFields)))
+            properties.extend(["{0} = _nestedProperty('_bits{1}', "
+                               "'{0}')".format(bitField['name'],
+                                               item['offset'])
+                               for bitField in bitFieldRun])
+        else:
+            fields.extend(runFields)
+        bitFieldRun = []
+    return fields, properties
+
+
+def outputCtypes(specification, options, pyFile):
+    """
+    Outputs Python ctypes file.
+
+    Given the specification construct a valid Python file
+    defining a ctypes structure for every binary packet.
+
+    Args:
+        specification (dict): The specification object.
+        options (dict):       A dictionary of options to
+                              modify output.
+        pyFile (file):        A file-like object to which
+                              to save the structures.
+    """
+    assert isinstance(specification, dict)
+    assert isinstance(options, dict)
+    assert hasattr(pyFile, 'write')
+    prefix = '    '
+    layouts = {}
+    writeOut(pyFile, '#!/usr/bin/env python')
+    writeOut(pyFile, '# -*- coding: utf-8 -*-')
+    writeOut(pyFile, '"""')
+    writeOut(pyFile, specification['title'])
+    writeOut(pyFile, '')
+    writeOutBlock(pyFile, 'ctypes structures with the exact layout of the '
+                  'binary packets. Use from_buffer to overlay one on a '
+                  'bytearray, mmap or other writable buffer.')
+    writeOut(pyFile, '"""')
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'from ctypes import BigEndianStructure, '
+             'LittleEndianStructure, Structure, \\')
+    writeOut(pyFile, 'c_bool, c_char, c_float, c_double, c_int8, c_int16, '
+             'c_int32, c_int64, \\', prefix)
+    writeOut(pyFile, 'c_uint8, c_uint16, c_uint32, c_uint64, sizeof',
+             prefix)
+    writeOut(pyFile, 'from sys import byteorder')
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+    writeOut(pyFile, ctypesHelpers)
+    for packetName, packet in specification['packets'].items():
+        writeOut(pyFile, '')
+        writeOut(pyFile, '')
+        if not hasStructure(packetName, specification, layouts):
+            writeOut(pyFile, '# {} varies in size so has no structure.'.format(
+                     packetName))
+            continue
+        baseClass = endianStructure.get(
+            packet.get('endianness', specification.get('endianness', '')),
+            'Structure')
+        writeOut(pyFile, 'class {}({}):'.format(packetName, baseClass))
+        writeOut(pyFile, '"""', prefix)
+        writeOut(pyFile, packet.get('title', packetName), prefix)
+        if 'description' in packet:
+            writeOut(pyFile, '')
+            writeOutBlock(pyFile, packet['description'], prefix)
+        writeOut(pyFile, '')
+        writeOut(pyFile, 'Examples:', prefix)
+        writeOut(pyFile, '>>> sizeof({})'.format(packetName), 2 * prefix)
+        writeOut(pyFile, '{}'.format(getPacketSize(packetName, specification,
+                                                   layouts)), 2 * prefix)
+        writeOut(pyFile, '"""', prefix)
+        writeOut(pyFile, '_pack_ = 1', prefix)
+        fields, properties = getFields(packetName, specification, layouts)
+        writeOut(pyFile, '_fields_ = [', prefix)
+        for field in fields:
+            writeOut(pyFile, '{},'.format(field), 2 * prefix)
+        writeOut(pyFile, ']', prefix)
+        for itemProperty in properties:
+            writeOut(pyFile, itemProperty, prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'if __name__ == "__main__":')
+    writeOut(pyFile, 'import doctest', prefix)
+    writeOut(pyFile, 'doctest.testmod()', prefix)
+
+
+def outputForLanguage(specification, options):
+    """
+    Outputs handler files for given language.
+
+    Creates files to process given specification in given
+    programming language.  Bases output file names on given
+    input specification file.
+
+    Args:
+        specification (dict): The specification object.
+        options (dict):       Command-line options.
+    """
+    assert isinstance(specification, dict)
+    assert isinstance(options, dict)
+    if options['verbose']:
+        print("Processing {}...".format(name))
+    filenameBase = basename(options['specificationName'])
+    if '.' in filenameBase:
+        filenameBase = filenameBase[:filenameBase.rfind('.')]
+    try:
+        pyFilename = "{}_ctypes.{}".format(filenameBase, filenameExtension)
+        pyFile = open(pyFilename, 'w')
+        outputCtypes(specification, options, pyFile)
+        pyFile.close()
+    except EnvironmentError as envErr:
+        giveUp("Output environment error", envErr)
+    if options['verbose']:
+        print("Finished processing {}.".format(name))
+
+
+# Execute the following when run from the command line.
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
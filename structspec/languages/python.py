@@ -7,18 +7,23 @@ Provides everything needed to output files that support the
 binary format in the Python programming language.
 """
 
+from collections import OrderedDict
 from math import pow
 from os.path import basename
 from os import linesep
 from re import compile as regexpcompile
-from struct import calcsize
+from struct import calcsize, pack, error as StructError
 try:
     from cStringIO import StringIO
 except ImportError:
     from io import StringIO
 from zope.interface import moduleProvides
+from six import string_types
 from structspec.common import writeOut, writeOutBlock, giveUp, getJsonPointer, \
-    isStringType, isFloatType, isBooleanType, schemaVal, typeSizes
+    isStringType, isFloatType, isBooleanType, isPadding, isBitField, \
+    getEndianness, getLabel, getTypeName, resolveBitSize, resolveConstraint, \
+    resolveMembers, resolveCount, getPacketLayout, getPacketSize, \
+    flattenLayout, getFieldOffsets, getEnumValues, isEnumType, getEnumType
 from structspec.interfaces import ILanguage
 
 moduleProvides(ILanguage)
@@ -59,15 +64,13 @@ typeFormatChar = {
     "float": 'f',
     "double": 'd',
     "long double": 'QQ',
-    "bool": 'i',
+    "bool": 'H',
     "boolean": '?',
     "_Bool": '?',
     "int8_t": 'b',
     "uint8_t": 'B',
     "int16_t": 'h',
     "uint16_t": 'H',
-    "int24_t": 'BH',
-    "uint24_t": 'BH',
     "int32_t": 'l',
     "uint32_t": 'L',
     "int64_t": 'q',
@@ -81,19 +84,511 @@ typeFormatChar = {
     "padding": 'x'
 }
 
-# The Python struct library characters for endianness
+# The Python struct library characters for endianness; native packets
+# use the native byte order but are packed without alignment, as the
+# C handlers and wire layouts have them
 endianFormatChar = {
     "big": '>',
     "little": '<',
     "network": '!',
-    "native": '@'
+    "native": '='
 }
 
+# Whether each 24-bit integer type is signed; struct has no format
+# character for them so they are converted separately
+int24Signed = {
+    "int24_t": True,
+    "uint24_t": False
+}
+
+# The int.from_bytes byte orders for endianness
+endianByteOrder = {
+    "big": "'big'",
+    "little": "'little'",
+    "network": "'big'",
+    "native": 'byteorder'
+}
+
+# The NumPy type codes for struct format characters
+formatDtype = {
+    "b": 'i1',
+    "B": 'u1',
+    "h": 'i2',
+    "H": 'u2',
+    "i": 'i4',
+    "I": 'u4',
+    "l": 'i4',
+    "L": 'u4',
+    "q": 'i8',
+    "Q": 'u8',
+    "f": 'f4',
+    "d": 'f8',
+    "?": 'b1',
+    "c": 'S1',
+    "s": 'S'
+}
+
+# The array module type codes for struct format characters
+formatTypecode = {
+    "b": 'b',
+    "B": 'B',
+    "h": 'h',
+    "H": 'H',
+    "i": 'i',
+    "I": 'I',
+    "l": 'l',
+    "L": 'L',
+    "q": 'q',
+    "Q": 'Q',
+    "f": 'f',
+    "d": 'd',
+    "?": 'B'
+}
+
+# The NumPy byte order characters for endianness
+endianDtypeChar = {
+    "big": '>',
+    "little": '<',
+    "network": '>',
+    "native": '='
+}
+
+# Column access used by all generated batch validators
+columnHelpers = '''def _getColumn(columns, name):
+    """Gets a column by dotted name from a dict or record array."""
+    try:
+        return columns[name]
+    except (KeyError, ValueError, IndexError):
+        column = columns
+        for part in name.split('.'):
+            column = column[part]
+        return column
+
+
+def _anyPerRow(failing):
+    """Reduces a mask over repeated values to one per row."""
+    if failing.ndim > 1:
+        return failing.reshape(failing.shape[0], -1).any(axis=1)
+    return failing
+'''
+
+# Integer enumeration support used by all generated enumeration classes
+enumHelpers = '''class _Enumeration(int):
+    """An integer constant from an enumeration, kept as a singleton."""
+    __slots__ = ()
+    names = {}
+    values = {}
+    members = {}
+
+    def __new__(cls, value):
+        try:
+            return cls.members[value]
+        except KeyError:
+            raise ValueError('{} is not a valid {}'.format(value,
+                                                          cls.__name__))
+
+    @property
+    def name(self):
+        """The name of the enumeration option."""
+        return self.names[self]
+
+    def __repr__(self):
+        return '{}.{}'.format(self.__class__.__name__, self.names[self])
+
+
+def _enumerate(cls):
+    """Creates the singleton members of an enumeration class."""
+    cls.members = dict([(value, int.__new__(cls, value))
+                        for value in cls.names])
+    for optionName, value in cls.values.items():
+        setattr(cls, optionName, cls.members[value])
+'''
+
+# Instrumentation support used when counters are requested
+counterImports = '''from functools import wraps
+try:
+    from time import perf_counter_ns as _clock
+except ImportError:
+    from timeit import default_timer
+
+    def _clock():
+        """Returns the time in nanoseconds."""
+        return int(default_timer() * 1e9)'''
+
+counterHelpers = '''def snapshot_counters():
+    """
+    Takes a snapshot of the instrumentation counters.
+
+    The counters are copied in a single step so this may safely
+    be called from another thread while packets are processed.
+
+    Returns:
+        A dictionary keyed by packet name then by operation
+        ('pack' or 'unpack') of dictionaries giving the calls,
+        bytes, nanoseconds and errors counted.
+    """
+    values = _counters.tolist()
+    snapshot = {}
+    position = 0
+    for packetName in _counterPackets:
+        snapshot[packetName] = {}
+        for operation in _counterOperations:
+            snapshot[packetName][operation] = dict(zip(
+                _counterNames, [int(value) for value in
+                                values[position:position + 4]]))
+            position += 4
+    return snapshot
+
+
+def reset_counters():
+    """Sets all the instrumentation counters back to zero."""
+    for position in range(len(_counters)):
+        _counters[position] = 0.0
+
+
+def _instrument(function, packetName, operation, length=None):
+    """
+    Wraps a pack or unpack function to update its counters.
+
+    Updates from several threads at once may occasionally be lost;
+    the counters are meant for finding where time goes, not for
+    accounting.
+    """
+    base = 4 * (len(_counterOperations) * _counterPackets.index(packetName) +
+                _counterOperations.index(operation))
+
+    @wraps(function)
+    def instrumented(data):
+        start = _clock()
+        try:
+            result = function(data)
+        except Exception:
+            _counters[base + 3] += 1
+            raise
+        _counters[base + 2] += _clock() - start
+        _counters[base] += 1
+        if length is None:
+            _counters[base + 1] += len(result)
+        elif callable(length):
+            _counters[base + 1] += length(result)
+        else:
+            _counters[base + 1] += length
+        return result
+    return instrumented
+'''
+
+# Compiled formats for items whose count is held by another item
+structCacheImports = '''try:
+    from functools import lru_cache
+except ImportError:
+    lru_cache = None'''
+
+structCacheHelpers = '''# How many compiled formats for repeated values are kept
+_structCacheSize = 64
+
+
+def _compileStruct(endianChar, formatChar, count):
+    """Compiles the format for a number of repeated values."""
+    return Struct('{}{}{}'.format(endianChar, count, formatChar))
+
+
+if lru_cache is not None:
+    _getStruct = lru_cache(maxsize=_structCacheSize)(_compileStruct)
+else:
+    _structCache = OrderedDict()
+
+    def _getStruct(endianChar, formatChar, count):
+        """Fetches a compiled format, keeping the most recently used."""
+        key = (endianChar, formatChar, count)
+        compiled = _structCache.pop(key, None)
+        if compiled is None:
+            compiled = _compileStruct(endianChar, formatChar, count)
+            if len(_structCache) >= _structCacheSize:
+                _structCache.popitem(False)
+        _structCache[key] = compiled
+        return compiled'''
+
+# Conversion of 24-bit integers, singly and in bulk
+int24Imports = '''from sys import byteorder'''
+
+int24Helpers = '''# The formats 24-bit integers are widened to without int.from_bytes
+_int24Formats = {
+    ('big', True): '>i',
+    ('big', False): '>I',
+    ('little', True): '<i',
+    ('little', False): '<I'
+}
+
+# The NumPy types 24-bit integers are widened to
+_int24Dtypes = {
+    ('big', True): '>i4',
+    ('big', False): '>u4',
+    ('little', True): '<i4',
+    ('little', False): '<u4'
+}
+
+if hasattr(int, 'from_bytes'):
+    def _getInt24(rawData, position, byteOrder, signed):
+        """Reads a single 24-bit integer."""
+        return int.from_bytes(rawData[position:position + 3], byteOrder,
+                              signed=signed)
+
+    def _putInt24(value, byteOrder, signed):
+        """Writes a single 24-bit integer."""
+        return value.to_bytes(3, byteOrder, signed=signed)
+else:
+    def _getInt24(rawData, position, byteOrder, signed):
+        """Reads a single 24-bit integer."""
+        if byteOrder == 'big':
+            widened = rawData[position:position + 3] + b'\\0'
+        else:
+            widened = b'\\0' + rawData[position:position + 3]
+        return unpack_from(_int24Formats[byteOrder, signed], widened)[0] >> 8
+
+    def _putInt24(value, byteOrder, signed):
+        """Writes a single 24-bit integer."""
+        widened = pack(_int24Formats[byteOrder, signed], value << 8)
+        if byteOrder == 'big':
+            return widened[:3]
+        return widened[1:]
+
+
+def _widenInt24(packed, byteOrder, signed):
+    """
+    Widens 24-bit integers held as rows of three bytes.
+
+    Each is placed in the high bytes of 32 bits so that shifting
+    back down extends the sign. Requires NumPy.
+    """
+    if byteOrder == 'native':
+        byteOrder = byteorder
+    widened = numpy.zeros(packed.shape[:-1] + (4,), numpy.uint8)
+    if byteOrder == 'big':
+        widened[..., :3] = packed
+    else:
+        widened[..., 1:] = packed
+    return widened.view(_int24Dtypes[byteOrder, signed])[..., 0] >> 8
+
+
+def _narrowInt24(values, byteOrder, signed):
+    """
+    Narrows integers to rows of three bytes.
+
+    Requires NumPy.
+    """
+    if byteOrder == 'native':
+        byteOrder = byteorder
+    widened = numpy.asarray(values, numpy.int64)
+    if signed:
+        lowest, highest = -2 ** 23, 2 ** 23 - 1
+    else:
+        lowest, highest = 0, 2 ** 24 - 1
+    if widened.size and (widened.min() < lowest or widened.max() > highest):
+        raise OverflowError('24-bit integer out of range')
+    widened = (widened << 8).astype(_int24Dtypes[byteOrder, signed])
+    widened = widened.reshape(widened.shape + (1,)).view(numpy.uint8)
+    if byteOrder == 'big':
+        return widened[..., :3]
+    return widened[..., 1:]
+
+
+def _getInt24Array(rawData, position, count, byteOrder, signed):
+    """Reads a number of 24-bit integers, all at once with NumPy."""
+    if numpy is None or not count:
+        return [_getInt24(rawData, position + 3 * index, byteOrder, signed)
+                for index in range(count)]
+    packed = numpy.frombuffer(rawData, numpy.uint8, 3 * count,
+                              position).reshape(count, 3)
+    return _widenInt24(packed, byteOrder, signed).tolist()
+
+
+def _putInt24Array(values, count, byteOrder, signed):
+    """Writes a number of 24-bit integers, all at once with NumPy."""
+    if len(values) != count:
+        raise ValueError('Expected {} values, not {}'.format(count,
+                                                             len(values)))
+    if numpy is None or not count:
+        return b''.join([_putInt24(value, byteOrder, signed)
+                         for value in values])
+    return _narrowInt24(values, byteOrder, signed).tobytes()'''
+
+# The tables of each packet the structspec runtime works from, and
+# wrappers handing it this module's globals
+runtimeHelpers = '''# The functions unpacking each packet into an existing record
+_recordUnpackers = {}
+
+# The layouts of the fields of each packet by dotted name
+_fieldLayouts = {}
+
+# The dotted names of the fields fixing the length of each packet,
+# empty for packets of fixed size or None if not at fixed offsets
+_lengthFields = {}
+
+# The offset of a telling identifying field of each packet and the
+# packed forms of its permitted values, or None if it has none
+_resyncAnchors = {}
+
+# The functions packing runs of each packet into an existing buffer
+_runPackers = {}
+
+CaptureReader = _runtime.CaptureReader
+open_capture = _runtime.openCapture
+
+
+class RecordPool(_runtime.RecordPool):
+    """A free list of records to unpack this module's packets into."""
+    recordUnpackers = _recordUnpackers
+
+
+def make_unpacker(packetName, fields):
+    """Makes a function unpacking only some fields of a packet."""
+    return _runtime.makeUnpacker(globals(), packetName, fields)
+
+
+def scan(path, packetName, where=None, chunkSize=1 << 24):
+    """Finds the packets in a capture file meeting some conditions."""
+    return _runtime.scan(globals(), path, packetName, where, chunkSize)
+
+
+def resync(path, packetName, confirm=3, chunkSize=1 << 24,
+           lookAhead=1 << 16):
+    """Reads the packets of a capture file that may be corrupt."""
+    return _runtime.resync(globals(), path, packetName, confirm, chunkSize,
+                           lookAhead)
+
+
+def _packMany(packetName, records, packetLen, processes, chunkLen):
+    """Packs packets end to end into a buffer sized exactly beforehand."""
+    return _runtime.packMany(globals(), packetName, records, packetLen,
+                             processes, chunkLen)'''
+
+# Conversion of whole columns of packets
+columnCodecHelpers = '''# NumPy record types overlaying packets, made when first needed
+_recordTypes = {}
+
+
+def _getRecordType(fields, recordSize):
+    """Gets the NumPy record type overlaying the fields of a packet."""
+    recordType = _recordTypes.get(fields)
+    if recordType is None:
+        formats = OrderedDict()
+        for name, key, fmt, offset, count, kind, extra, typecode in fields:
+            formats[key] = (fmt, offset)
+        recordType = _recordTypes[fields] = numpy.dtype({
+            'names': list(formats.keys()),
+            'formats': [fmt for fmt, offset in formats.values()],
+            'offsets': [offset for fmt, offset in formats.values()],
+            'itemsize': recordSize
+        })
+    return recordType
+
+
+def _getDotted(record, name):
+    """Gets a value by dotted name from nested dicts."""
+    for part in name.split('.'):
+        record = record[part]
+    return record
+
+
+def _setDotted(record, name, value):
+    """Sets a value by dotted name in nested dicts."""
+    parts = name.split('.')
+    for part in parts[:-1]:
+        record = record.setdefault(part, {})
+    record[parts[-1]] = value
+
+
+def _newColumn(typecode):
+    """Makes an empty column, a list if an array cannot hold it."""
+    try:
+        return array(typecode)
+    except (TypeError, ValueError):
+        return []
+
+
+def _unpackColumns(buffer, count, recordSize, fields, unpackRecord):
+    """Unpacks packets laid end to end into a column per field."""
+    available = len(buffer) // recordSize
+    if count is None:
+        count = available
+    elif count > available:
+        raise ValueError('Only {} whole packets available'.format(available))
+    columns = OrderedDict()
+    if numpy is not None:
+        records = numpy.frombuffer(buffer, _getRecordType(fields, recordSize),
+                                   count)
+        for name, key, fmt, offset, elementCount, kind, extra, typecode \\
+                in fields:
+            column = records[key]
+            if kind == 'bits':
+                column = (column >> extra[0]) & ((1 << extra[1]) - 1)
+            elif kind == 'int24':
+                column = _widenInt24(column, *extra)
+            columns[name] = column.astype(column.dtype.newbyteorder('='))
+        return columns
+    if not isinstance(buffer, bytes):
+        buffer = bytes(bytearray(buffer))
+    for field in fields:
+        columns[field[0]] = _newColumn(field[7])
+    for position in range(0, count * recordSize, recordSize):
+        record = unpackRecord(buffer[position:position + recordSize])
+        for field in fields:
+            if field[4] == 1:
+                columns[field[0]].append(_getDotted(record, field[0]))
+            else:
+                columns[field[0]].extend(_getDotted(record, field[0]))
+    return columns
+
+
+def _packColumns(columns, recordSize, fields, packRecord):
+    """Packs a column per field into packets laid end to end."""
+    if not fields:
+        return b''
+    first = _getColumn(columns, fields[0][0])
+    if getattr(first, 'ndim', 1) > 1:
+        count = len(first)
+    else:
+        count = len(first) // fields[0][4]
+    if numpy is not None:
+        records = numpy.zeros(count, _getRecordType(fields, recordSize))
+        for name, key, fmt, offset, elementCount, kind, extra, typecode \\
+                in fields:
+            column = numpy.asarray(_getColumn(columns, name))
+            if kind == 'bits':
+                container = records.dtype[key].newbyteorder('=')
+                column = column.astype(container) & container.type(
+                    (1 << extra[1]) - 1)
+                records[key] |= column << container.type(extra[0])
+            elif kind == 'int24':
+                records[key] = _narrowInt24(
+                    column.reshape(records[key].shape[:-1]), *extra)
+            else:
+                records[key] = column.reshape(records[key].shape)
+        return records.tobytes()
+    fieldColumns = [(field[0], field[4], _getColumn(columns, field[0]))
+                    for field in fields]
+    outList = []
+    for row in range(count):
+        record = {}
+        for name, elementCount, column in fieldColumns:
+            if elementCount == 1:
+                _setDotted(record, name, column[row])
+            else:
+                _setDotted(record, name, list(
+                    column[row * elementCount:(row + 1) * elementCount]))
+        outList.append(packRecord(record))
+    return b''.join(outList)'''
+
+# The most permitted values an identifying field may have for its
+# packed forms to be searched for when resynchronizing
+maxAnchorPatterns = 16
+
 # compiled regular expressions
 varNameRE = regexpcompile(r'^[A-Z_a-z]\w*$')
 exprPortion = r'[,\w\s+*/%()\[\]-]+'
 exprRE = regexpcompile(r'^{}$'.format(exprPortion))
-structFmtRE = regexpcompile(r'^"([>}}{{!=<@]*[cbBhHiIlLqQfd?spPx}}{{]+)"(\.format\({}\))*$'.format(exprPortion))
+structFmtRE = regexpcompile(r'^"([>}}{{!=<@]*[0-9cbBhHiIlLqQfd?spPx}}{{]+)"(\.format\({}\))*$'.format(exprPortion))
+fieldRE = regexpcompile(r"packet\['(\w+)'\]")
 
 
 def outputEnumerations(enumerationSpec, options, pyFile):
@@ -182,9 +677,94 @@ def outputEnumerations(enumerationSpec, options, pyFile):
             newLocals.append((optionName, value))
         writeOut(pyFile, '')
         writeOut(pyFile, '')
+        if isIntegerEnum(enumerationName, enumeration):
+            outputEnumerationClass(enumerationName, enumeration, pyFile)
     return newLocals
 
 
+def isIntegerEnum(enumerationName, enumeration):
+    """
+    Determines whether an enumeration gets a class of its own.
+
+    Only enumerations with a usable name whose options all have
+    integer values get classes.
+
+    Args:
+        enumerationName (str): The name of the enumeration.
+        enumeration (dict):    The definition of the enumeration.
+
+    Returns:
+        True if it gets a class, False otherwise.
+
+    Examples:
+        >>> isIntegerEnum('Kind', {'options': {'A': {'value': 1}}})
+        True
+        >>> isIntegerEnum('Kind', {'options': {'A': {'value': 'a'}}})
+        False
+        >>> isIntegerEnum('Kind', {'options': {'A': {'value': True}}})
+        False
+    """
+    if not varNameRE.match(enumerationName):
+        return False
+    for value in getEnumValues(enumeration).values():
+        if not isinstance(value, int) or isinstance(value, bool):
+            return False
+    return True
+
+
+def outputEnumerationClass(enumerationName, enumeration, pyFile):
+    """
+    Outputs the class for an enumeration into a Python file.
+
+    The class is an integer subclass with one shared instance
+    per option and dictionaries mapping values to names and
+    names to values, so converting either way is a single
+    lookup.
+
+    Args:
+        enumerationName (str): The name of the enumeration.
+        enumeration (dict):    The definition of the enumeration.
+        pyFile (file):         A file-like object to which
+                               to save the struct code.
+    """
+    assert isinstance(enumeration, dict)
+    assert hasattr(pyFile, 'write')
+    prefix = '    '
+    values = getEnumValues(enumeration)
+    names = []
+    for optionName, value in values.items():
+        if value not in [knownValue for knownValue, knownName in names]:
+            names.append((value, optionName))
+    writeOut(pyFile, 'class {}(_Enumeration):'.format(enumerationName))
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, enumeration.get('title', enumerationName), prefix)
+    if 'description' in enumeration:
+        writeOut(pyFile, '')
+        writeOutBlock(pyFile, enumeration['description'], prefix)
+    if names:
+        writeOut(pyFile, '')
+        writeOut(pyFile, 'Examples:', prefix)
+        writeOut(pyFile, '>>> {}({})'.format(enumerationName, names[0][0]),
+                 2 * prefix)
+        writeOut(pyFile, '{}.{}'.format(enumerationName, names[0][1]),
+                 2 * prefix)
+        writeOut(pyFile, '>>> {}.values[{!r}]'.format(enumerationName,
+                                                       names[0][1]),
+                 2 * prefix)
+        writeOut(pyFile, '{}'.format(names[0][0]), 2 * prefix)
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, '__slots__ = ()', prefix)
+    writeOut(pyFile, 'names = {{{}}}'.format(', '.join(
+        ['{!r}: {!r}'.format(value, optionName)
+         for value, optionName in names])), prefix)
+    writeOut(pyFile, 'values = {{{}}}'.format(', '.join(
+        ['{!r}: {!r}'.format(optionName, value)
+         for optionName, value in values.items()])), prefix)
+    writeOut(pyFile, '_enumerate({})'.format(enumerationName))
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+
+
 def handleBitFields(bitFieldLen, bitFieldCount, structAccretions):
     """
     Transiently stores bitfield information.
@@ -240,7 +820,8 @@ def handleBitFields(bitFieldLen, bitFieldCount, structAccretions):
     return bitFieldCount
 
 
-def handleStructBreaks(structDefList, structAccretions, endianness=''):
+def handleStructBreaks(structDefList, structAccretions, endianness='',
+                       isArray=False):
     """
     Writes pending lines prior to a topic shift.
 
@@ -253,6 +834,9 @@ def handleStructBreaks(structDefList, structAccretions, endianness=''):
         structAccretions (dict): Structure information collected
                                  since last processing time.
         endianness (str):        The endianness.
+        isArray (bool):          Whether the pending items are
+                                 a single repeated value to be
+                                 kept as a list.
     """
     assert isinstance(structDefList, list)
     assert isinstance(structAccretions, dict)
@@ -271,14 +855,16 @@ def handleStructBreaks(structDefList, structAccretions, endianness=''):
         formatStr = "{}{}".format(endianFormatChar.get(endianness, ''),
                                   formatStr)
         varStr = ', '.join(structAccretions['varList'])
-        if len(structAccretions['varList']) > 1:
-            varStr = '({})'.format(varStr)
-        else:
-            varStr = '[{}]'.format(varStr)
+        if not isArray:
+            if len(structAccretions['varList']) > 1:
+                varStr = '({})'.format(varStr)
+            else:
+                varStr = '[{}]'.format(varStr)
         structDefList.append({
             'type': 'segment',
             'fmt': '"{}"{}'.format(formatStr, countStr),
             'vars': varStr,
+            'array': isArray,
             'bitFields': structAccretions['bitFields'],
             'endianness': endianness,
             'titles': structAccretions['titles'],
@@ -293,6 +879,52 @@ def handleStructBreaks(structDefList, structAccretions, endianness=''):
         structAccretions['descriptions'] = []
 
 
+def getVariableSize(structDef):
+    """
+    Gets the expression for the size of an item counted by another.
+
+    Args:
+        structDef (dict): The work list entry for the item.
+
+    Returns:
+        The Python source for its size in bytes.
+
+    Examples:
+        >>> getVariableSize({'elementSize': 2, 'countVar': "packet['n']"})
+        "2 * packet['n']"
+        >>> getVariableSize({'elementSize': 1, 'countVar': "packet['n']"})
+        "packet['n']"
+    """
+    if structDef['elementSize'] == 1:
+        return structDef['countVar']
+    return '{} * {}'.format(structDef['elementSize'], structDef['countVar'])
+
+
+def getSegmentSize(structDef):
+    """
+    Gets the expression for the size of a segment.
+
+    Segments whose format never changes have their size worked out
+    once here rather than each time a packet is handled.
+
+    Args:
+        structDef (dict): The work list entry for the segment.
+
+    Returns:
+        The Python source for its size in bytes.
+
+    Examples:
+        >>> getSegmentSize({'fmt': '"<Hb"'})
+        '3'
+        >>> getSegmentSize({'fmt': '"<{}h".format(COUNT)'})
+        'calcsize("<{}h".format(COUNT))'
+    """
+    fmt = structDef['fmt']
+    if fmt.startswith('"') and fmt.endswith('"'):
+        return str(calcsize(fmt[1:-1]))
+    return 'calcsize({})'.format(fmt)
+
+
 def populateWorkLists(packet, specification,
                       structDefList, structAccretions):
     """
@@ -326,12 +958,33 @@ def populateWorkLists(packet, specification,
         isinstance(structAccretions['varList'], list) and \
         isinstance(structAccretions['bitFields'], list)
     bitFieldCount = bitFieldLen = 0
+    segmentEndianness = None
     for structureName, structure in packet['structure'].items():
-        endianness = structure.get('endianness', packet.get('endianness',
-                                   specification.get('endianness', ''))).encode('utf-8')
-        if structure['type'].startswith('#/'):
+        endianness = getEndianness(structure, packet, specification)
+        typeName = structure['type']
+        if isEnumType(typeName):
+            typeName = getEnumType(typeName, specification)
+        isSubstructure = typeName.startswith('#/')
+        gotBitField = not isSubstructure and \
+            isBitField(structure, specification)
+        if gotBitField:
+            sizeInBits = resolveBitSize(structure, specification) or 0
+        # Bitfields share a container only while nothing else intervenes
+        # and they fit; segments share a single endianness.
+        if bitFieldLen and (not gotBitField or
+                            endianness != segmentEndianness or
+                            bitFieldLen + sizeInBits > 64):
+            bitFieldCount = handleBitFields(bitFieldLen, bitFieldCount,
+                                            structAccretions)
+            bitFieldLen = 0
+        if segmentEndianness is not None and \
+                endianness != segmentEndianness:
+            handleStructBreaks(structDefList, structAccretions,
+                               segmentEndianness)
+        segmentEndianness = endianness
+        if isSubstructure:
             handleStructBreaks(structDefList, structAccretions, endianness)
-            typeName = structure['type'][structure['type'].rfind('/') + 1:]
+            typeName = getTypeName(structure['type'])
             structDefList.append({
                 'type': 'substructure',
                 'itemName': structureName,
@@ -339,53 +992,1174 @@ def populateWorkLists(packet, specification,
                 'description': structure.get('description', None),
                 'title': structure.get('title', None)
             })
-        else:
-            typeName = structure['type']
-            if 'count' in structure:
-                if structure['count'].startswith('#/'):
-                    countLabel = structure['count'][:-len(schemaVal)]
-                    countLabel = countLabel[countLabel.rfind('/') + 1:]
-                    structAccretions['formatList'].append('{}')
-                    structAccretions['countList'].append(countLabel)
-                else:
-                    countLabel = structure['count']
-                    structAccretions['formatList'].append(countLabel)
-            gotBitField = False
-            if 'size' in structure:
-                if structure['size'].startswith('#/'):
-                    sizeLabel = structure['size'][:-len(schemaVal)]
-                    sizeLabel = sizeLabel[sizeLabel.rfind('/') + 1:]
-                    sizeInBits = resolveJsonPointer(specification,
-                                                    structure['size'][1:])
-                else:
-                    sizeLabel = structure['size']
-                    try:
-                        sizeInBits = int(sizeLabel)
-                    except ValueError:
-                        sizeInBits = 0
-                if sizeInBits != typeSizes.get(typeName, -1) or \
-                   sizeInBits % 8 != 0:
-                    gotBitField = True
-            if typeName in typeFormatChar and not gotBitField:
-                bitFieldCount = handleBitFields(bitFieldLen, bitFieldCount,
-                                                structAccretions)
-                bitFieldLen = 0
-                structAccretions['formatList'].append(typeFormatChar[typeName])
+        elif gotBitField:
+            bitFieldLen += sizeInBits
+            structAccretions['bitFields'].append(
+                ("packet['{}']".format(structureName),
+                 bitFieldCount, sizeInBits, structure['type']))
+        elif typeName in int24Signed:
+            count, countLabel = resolveCount(structure, packet, specification)
+            handleStructBreaks(structDefList, structAccretions, endianness)
+            isVariable = count is None and countLabel in packet['structure']
+            if isVariable:
+                countVar = "packet['{}']".format(countLabel)
+            else:
+                countVar = str(count)
+            structDefList.append({
+                'type': 'int24',
+                'itemName': structureName,
+                'count': count,
+                'countVar': countVar,
+                'variable': isVariable,
+                'byteOrder': endianByteOrder.get(endianness, 'byteorder'),
+                'signed': int24Signed[typeName],
+                'elementSize': 3,
+                'array': 'count' in structure
+            })
+        elif typeName in typeFormatChar:
+            formatChar = typeFormatChar[typeName]
+            count, countLabel = resolveCount(structure, packet, specification)
+            if count is None and countLabel in packet['structure']:
+                # The count is only known once the item holding it is
+                # read, so the item gets a segment of its own.
+                handleStructBreaks(structDefList, structAccretions,
+                                   endianness)
+                endianChar = endianFormatChar.get(endianness, '')
+                structDefList.append({
+                    'type': 'variable',
+                    'itemName': structureName,
+                    'countVar': "packet['{}']".format(countLabel),
+                    'endianChar': endianChar,
+                    'formatChar': formatChar,
+                    'elementSize': calcsize(endianChar + formatChar),
+                    'array': formatChar not in ('s', 'p', 'x'),
+                    'padding': isPadding(typeName)
+                })
+                continue
+            countStr = str(structure.get('count', ''))
+            if countStr and count is not None:
+                # Constant counts are folded in so formats never change.
+                countStr = str(count)
+            # Repeated values other than strings and padding come back
+            # as a list so they get a segment of their own.
+            isArray = bool(countStr) and formatChar not in ('s', 'p', 'x')
+            if isArray:
+                handleStructBreaks(structDefList, structAccretions,
+                                   endianness)
+            if countStr.startswith('#/'):
+                structAccretions['countList'].append(getLabel(countStr))
+                countStr = '{}'
+            structAccretions['formatList'].append(countStr + formatChar)
+            if not isPadding(typeName):
                 structAccretions['varList'].append(
                     "packet['{}']".format(structureName))
-                structAccretions['titles'].append(structure.get('title', None))
-                structAccretions['descriptions'].append(structure.get('title', None))
-            elif gotBitField:
-                bitFieldLen += sizeInBits
-                structAccretions['bitFields'].append(
-                    ("packet['{}']".format(structureName),
-                     bitFieldCount, sizeInBits, typeName))
+            structAccretions['titles'].append(structure.get('title', None))
+            structAccretions['descriptions'].append(
+                structure.get('title', None))
+            if isArray:
+                handleStructBreaks(structDefList, structAccretions,
+                                   endianness, True)
     bitFieldCount = handleBitFields(bitFieldLen, bitFieldCount,
                                     structAccretions)
-    handleStructBreaks(structDefList, structAccretions, endianness)
+    handleStructBreaks(structDefList, structAccretions,
+                       segmentEndianness or '')
     return bitFieldCount
 
 
+def getConstraints(structure, specification):
+    """
+    Gets the value constraints placed on a structure item.
+
+    Args:
+        structure (dict):     The definition of the item.
+        specification (dict): The specification object.
+
+    Returns:
+        A tuple containing the Python source for the minimum
+        and maximum permitted values and the list of permitted
+        values, each None if not constrained.
+
+    Examples:
+        >>> spec = {'enums': {'Limits': {'options': {'TOP': {'value': 9}}}}}
+        >>> getConstraints({'type': 'uint8_t'}, spec)
+        (None, None, None)
+        >>> getConstraints({'type': 'uint8_t', 'min': 2, 'max': 'TOP'}, spec)
+        ('2', '9', None)
+        >>> getConstraints({'type': 'uint8_t', 'max': 'TOP * 2',
+        ...                 'member': [1, 2, 4]}, spec)
+        (None, 'TOP * 2', [1, 2, 4])
+    """
+    limits = []
+    for limitName in ('min', 'max'):
+        if limitName in structure:
+            limit = resolveConstraint(structure[limitName], specification)
+            if isinstance(limit, string_types):
+                limits.append(str(limit))
+            else:
+                limits.append(repr(limit))
+        else:
+            limits.append(None)
+    members = None
+    if 'member' in structure:
+        members = resolveMembers(structure['member'], specification)
+    return (limits[0], limits[1], members)
+
+
+def getBitFieldMaximum(typeName, bitSize):
+    """
+    Gets the largest value a bitfield can hold.
+
+    Bitfields are packed and unpacked as unsigned whatever their
+    type, so hold values from zero up to this.
+
+    Args:
+        typeName (str): The name of the bitfield's type.
+        bitSize (int):  The width of the bitfield in bits.
+
+    Returns:
+        The largest value, or None if the bitfield is not of
+        an integer type.
+
+    Examples:
+        >>> getBitFieldMaximum('uint8_t', 3)
+        7
+        >>> getBitFieldMaximum('int16_t', 12)
+        4095
+        >>> getBitFieldMaximum('_Bool', 1) is None
+        True
+    """
+    if not bitSize or isFloatType(typeName) or isStringType(typeName) or \
+            typeFormatChar.get(typeName) == '?':
+        return None
+    return (1 << bitSize) - 1
+
+
+def hasVariableCount(packetName, specification, layouts=None):
+    """
+    Determines whether a packet has items counted by other items.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts,
+                              which also keeps the answer.
+
+    Returns:
+        True if the packet or any of its substructures has an
+        item whose count is held by another item.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': OrderedDict([
+        ...     ('blob', {'structure': OrderedDict([
+        ...         ('n', {'type': 'uint8_t'}),
+        ...         ('data', {'type': 'uint16_t', 'count': 'n'})])}),
+        ...     ('outer', {'structure': OrderedDict([
+        ...         ('inner', {'type': '#/packets/blob'})])}),
+        ...     ('fixed', {'structure': OrderedDict([
+        ...         ('data', {'type': 'uint16_t', 'count': 4})])})])}
+        >>> [hasVariableCount(packetName, spec)
+        ...  for packetName in spec['packets']]
+        [True, True, False]
+    """
+    if layouts is not None and ('variable', packetName) in layouts:
+        return layouts[('variable', packetName)]
+    structure = specification['packets'][packetName]['structure']
+    variable = False
+    for item in getPacketLayout(packetName, specification, layouts):
+        if item['kind'] == 'substructure':
+            variable = hasVariableCount(item['type'], specification, layouts)
+        else:
+            variable = item['count'] is None and \
+                item['countLabel'] in structure
+        if variable:
+            break
+    if layouts is not None:
+        layouts[('variable', packetName)] = variable
+    return variable
+
+
+def getColumnFields(packetName, specification, layouts=None):
+    """
+    Gets how each field of a packet is laid out as a column.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        A list with a tuple per field giving its dotted name, the
+        name of the NumPy record field holding it (shared by the
+        bitfields of a container), its NumPy type, byte offset,
+        count, kind ('value', 'bits' or 'int24'), the bit offset
+        and size or byte order and signedness needed to extract
+        it, and the array module type code for it. None if the
+        packet varies in size or holds types without columns.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'endianness': 'big', 'packets': OrderedDict([
+        ...     ('hdr', {'structure': OrderedDict([
+        ...         ('a', {'type': 'uint8_t', 'size': 3}),
+        ...         ('b', {'type': 'uint8_t', 'size': 5})])}),
+        ...     ('msg', {'structure': OrderedDict([
+        ...         ('head', {'type': '#/packets/hdr'}),
+        ...         ('vals', {'type': 'int16_t', 'count': 2}),
+        ...         ('name', {'type': 'string', 'count': 4}),
+        ...         ('gain', {'type': 'int24_t', 'endianness': 'little'})
+        ...     ])})])}
+        >>> for field in getColumnFields('msg', spec):
+        ...     print(field)
+        ('head.a', 'b0', '>u1', 0, 1, 'bits', (0, 3), 'B')
+        ('head.b', 'b0', '>u1', 0, 1, 'bits', (3, 5), 'B')
+        ('vals', 'f2', '(2,)>i2', 1, 2, 'value', None, 'h')
+        ('name', 'f3', '>S4', 5, 1, 'value', None, None)
+        ('gain', 'f4', '(3,)u1', 9, 1, 'int24', ('little', True), 'i')
+    """
+    if getPacketSize(packetName, specification, layouts) is None:
+        return None
+    fields = []
+    for itemNum, item in enumerate(flattenLayout(packetName, specification,
+                                                 layouts)):
+        if item['kind'] == 'padding':
+            continue
+        byteOrder = endianDtypeChar.get(item['endianness'], '=')
+        shape = ''
+        if item['count'] != 1:
+            shape = '({},)'.format(item['count'])
+        key = 'f{}'.format(itemNum)
+        if item['kind'] == 'bitfield':
+            fields.append((
+                item['name'], 'b{}'.format(item['offset']),
+                '{}u{}'.format(byteOrder, item['size']), item['offset'], 1,
+                'bits', (item['bitOffset'], item['bitSize']),
+                {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}[item['size']]))
+        elif item['type'] in int24Signed:
+            signed = int24Signed[item['type']]
+            if item['count'] != 1:
+                shape = '({},3)'.format(item['count'])
+            else:
+                shape = '(3,)'
+            fields.append((
+                item['name'], key, shape + 'u1', item['offset'],
+                item['count'], 'int24',
+                (str(item['endianness']) if item['endianness'] in
+                 ('big', 'little') else 'native', signed),
+                'i' if signed else 'I'))
+        elif typeFormatChar.get(item['type']) == 's':
+            fields.append((
+                item['name'], key, '{}S{}'.format(byteOrder, item['count']),
+                item['offset'], 1, 'value', None, None))
+        elif typeFormatChar.get(item['type']) in formatDtype:
+            formatChar = typeFormatChar[item['type']]
+            fields.append((
+                item['name'], key, '{}{}{}'.format(
+                    shape, byteOrder, formatDtype[formatChar]),
+                item['offset'], item['count'], 'value', None,
+                formatTypecode.get(formatChar)))
+        else:
+            return None
+    return fields
+
+
+def getFieldLayout(packetName, specification, layouts=None):
+    """
+    Gets where each field of a packet can be read from.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        An ordered dictionary keyed by the dotted names of the
+        fields at fixed offsets, each giving a tuple of its byte
+        offset, struct byte order character, struct format for
+        it (the container for bitfields), the number of values
+        that format gives, its kind ('value', 'list', 'bits' or
+        'int24') and, for bitfields, the bit offset and mask or,
+        for 24-bit integers, the byte order, signedness and count.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'endianness': 'big', 'packets': OrderedDict([
+        ...     ('hdr', {'structure': OrderedDict([
+        ...         ('a', {'type': 'uint8_t', 'size': 3}),
+        ...         ('b', {'type': 'uint8_t', 'size': 5})])}),
+        ...     ('msg', {'structure': OrderedDict([
+        ...         ('head', {'type': '#/packets/hdr'}),
+        ...         ('vals', {'type': 'int16_t', 'count': 2}),
+        ...         ('name', {'type': 'string', 'count': 4}),
+        ...         ('gain', {'type': 'int24_t', 'endianness': 'little'}),
+        ...         ('n', {'type': 'uint8_t'}),
+        ...         ('data', {'type': 'uint8_t', 'count': 'n'}),
+        ...         ('last', {'type': 'uint8_t'})])})])}
+        >>> for name, place in getFieldLayout('msg', spec).items():
+        ...     print('{} {}'.format(name, place))
+        head.a (0, '>', 'B', 1, 'bits', (0, 7))
+        head.b (0, '>', 'B', 1, 'bits', (3, 31))
+        vals (1, '>', '2h', 2, 'list', None)
+        name (5, '>', '4s', 1, 'value', None)
+        gain (9, '<', '3s', 1, 'int24', ('little', True, 1))
+        n (12, '>', 'B', 1, 'value', None)
+    """
+    fieldLayout = OrderedDict()
+    for item in flattenLayout(packetName, specification, layouts):
+        if item['kind'] == 'padding' or item['offset'] is None or \
+                item['count'] is None:
+            continue
+        endianChar = endianFormatChar.get(item['endianness'], '=')
+        if item['kind'] == 'bitfield':
+            place = ('{}'.format({1: 'B', 2: 'H', 4: 'L', 8: 'Q'}[
+                item['size']]), 1, 'bits',
+                (item['bitOffset'], 2 ** item['bitSize'] - 1))
+        elif item['type'] in int24Signed:
+            place = ('{}s'.format(3 * item['count']), 1, 'int24', (
+                str(item['endianness']) if item['endianness'] in
+                ('big', 'little') else 'native', int24Signed[item['type']],
+                item['count']))
+        elif item['type'] in typeFormatChar and \
+                len(typeFormatChar[item['type']]) == 1 and \
+                typeFormatChar[item['type']] != 'P':
+            formatChar = typeFormatChar[item['type']]
+            if formatChar in ('s', 'p'):
+                place = ('{}{}'.format(item['count'], formatChar), 1,
+                         'value', None)
+            elif 'count' in item['structure']:
+                place = ('{}{}'.format(item['count'], formatChar),
+                         item['count'], 'list', None)
+            else:
+                place = (formatChar, 1, 'value', None)
+        else:
+            continue
+        fieldLayout[item['name']] = (item['offset'], endianChar) + place
+    return fieldLayout
+
+
+def getLengthFields(packetName, specification, fieldLayout,
+                    layouts=None):
+    """
+    Gets the fields needed to work out the length of a packet.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        fieldLayout (dict):   The fields of the packet at fixed
+                              offsets, as from getFieldLayout.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        A list of the dotted names of the items holding the counts
+        of other items, empty if the packet is of fixed size, or
+        None if any of them is not at a fixed offset.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'packets': OrderedDict([
+        ...     ('blob', {'structure': OrderedDict([
+        ...         ('n', {'type': 'uint8_t'}),
+        ...         ('data', {'type': 'uint16_t', 'count': 'n'})])}),
+        ...     ('pair', {'structure': OrderedDict([
+        ...         ('first', {'type': '#/packets/blob'}),
+        ...         ('second', {'type': '#/packets/blob'})])})])}
+        >>> getLengthFields('blob', spec, getFieldLayout('blob', spec))
+        ['n']
+        >>> print(getLengthFields('pair', spec, getFieldLayout('pair', spec)))
+        None
+    """
+    if not hasVariableCount(packetName, specification, layouts):
+        return []
+    lengthFields = []
+    for item in flattenLayout(packetName, specification, layouts):
+        if item['count'] is not None:
+            continue
+        lengthField = '.'.join(item['name'].split('.')[:-1] +
+                               [item['countLabel']])
+        if lengthField not in fieldLayout:
+            return None
+        if lengthField not in lengthFields:
+            lengthFields.append(lengthField)
+    return lengthFields
+
+
+def getResyncAnchor(packetName, specification, fieldLayout, layouts=None):
+    """
+    Gets the byte patterns marking where a packet may start.
+
+    Of the fields at fixed offsets with only a few permitted values,
+    the one least likely to hold one of them by chance is chosen.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        fieldLayout (dict):   The fields of the packet at fixed
+                              offsets, as from getFieldLayout.
+        layouts (dict):       Optional cache of packet layouts.
+
+    Returns:
+        A tuple of the field's byte offset and a list of the packed
+        forms of its permitted values, or None if it has no such
+        field.
+
+    Examples:
+        >>> from collections import OrderedDict
+        >>> spec = {'endianness': 'big', 'packets': OrderedDict([
+        ...     ('msg', {'structure': OrderedDict([
+        ...         ('kind', {'type': 'uint8_t', 'member': [1, 2]}),
+        ...         ('tag', {'type': 'uint16_t', 'member': [0xabcd]}),
+        ...         ('n', {'type': 'uint8_t'})])})])}
+        >>> offset, patterns = getResyncAnchor(
+        ...     'msg', spec, getFieldLayout('msg', spec))
+        >>> offset, patterns == [pack('>H', 0xabcd)]
+        (1, True)
+    """
+    best = None
+    for item in flattenLayout(packetName, specification, layouts):
+        place = fieldLayout.get(item['name'])
+        if place is None or place[4] != 'value' or \
+                'member' not in item['structure']:
+            continue
+        members = resolveMembers(item['structure']['member'], specification)
+        if len(members) > maxAnchorPatterns:
+            continue
+        try:
+            patterns = sorted(set([pack(place[1] + place[2], member)
+                                   for member in members]))
+        except StructError:
+            continue
+        # The chance of a byte chosen at random starting a match
+        chance = len(patterns) / 256.0 ** calcsize(place[1] + place[2])
+        if best is None or chance < best[0]:
+            best = (chance, place[0], patterns)
+    if best is None:
+        return None
+    return best[1:]
+
+
+def outputColumnCodecs(packetName, specification, fields, pyFile,
+                       layouts=None):
+    """
+    Outputs the columnar pack and unpack functions for a packet.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        fields (list):        The column layout of the packet as
+                              given by getColumnFields.
+        pyFile (file):        A file-like object to which
+                              to save the struct code.
+        layouts (dict):       Optional cache of packet layouts.
+    """
+    assert isinstance(specification, dict)
+    assert hasattr(pyFile, 'write')
+    prefix = '    '
+    packetLen = getPacketSize(packetName, specification, layouts)
+    writeOut(pyFile, '_{}_columns = ('.format(packetName))
+    for field in fields:
+        writeOut(pyFile, '{},'.format(repr(field)), prefix)
+    writeOut(pyFile, ')')
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+
+    # Create the columnar unpack function
+    writeOut(pyFile, 'def unpack_columns_{}(buffer, count=None):'.format(
+             packetName))
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, "Unpacks many {} packets into columns.".format(
+             packetName), prefix)
+    writeOut(pyFile, '')
+    writeOutBlock(pyFile, 'Decodes packets laid end to end into a column '
+                  'per field, with the fields of substructures named by '
+                  'dotted paths. Columns are NumPy arrays when NumPy is '
+                  'available, with repeated values as a second dimension. '
+                  'Otherwise they are arrays from the array module (lists '
+                  'for strings) with repeated values laid out a packet '
+                  'after another.', prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Args:', prefix)
+    writeOut(pyFile, 'buffer:      A string or other buffer of packed '
+             'data.', 2 * prefix)
+    writeOut(pyFile, 'count (int): How many packets to unpack; all those',
+             2 * prefix)
+    writeOut(pyFile, 'in the buffer by default.', 2 * prefix + 13 * ' ')
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Returns:', prefix)
+    writeOut(pyFile, 'An ordered dictionary of columns keyed by field name.',
+             2 * prefix)
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, 'return _unpackColumns(buffer, count, {0}, _{1}_columns, '
+             'unpack_{1})'.format(packetLen, packetName), prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+
+    # Create the columnar pack function
+    writeOut(pyFile, 'def pack_columns_{}(columns):'.format(packetName))
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, "Packs columns into many {} packets.".format(
+             packetName), prefix)
+    writeOut(pyFile, '')
+    writeOutBlock(pyFile, 'The inverse of unpack_columns_{}; columns may '
+                  'also be given as a NumPy record array or as nested '
+                  'dictionaries.'.format(packetName), prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Args:', prefix)
+    writeOut(pyFile, 'columns: The columns keyed by field name.',
+             2 * prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Returns:', prefix)
+    writeOut(pyFile, 'A binary string of the packets laid end to end.',
+             2 * prefix)
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, 'return _packColumns(columns, {0}, _{1}_columns, '
+             'pack_{1})'.format(packetLen, packetName), prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+
+
+def outputValidators(packetName, specification, pyFile, layouts=None):
+    """
+    Outputs the validation functions for a packet.
+
+    Writes out check_<packet> which compares the values of a
+    packet against their min, max and member constraints (and
+    bitfields against their widths), the
+    validate_<packet> which unpacks and checks a packet, and the
+    NumPy variants which check whole columns of packets at once.
+
+    Args:
+        packetName (str):     The name of the packet.
+        specification (dict): The specification object.
+        pyFile (file):        A file-like object to which
+                              to save the struct code.
+        layouts (dict):       Optional cache of packet layouts.
+    """
+    assert isinstance(specification, dict)
+    assert hasattr(pyFile, 'write')
+    prefix = '    '
+    checks = []
+    for item in getPacketLayout(packetName, specification, layouts):
+        if item['kind'] == 'substructure':
+            checks.append((item, None, None, None, None))
+            continue
+        minimum, maximum, members = getConstraints(item['structure'],
+                                                   specification)
+        bitMaximum = None
+        if item['kind'] == 'bitfield':
+            bitMaximum = getBitFieldMaximum(item['type'], item['bitSize'])
+        if minimum is None and maximum is None and members is None and \
+                bitMaximum is None:
+            continue
+        setName = None
+        if members is not None:
+            setName = '_{}_{}_members'.format(packetName, item['name'])
+            writeOut(pyFile, '{} = frozenset([{}])'.format(
+                setName, ', '.join([repr(value) for value in members])))
+        checks.append((item, minimum, maximum, setName, bitMaximum))
+    if [check for check in checks if check[3] is not None]:
+        writeOut(pyFile, '')
+        writeOut(pyFile, '')
+
+    # Create the check function
+    writeOut(pyFile, 'def check_{}(packet):'.format(packetName))
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, "Checks the values of a {} packet.".format(packetName),
+             prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Args:', prefix)
+    writeOut(pyFile, 'packet (dict): A dictionary of unpacked data.',
+             2 * prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Returns:', prefix)
+    writeOut(pyFile, 'A list of the names of the fields with values '
+             'out of range.', 2 * prefix)
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, 'failures = []', prefix)
+    for item, minimum, maximum, setName, bitMaximum in checks:
+        if item['kind'] == 'substructure':
+            writeOut(pyFile, "for failure in check_{}(packet['{}']):".format(
+                item['type'], item['name']), prefix)
+            writeOut(pyFile, "failures.append('{}.' + failure)".format(
+                item['name']), 2 * prefix)
+            continue
+        isArray = item['count'] != 1 and not isStringType(item['type'])
+        if isArray:
+            value = 'value'
+        else:
+            value = "packet['{}']".format(item['name'])
+        conditions = []
+        if setName is not None:
+            conditions.append('{} not in {}'.format(value, setName))
+        if minimum is not None and maximum is not None:
+            conditions.append('not {} <= {} <= {}'.format(minimum, value,
+                                                          maximum))
+        elif minimum is not None:
+            conditions.append('not {} <= {}'.format(minimum, value))
+        elif maximum is not None:
+            conditions.append('not {} <= {}'.format(value, maximum))
+        if bitMaximum is not None:
+            conditions.append('not 0 <= {} <= {}'.format(value, bitMaximum))
+        if isArray:
+            writeOut(pyFile, "if any({} for value in packet['{}']):".format(
+                ' or '.join(conditions), item['name']), prefix)
+        else:
+            writeOut(pyFile, 'if {}:'.format(' or '.join(conditions)),
+                     prefix)
+        writeOut(pyFile, "failures.append('{}')".format(item['name']),
+                 2 * prefix)
+    writeOut(pyFile, 'return failures', prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+
+    # Create the validate function
+    writeOut(pyFile, 'def validate_{}(rawData):'.format(packetName))
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, "Reads and validates a {} packet.".format(packetName),
+             prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, "Reads a {} structure from raw binary data".format(
+             packetName), prefix)
+    writeOut(pyFile, "and validates it.", prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Args:', prefix)
+    writeOut(pyFile, 'rawData (str): The raw binary data to be unpacked.',
+             2 * prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Returns:', prefix)
+    writeOut(pyFile, 'A dictionary of the unpacked data.', 2 * prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Raises:', prefix)
+    writeOut(pyFile, 'ValueError: If any value is out of range.', 2 * prefix)
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, 'packet = unpack_{}(rawData)'.format(packetName), prefix)
+    writeOut(pyFile, 'failures = check_{}(packet)'.format(packetName), prefix)
+    writeOut(pyFile, 'if failures:', prefix)
+    writeOut(pyFile, "raise ValueError('Invalid {} values: {{}}'.format("
+             "', '.join(failures)))".format(packetName), 2 * prefix)
+    writeOut(pyFile, 'return packet', prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+
+    # Create the column check function
+    writeOut(pyFile, "def check_{}_columns(columns, prefix=''):".format(
+             packetName))
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, "Checks the values of many {} packets at once.".format(
+             packetName), prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Requires NumPy.', prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Args:', prefix)
+    writeOut(pyFile, 'columns:      A NumPy record array or a '
+             'dictionary of', 2 * prefix)
+    writeOut(pyFile, 'NumPy arrays keyed by dotted field name.',
+             2 * prefix + 14 * ' ')
+    writeOut(pyFile, 'prefix (str): The dotted path to these packets '
+             'within', 2 * prefix)
+    writeOut(pyFile, 'the columns.', 2 * prefix + 14 * ' ')
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Returns:', prefix)
+    writeOut(pyFile, 'A boolean array marking the rows with values out of',
+             2 * prefix)
+    writeOut(pyFile, 'range (or False if nothing is checked).', 2 * prefix)
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, 'failing = False', prefix)
+    for item, minimum, maximum, setName, bitMaximum in checks:
+        if item['kind'] == 'substructure':
+            writeOut(pyFile, "failing = failing | check_{}_columns(columns, "
+                     "prefix + '{}.')".format(item['type'], item['name']),
+                     prefix)
+            continue
+        if minimum is None and maximum is None and setName is None:
+            # Bitfields unpacked into columns always fit their widths
+            continue
+        writeOut(pyFile, "column = _getColumn(columns, prefix + '{}')".format(
+            item['name']), prefix)
+        conditions = []
+        if setName is not None:
+            conditions.append('~numpy.isin(column, list({}))'.format(
+                setName))
+        if minimum is not None:
+            conditions.append('~(column >= {})'.format(minimum))
+        if maximum is not None:
+            conditions.append('~(column <= {})'.format(maximum))
+        writeOut(pyFile, 'failing = failing | _anyPerRow({})'.format(
+            ' | '.join(conditions)), prefix)
+    writeOut(pyFile, 'return failing', prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+
+    # Create the batch validate function
+    writeOut(pyFile, 'def validate_{}_batch(columns):'.format(packetName))
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, "Validates many {} packets at once.".format(packetName),
+             prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Requires NumPy.', prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Args:', prefix)
+    writeOut(pyFile, 'columns: A NumPy record array or a dictionary of',
+             2 * prefix)
+    writeOut(pyFile, 'NumPy arrays keyed by dotted field name.',
+             2 * prefix + 9 * ' ')
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Returns:', prefix)
+    writeOut(pyFile, 'An array of the indices of the rows with values out',
+             2 * prefix)
+    writeOut(pyFile, 'of range.', 2 * prefix)
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, 'return numpy.flatnonzero(check_{}_columns(columns))'
+             .format(packetName), prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+
+
+def getBitFieldPackingLines(structDef):
+    """
+    Gets the Python combining bitfields into their containers.
+
+    Values that do not fit in their bitfields are refused rather
+    than spilling into their neighbours.
+
+    Args:
+        structDef (dict): The segment holding the bitfields.
+
+    Returns:
+        A list of the lines, each a tuple of its indentation level
+        and its text.
+
+    Examples:
+        >>> structDef = {'bitFields': [("packet['a']", 0, 3, 'uint8_t'),
+        ...                            ("packet['b']", 0, 5, 'uint8_t')]}
+        >>> for level, line in getBitFieldPackingLines(structDef):
+        ...     print('    ' * level + line)
+        if not 0 <= packet['b'] <= 31:
+            raise StructError('b does not fit in 5 bits')
+        bitField0 = packet['b']
+        if not 0 <= packet['a'] <= 7:
+            raise StructError('a does not fit in 3 bits')
+        bitField0 <<= 3
+        bitField0 |= packet['a']
+    """
+    lines = []
+    startedBitFields = []
+    for (bitFieldName, bitFieldNum, bitFieldSize, bitFieldLabel
+         ) in reversed(structDef['bitFields']):
+        bitMaximum = getBitFieldMaximum(bitFieldLabel, bitFieldSize)
+        if bitMaximum is not None:
+            lines.append((0, 'if not 0 <= {} <= {}:'.format(bitFieldName,
+                                                            bitMaximum)))
+            lines.append((1, "raise StructError('{} does not fit in {} "
+                          "bits')".format(fieldRE.match(bitFieldName).group(1),
+                                          bitFieldSize)))
+        if bitFieldNum not in startedBitFields:
+            startedBitFields.append(bitFieldNum)
+            lines.append((0, 'bitField{} = {}'.format(bitFieldNum,
+                                                     bitFieldName)))
+        else:
+            lines.append((0, 'bitField{} <<= {}'.format(
+                bitFieldNum, bitFieldSize)))
+            lines.append((0, 'bitField{} |= {}'.format(
+                bitFieldNum, bitFieldName)))
+    return lines
+
+
+def outputBitFieldPacking(structDef, pyFile):
+    """
+    Outputs the Python combining bitfields into their containers.
+
+    Args:
+        structDef (dict): The segment holding the bitfields.
+        pyFile (file):    A file-like object to which
+                          to save the struct code.
+    """
+    prefix = '    '
+    for level, line in getBitFieldPackingLines(structDef):
+        writeOut(pyFile, line, (level + 1) * prefix)
+
+
+def getPackIntoLines(packetName, structDefList, segmentPackers=None):
+    """
+    Gets the Python packing a packet into an existing buffer.
+
+    Args:
+        packetName (str):      The name of the packet.
+        structDefList (list):  The segments and other items of the
+                               packet as from populateWorkLists.
+        segmentPackers (dict): The names of functions already bound
+                               to pack each segment format, if any.
+
+    Returns:
+        A list of the lines, each a tuple of its indentation level
+        and its text.
+
+    Examples:
+        >>> structDefList = [{'type': 'segment', 'fmt': '"<Hb"',
+        ...                   'vars': "(packet['a'], packet['b'])",
+        ...                   'array': False, 'bitFields': []}]
+        >>> for level, line in getPackIntoLines('p', structDefList,
+        ...                                     {'"<Hb"': 'packSegment0'}):
+        ...     print(line)
+        packSegment0(buffer, offset, packet['a'], packet['b'])
+        offset += 3
+    """
+    lines = []
+    for structDef in structDefList:
+        if structDef['type'] == 'segment':
+            lines.extend(getBitFieldPackingLines(structDef))
+            if structDef['array']:
+                values = '*{}'.format(structDef['vars'])
+            else:
+                values = structDef['vars'][1:-1]
+            if segmentPackers is None:
+                lines.append((0, 'pack_into({}, buffer, offset, {})'.format(
+                    structDef['fmt'], values)))
+            else:
+                lines.append((0, '{}(buffer, offset, {})'.format(
+                    segmentPackers[structDef['fmt']], values)))
+            lines.append((0, 'offset += {}'.format(
+                getSegmentSize(structDef))))
+        elif structDef['type'] == 'substructure':
+            lines.append((0, "offset += pack_{}_into(packet['{}'], buffer, "
+                          "offset)".format(structDef['itemType'],
+                                           structDef['itemName'])))
+        elif structDef['type'] == 'int24':
+            if structDef['array']:
+                lines.append((0, "packed = _putInt24Array(packet['{}'], {}, "
+                              "{}, {})".format(structDef['itemName'],
+                                               structDef['countVar'],
+                                               structDef['byteOrder'],
+                                               structDef['signed'])))
+            else:
+                lines.append((0, "packed = _putInt24(packet['{}'], {}, "
+                              "{})".format(structDef['itemName'],
+                                           structDef['byteOrder'],
+                                           structDef['signed'])))
+            lines.append((0, 'if offset + len(packed) > len(buffer):'))
+            lines.append((1, "raise StructError('{} does not fit in the "
+                          "buffer')".format(packetName)))
+            lines.append((0, 'buffer[offset:offset + len(packed)] = packed'))
+            lines.append((0, 'offset += len(packed)'))
+        elif structDef['type'] == 'variable':
+            if structDef['padding']:
+                values = ''
+            elif structDef['array']:
+                values = ", *packet['{}']".format(structDef['itemName'])
+            else:
+                values = ", packet['{}']".format(structDef['itemName'])
+            lines.append((0, "_getStruct('{}', '{}', {}).pack_into(buffer, "
+                          "offset{})".format(structDef['endianChar'],
+                                             structDef['formatChar'],
+                                             structDef['countVar'], values)))
+            lines.append((0, 'offset += {}'.format(
+                getVariableSize(structDef))))
+    return lines
+
+
+def outputPackInto(packetName, structDefList, pyFile):
+    """
+    Outputs a Python function packing a packet into a buffer.
+
+    Args:
+        packetName (str):     The name of the packet.
+        structDefList (list): The segments and other items of the
+                              packet as from populateWorkLists.
+        pyFile (file):        A file-like object to which
+                              to save the struct code.
+    """
+    prefix = '    '
+    writeOut(pyFile, 'def pack_{}_into(packet, buffer, offset=0):'.format(
+        packetName))
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, "Packs a {} packet into an existing buffer.".format(
+        packetName), prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Args:', prefix)
+    writeOut(pyFile, 'packet (dict): A dictionary of data to be packed.',
+             2 * prefix)
+    writeOut(pyFile, 'buffer:        A writable buffer such as a '
+             'bytearray.', 2 * prefix)
+    writeOut(pyFile, 'offset (int):  Where in the buffer to put the '
+             'packet.', 2 * prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Returns:', prefix)
+    writeOut(pyFile, 'The number of bytes packed.', 2 * prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Raises:', prefix)
+    writeOut(pyFile, 'StructError: If the packet does not fit in the '
+             'buffer.', 2 * prefix)
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, 'assert isinstance(packet, dict)', prefix)
+    writeOut(pyFile, 'start = offset', prefix)
+    for level, line in getPackIntoLines(packetName, structDefList):
+        writeOut(pyFile, line, (level + 1) * prefix)
+    writeOut(pyFile, 'return offset - start', prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+
+
+def outputPackMany(packetName, structDefList, isVariable, pyFile):
+    """
+    Outputs Python functions packing many packets end to end.
+
+    The packets are packed one after another in a single loop, with
+    each segment format bound to its packing function beforehand.
+
+    Args:
+        packetName (str):     The name of the packet.
+        structDefList (list): The segments and other items of the
+                              packet as from populateWorkLists.
+        isVariable (bool):    Whether the size of the packet depends
+                              on counts held within it.
+        pyFile (file):        A file-like object to which
+                              to save the struct code.
+    """
+    prefix = '    '
+    segmentPackers = OrderedDict()
+    for structDef in structDefList:
+        if structDef['type'] == 'segment' and \
+                structDef['fmt'] not in segmentPackers:
+            segmentPackers[structDef['fmt']] = 'packSegment{}'.format(
+                len(segmentPackers))
+    writeOut(pyFile, 'def _pack_{}_run(records, buffer, offset):'.format(
+        packetName))
+    writeOut(pyFile, '"""Packs {} packets one after another, giving where '
+             'they end."""'.format(packetName), prefix)
+    for fmt, packerName in segmentPackers.items():
+        writeOut(pyFile, '{} = Struct({}).pack_into'.format(packerName, fmt),
+                 prefix)
+    writeOut(pyFile, 'for packet in records:', prefix)
+    for level, line in getPackIntoLines(packetName, structDefList,
+                                        segmentPackers):
+        writeOut(pyFile, line, (level + 2) * prefix)
+    writeOut(pyFile, 'return offset', prefix)
+    writeOut(pyFile, "_runPackers['{0}'] = _pack_{0}_run".format(packetName))
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'def pack_many_{}(records, processes=None, '
+             'chunkLen=1 << 16):'.format(packetName))
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, 'Packs many {} packets end to end.'.format(packetName),
+             prefix)
+    writeOut(pyFile, '')
+    if isVariable:
+        writeOut(pyFile, 'The output is sized exactly from the counts held '
+                 'in each packet', prefix)
+    else:
+        writeOut(pyFile, 'The output is sized exactly from the fixed size '
+                 'of the packet', prefix)
+    writeOut(pyFile, 'before any is packed, and each is packed straight '
+             'into it.', prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Args:', prefix)
+    writeOut(pyFile, 'records (list):  The dictionaries of data to be '
+             'packed.', 2 * prefix)
+    writeOut(pyFile, 'processes (int): How many worker processes to share '
+             'the', 2 * prefix)
+    writeOut(pyFile, 'packing out among, packing into shared', 2 * prefix
+             + ' ' * 17)
+    writeOut(pyFile, 'memory; it is all done in this process', 2 * prefix
+             + ' ' * 17)
+    writeOut(pyFile, 'if None.', 2 * prefix + ' ' * 17)
+    writeOut(pyFile, 'chunkLen (int):  How many packets to hand a worker '
+             'at once.', 2 * prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Returns:', prefix)
+    writeOut(pyFile, 'A bytearray of the packed packets.', 2 * prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Raises:', prefix)
+    writeOut(pyFile, 'StructError: If a packet cannot be packed.', 2 * prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Examples:', prefix)
+    writeOut(pyFile, '>>> pack_many_{}([])'.format(packetName), 2 * prefix)
+    writeOut(pyFile, "bytearray(b'')", 2 * prefix)
+    writeOut(pyFile, '"""', prefix)
+    if isVariable:
+        writeOut(pyFile, "return _packMany('{}', records, None, processes, "
+                 "chunkLen)".format(packetName), prefix)
+    else:
+        writeOut(pyFile, "return _packMany('{0}', records, get_{0}_len(), "
+                 "processes, chunkLen)".format(packetName), prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+
+
+def getUnpackIntoLines(structDefList, enumItems, byAttribute):
+    """
+    Gets the Python unpacking a packet into an existing record.
+
+    Args:
+        structDefList (list): The segments and other items of the
+                              packet as from populateWorkLists.
+        enumItems (list):     The layout items to decode as members
+                              of their enumerations.
+        byAttribute (bool):   Whether the record's fields are
+                              attributes rather than dictionary keys.
+
+    Returns:
+        A list of the lines, each a tuple of its indentation level
+        and its text.
+
+    Examples:
+        >>> structDefList = [{'type': 'segment', 'fmt': '"<Hb"',
+        ...                   'vars': "(packet['a'], packet['b'])",
+        ...                   'array': False, 'bitFields': []}]
+        >>> for level, line in getUnpackIntoLines(structDefList, [], True):
+        ...     print(line)
+        (packet.a, packet.b) = unpack_from("<Hb", buffer, position)
+        position += 3
+    """
+    lines = []
+
+    def getField(name):
+        if byAttribute:
+            return 'packet.{}'.format(name)
+        return "packet['{}']".format(name)
+
+    def fromDict(source):
+        if byAttribute:
+            return fieldRE.sub(r'packet.\1', source)
+        return source
+
+    def refill(name, values):
+        if byAttribute:
+            lines.append((0, '{}[:] = {}'.format(getField(name), values)))
+        else:
+            lines.append((0, "if '{}' in packet:".format(name)))
+            lines.append((1, '{}[:] = {}'.format(getField(name), values)))
+            lines.append((0, 'else:'))
+            lines.append((1, '{} = list({})'.format(getField(name), values)))
+
+    for structDef in structDefList:
+        if structDef['type'] == 'segment':
+            values = 'unpack_from({}, buffer, position)'.format(
+                structDef['fmt'])
+            if structDef['array']:
+                refill(fieldRE.match(structDef['vars']).group(1), values)
+            else:
+                lines.append((0, '{} = {}'.format(
+                    fromDict(structDef['vars']), values)))
+            lines.append((0, 'position += {}'.format(
+                getSegmentSize(structDef))))
+            for fragNum, (bitFieldName, bitFieldNum, bitFieldSize,
+                          bitFieldLabel) in enumerate(structDef['bitFields']):
+                bitFieldMask = hex(int(pow(2, bitFieldSize)) - 1)
+                if isFloatType(bitFieldLabel):
+                    bitFieldType = 'float'
+                elif isBooleanType(bitFieldLabel):
+                    bitFieldType = 'bool'
+                elif isStringType(bitFieldLabel):
+                    bitFieldType = 'str'
+                else:
+                    bitFieldType = 'int'
+                lines.append((0, '{} = {}(bitField{} & {})'.format(
+                    fromDict(bitFieldName), bitFieldType, bitFieldNum,
+                    bitFieldMask)))
+                if fragNum < len(structDef['bitFields']) - 1 and \
+                        structDef['bitFields'][fragNum + 1][1] == bitFieldNum:
+                    lines.append((0, 'bitField{} >>= {}'.format(
+                        bitFieldNum, bitFieldSize)))
+        elif structDef['type'] == 'substructure':
+            if not byAttribute:
+                lines.append((0, "if '{}' not in packet:".format(
+                    structDef['itemName'])))
+                lines.append((1, '{} = {{}}'.format(
+                    getField(structDef['itemName']))))
+            lines.append((0, 'position += unpack_{}_into(buffer, position, '
+                          '{})'.format(structDef['itemType'],
+                                       getField(structDef['itemName']))))
+        elif structDef['type'] == 'int24':
+            if structDef['array']:
+                refill(structDef['itemName'],
+                       '_getInt24Array(buffer, position, {}, {}, {})'.format(
+                           fromDict(structDef['countVar']),
+                           structDef['byteOrder'], structDef['signed']))
+            else:
+                lines.append((0, '{} = _getInt24(buffer, position, {}, '
+                              '{})'.format(getField(structDef['itemName']),
+                                           structDef['byteOrder'],
+                                           structDef['signed'])))
+            if structDef['variable']:
+                lines.append((0, 'position += {}'.format(
+                    fromDict(getVariableSize(structDef)))))
+            else:
+                lines.append((0, 'position += {}'.format(
+                    3 * structDef['count'])))
+        elif structDef['type'] == 'variable':
+            values = "_getStruct('{}', '{}', {}).unpack_from(buffer, " \
+                "position)".format(structDef['endianChar'],
+                                   structDef['formatChar'],
+                                   fromDict(structDef['countVar']))
+            if structDef['array']:
+                refill(structDef['itemName'], values)
+            elif not structDef['padding']:
+                lines.append((0, '[{}] = {}'.format(
+                    getField(structDef['itemName']), values)))
+            lines.append((0, 'position += {}'.format(
+                fromDict(getVariableSize(structDef)))))
+    for item in enumItems:
+        if item['count'] == 1:
+            lines.append((0, '{0} = {1}.members.get({0}, {0})'.format(
+                getField(item['name']), item['enum'])))
+        else:
+            lines.append((0, '{0}[:] = [{1}.members.get(value, value) for '
+                          'value in {0}]'.format(getField(item['name']),
+                                                 item['enum'])))
+    return lines
+
+
+def outputUnpackInto(packetName, structDefList, enumItems, pyFile):
+    """
+    Outputs a Python function unpacking a packet into a record.
+
+    Args:
+        packetName (str):     The name of the packet.
+        structDefList (list): The segments and other items of the
+                              packet as from populateWorkLists.
+        enumItems (list):     The layout items to decode as members
+                              of their enumerations.
+        pyFile (file):        A file-like object to which
+                              to save the struct code.
+    """
+    prefix = '    '
+    writeOut(pyFile, 'def unpack_{}_into(buffer, offset, packet):'.format(
+        packetName))
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, "Unpacks a {} packet into an existing record.".format(
+        packetName), prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Every field of the record is overwritten; lists and '
+             'nested', prefix)
+    writeOut(pyFile, 'records are refilled in place rather than replaced. '
+             'A', prefix)
+    writeOut(pyFile, 'dictionary gains any it lacks, but any other '
+             'record (such', prefix)
+    writeOut(pyFile, 'as an object with slots) must already have them.',
+             prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Args:', prefix)
+    writeOut(pyFile, 'buffer:        The raw binary data to be unpacked.',
+             2 * prefix)
+    writeOut(pyFile, 'offset (int):  Where in the buffer the packet '
+             'starts.', 2 * prefix)
+    writeOut(pyFile, 'packet:        The dictionary or object to unpack '
+             'into.', 2 * prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, 'Returns:', prefix)
+    writeOut(pyFile, 'The number of bytes unpacked.', 2 * prefix)
+    writeOut(pyFile, '"""', prefix)
+    writeOut(pyFile, 'position = offset', prefix)
+    writeOut(pyFile, 'if isinstance(packet, dict):', prefix)
+    for level, line in getUnpackIntoLines(structDefList, enumItems, False):
+        writeOut(pyFile, line, (level + 2) * prefix)
+    writeOut(pyFile, 'else:', prefix)
+    for level, line in getUnpackIntoLines(structDefList, enumItems, True):
+        writeOut(pyFile, line, (level + 2) * prefix)
+    writeOut(pyFile, 'return position - offset', prefix)
+    writeOut(pyFile, '')
+    writeOut(pyFile, '')
+
+
 def outputPython(specification, options, pyFile):
     """
     Outputs Python struct file.
@@ -393,6 +2167,11 @@ def outputPython(specification, options, pyFile):
     Given the specification construct a valid Python struct
     file that describes all the binary packets.
 
+    The record pools, selective unpacking, capture scanning and
+    resynchronizing and bulk packing are only output if the runtime
+    option is set, as they come from the structspec.runtime module
+    and so need structspec wherever the output is used.
+
     Args:
         specification (dict): The specification object.
         options (dict):       A dictionary of options to
@@ -404,6 +2183,8 @@ def outputPython(specification, options, pyFile):
     assert isinstance(options, dict)
     assert hasattr(pyFile, 'write')
     packetLengths = {}
+    layouts = {}
+    useRuntime = options.get('runtime', False)
     writeOut(pyFile, '#!/usr/bin/env python')
     writeOut(pyFile, '# -*- coding: utf-8 -*-')
     writeOut(pyFile, '"""')
@@ -418,8 +2199,37 @@ def outputPython(specification, options, pyFile):
                                              specification[tag]))
     writeOut(pyFile, '"""')
     writeOut(pyFile, '')
-    writeOut(pyFile, 'from struct import calcsize, pack, unpack_from')
+    writeOut(pyFile, 'from struct import Struct, calcsize, pack, pack_into, '
+             'unpack_from')
+    writeOut(pyFile, 'from struct import error as StructError')
     writeOut(pyFile, 'from zope.interface import directlyProvides, Interface')
+    writeOut(pyFile, 'try:')
+    writeOut(pyFile, 'import numpy', '    ')
+    writeOut(pyFile, 'except ImportError:')
+    writeOut(pyFile, 'numpy = None', '    ')
+    if useRuntime:
+        writeOut(pyFile, 'from structspec import runtime as _runtime')
+    variableCounts = [packetName for packetName in specification['packets']
+                      if hasVariableCount(packetName, specification, layouts)]
+    columnFields = OrderedDict()
+    for packetName in specification['packets']:
+        fields = getColumnFields(packetName, specification, layouts)
+        if fields is not None:
+            columnFields[packetName] = fields
+    if columnFields or options.get('instrument', False):
+        writeOut(pyFile, 'from array import array')
+    if columnFields or variableCounts:
+        writeOut(pyFile, 'from collections import OrderedDict')
+    if options.get('instrument', False):
+        writeOut(pyFile, counterImports)
+    if variableCounts:
+        writeOut(pyFile, structCacheImports)
+    hasInt24 = any([item['type'] in int24Signed and item['kind'] == 'field'
+                    for packetName in specification['packets']
+                    for item in getPacketLayout(packetName, specification,
+                                                layouts)])
+    if hasInt24:
+        writeOut(pyFile, int24Imports)
     writeOut(pyFile, '')
     writeOut(pyFile, '')
     prefix = '    '
@@ -460,11 +2270,47 @@ def outputPython(specification, options, pyFile):
     writeOut(pyFile, '"""Unpacks a binary string into a dict."""', 2 * prefix)
     writeOut(pyFile, '')
     writeOut(pyFile, '')
-
+    writeOut(pyFile, columnHelpers)
+    writeOut(pyFile, '')
+    writeOut(pyFile, enumHelpers)
+    writeOut(pyFile, '')
+    if options.get('instrument', False):
+        # An array of counters, four per operation per packet
+        writeOut(pyFile, '_counterPackets = ({},)'.format(', '.join(
+            [repr(str(packetName))
+             for packetName in specification['packets']])))
+        writeOut(pyFile, "_counterOperations = ('pack', 'unpack')")
+        writeOut(pyFile, "_counterNames = ('calls', 'bytes', 'nanoseconds', "
+                 "'errors')")
+        writeOut(pyFile, "_counters = array('d', [0.0] * (4 * "
+                 "len(_counterOperations) * len(_counterPackets)))")
+        writeOut(pyFile, '')
+        writeOut(pyFile, '')
+        writeOut(pyFile, counterHelpers)
+        writeOut(pyFile, '')
+    if variableCounts:
+        writeOut(pyFile, structCacheHelpers)
+        writeOut(pyFile, '')
+        writeOut(pyFile, '')
+    if hasInt24:
+        writeOut(pyFile, int24Helpers)
+        writeOut(pyFile, '')
+        writeOut(pyFile, '')
+    if columnFields:
+        writeOut(pyFile, columnCodecHelpers)
+        writeOut(pyFile, '')
+        writeOut(pyFile, '')
+    if useRuntime:
+        writeOut(pyFile, runtimeHelpers)
+        writeOut(pyFile, '')
+        writeOut(pyFile, '')
 
     # Parse the enumerations
-    newLocals = outputEnumerations(specification['enums'].items(),
+    newLocals = outputEnumerations(specification.get('enums', {}).items(),
                                    options, pyFile)
+    enumClasses = [enumerationName for enumerationName, enumeration
+                   in specification.get('enums', {}).items()
+                   if isIntegerEnum(enumerationName, enumeration)]
     # The following is a little ugly but places the enumerations
     # in the current namespace so that they may be referenced
     # when evaluating formats.
@@ -489,7 +2335,11 @@ def outputPython(specification, options, pyFile):
         )
 
         # Create the get length function
-        writeOut(pyFile, 'def get_{}_len():'.format(packetName))
+        isVariable = packetName in variableCounts
+        if isVariable:
+            writeOut(pyFile, 'def get_{}_len(packet=None):'.format(packetName))
+        else:
+            writeOut(pyFile, 'def get_{}_len():'.format(packetName))
         writeOut(pyFile, '"""', prefix)
         writeOut(pyFile, "Calculates the size of {}.".format(packetName), prefix)
         writeOut(pyFile, '')
@@ -497,6 +2347,15 @@ def outputPython(specification, options, pyFile):
                  packetName), prefix)
         writeOut(pyFile, "(including any internal substructures).", prefix)
         writeOut(pyFile, '')
+        if isVariable:
+            writeOut(pyFile, "Items whose count is held by another item are "
+                     "taken", prefix)
+            writeOut(pyFile, "as empty unless a packet is given.", prefix)
+            writeOut(pyFile, '')
+            writeOut(pyFile, 'Args:', prefix)
+            writeOut(pyFile, 'packet (dict): The packet whose counts are '
+                     'used.', 2 * prefix)
+            writeOut(pyFile, '')
         writeOut(pyFile, 'Returns:', prefix)
         writeOut(pyFile, 'The size of {}.'.format(packetName),
                  2 * prefix)
@@ -511,6 +2370,9 @@ def outputPython(specification, options, pyFile):
                     packetLen += calcsize(eval(structDef['fmt']))
                 elif structDef['type'] == 'substructure':
                     packetLen += packetLengths[structDef['itemType']]
+                elif structDef['type'] == 'int24' and \
+                        not structDef['variable']:
+                    packetLen += 3 * structDef['count']
             packetLengths[packetName] = packetLen
             writeOut(pyFile, '')
             writeOut(pyFile, 'Examples:', prefix)
@@ -530,10 +2392,29 @@ def outputPython(specification, options, pyFile):
         else:
             writeOut(pyFile, 'totalSize = calcsize({})'.format(
                      ') + calcsize('.join(formatStrList)), prefix)
-        substructureList = [structDef['itemType'] for structDef in structDefList
-                            if structDef['type'] == 'substructure']
-        for substruct in substructureList:
-            writeOut(pyFile, 'totalSize += get_{}_len()'.format(substruct), prefix)
+        int24Size = sum([3 * structDef['count'] for structDef in structDefList
+                         if structDef['type'] == 'int24' and
+                         not structDef['variable']])
+        if int24Size:
+            writeOut(pyFile, 'totalSize += {}'.format(int24Size), prefix)
+        variableSizes = []
+        for structDef in structDefList:
+            if structDef['type'] == 'substructure':
+                if structDef['itemType'] in variableCounts:
+                    writeOut(pyFile, "totalSize += get_{}_len(None if packet "
+                             "is None else packet['{}'])".format(
+                                 structDef['itemType'],
+                                 structDef['itemName']), prefix)
+                else:
+                    writeOut(pyFile, 'totalSize += get_{}_len()'.format(
+                             structDef['itemType']), prefix)
+            elif structDef['type'] == 'variable' or \
+                    structDef['type'] == 'int24' and structDef['variable']:
+                variableSizes.append(getVariableSize(structDef))
+        if variableSizes:
+            writeOut(pyFile, 'if packet is not None:', prefix)
+            writeOut(pyFile, 'totalSize += {}'.format(
+                     ' + '.join(variableSizes)), 2 * prefix)
         writeOut(pyFile, 'return totalSize', prefix)
         writeOut(pyFile, 'directlyProvides(get_{}_len, I{}Length)'.format(
                  packetName, extensionlessName))
@@ -560,27 +2441,58 @@ def outputPython(specification, options, pyFile):
         writeOut(pyFile, 'outList = []', prefix)
         for structDef in structDefList:
             if structDef['type'] == 'segment':
-                for fragNum, (bitFieldName, bitFieldNum, bitFieldSize, bitFieldLabel
-                              ) in enumerate(reversed(structDef['bitFields'])):
-                    if fragNum == 0:
-                        writeOut(pyFile, 'bitField{} = {}'.format(
-                            bitFieldNum, bitFieldName), prefix)
-                    else:
-                        writeOut(pyFile, 'bitField{} <<= {}'.format(
-                            bitFieldNum, bitFieldSize), prefix)
-                        writeOut(pyFile, 'bitField{} |= {}'.format(
-                            bitFieldNum, bitFieldName), prefix)
-                writeOut(pyFile, 'outList.append(pack({}, {}))'.format(
-                    structDef['fmt'], structDef['vars'][1:-1]), prefix)
+                outputBitFieldPacking(structDef, pyFile)
+                if structDef['array']:
+                    writeOut(pyFile, 'outList.append(pack({}, *{}))'.format(
+                        structDef['fmt'], structDef['vars']), prefix)
+                else:
+                    writeOut(pyFile, 'outList.append(pack({}, {}))'.format(
+                        structDef['fmt'], structDef['vars'][1:-1]), prefix)
             elif structDef['type'] == 'substructure':
                 writeOut(pyFile, 'outList.append(pack_{}(packet["{}"]))'.format(
                     structDef['itemType'], structDef['itemName']), prefix)
+            elif structDef['type'] == 'int24':
+                if structDef['array']:
+                    writeOut(pyFile, "outList.append(_putInt24Array(packet["
+                             "'{}'], {}, {}, {}))".format(
+                                 structDef['itemName'], structDef['countVar'],
+                                 structDef['byteOrder'], structDef['signed']),
+                             prefix)
+                else:
+                    writeOut(pyFile, "outList.append(_putInt24(packet['{}'], "
+                             "{}, {}))".format(structDef['itemName'],
+                                               structDef['byteOrder'],
+                                               structDef['signed']), prefix)
+            elif structDef['type'] == 'variable':
+                if structDef['padding']:
+                    values = ''
+                elif structDef['array']:
+                    values = "*packet['{}']".format(structDef['itemName'])
+                else:
+                    values = "packet['{}']".format(structDef['itemName'])
+                writeOut(pyFile, "outList.append(_getStruct('{}', '{}', {})"
+                         ".pack({}))".format(structDef['endianChar'],
+                                             structDef['formatChar'],
+                                             structDef['countVar'], values),
+                         prefix)
         writeOut(pyFile, 'return "".join(outList)', prefix)
         writeOut(pyFile, 'directlyProvides(pack_{}, I{}Packer)'.format(
                  packetName, extensionlessName))
+        if options.get('instrument', False):
+            writeOut(pyFile, "pack_{0} = _instrument(pack_{0}, '{0}', "
+                     "'pack')".format(packetName))
+            writeOut(pyFile, 'directlyProvides(pack_{}, I{}Packer)'.format(
+                     packetName, extensionlessName))
         writeOut(pyFile, '')
         writeOut(pyFile, '')
 
+        # Create the function packing into an existing buffer
+        outputPackInto(packetName, structDefList, pyFile)
+
+        # Create the function packing many packets at once
+        if useRuntime:
+            outputPackMany(packetName, structDefList, isVariable, pyFile)
+
         # Create the unpack function
         writeOut(pyFile, 'def unpack_{}(rawData):'.format(packetName))
         writeOut(pyFile, '"""', prefix)
@@ -610,8 +2522,12 @@ def outputPython(specification, options, pyFile):
             if structDef['type'] == 'segment':
                 line.append('segmentFmt = {}{}'.format(structDef['fmt'], linesep))
                 line.append('{}segmentLen = calcsize(segmentFmt){}'.format(prefix, linesep))
-                line.append('{}{} = unpack_from(segmentFmt, rawData, position){}'.format(
-                            prefix, structDef['vars'], linesep))
+                if structDef['array']:
+                    line.append('{}{} = list(unpack_from(segmentFmt, rawData, position)){}'.format(
+                                prefix, structDef['vars'], linesep))
+                else:
+                    line.append('{}{} = unpack_from(segmentFmt, rawData, position){}'.format(
+                                prefix, structDef['vars'], linesep))
                 line.append('{}position += segmentLen{}'.format(prefix, linesep))
                 for fragNum, (bitFieldName, bitFieldNum, bitFieldSize,
                               bitFieldLabel) in enumerate(structDef['bitFields']):
@@ -626,7 +2542,9 @@ def outputPython(specification, options, pyFile):
                         bitFieldType = 'int'
                     line.append("{}{} = {}(bitField{} & {}){}".format(prefix, bitFieldName,
                                 bitFieldType, bitFieldNum, bitFieldMask, linesep))
-                    if fragNum < len(structDef['bitFields']) - 1:
+                    if fragNum < len(structDef['bitFields']) - 1 and \
+                            structDef['bitFields'][fragNum + 1][1] == \
+                            bitFieldNum:
                         line.append("{}bitField{} >>= {}{}".format(prefix,
                                     bitFieldNum, bitFieldSize, linesep))
                 if line[-1].endswith(linesep):
@@ -637,40 +2555,119 @@ def outputPython(specification, options, pyFile):
                     writeOutBlock(outBufStr, structDef['description'], '    # ')
                 line.append("packet['{}'] = unpack_{}(rawData[position:]){}".format(
                     structDef['itemName'], structDef['itemType'], linesep))
-                line.append("{}position += get_{}_len()".format(
-                    prefix, structDef['itemType']))
+                if structDef['itemType'] in variableCounts:
+                    line.append("{}position += get_{}_len(packet['{}'])".format(
+                        prefix, structDef['itemType'], structDef['itemName']))
+                else:
+                    line.append("{}position += get_{}_len()".format(
+                        prefix, structDef['itemType']))
                 if structDef['title']:
                     line.append(' # {}'.format(structDef['title']))
+            elif structDef['type'] == 'int24':
+                if structDef['array']:
+                    line.append("packet['{}'] = _getInt24Array(rawData, "
+                                "position, {}, {}, {}){}".format(
+                                    structDef['itemName'],
+                                    structDef['countVar'],
+                                    structDef['byteOrder'],
+                                    structDef['signed'], linesep))
+                else:
+                    line.append("packet['{}'] = _getInt24(rawData, position, "
+                                "{}, {}){}".format(structDef['itemName'],
+                                                   structDef['byteOrder'],
+                                                   structDef['signed'],
+                                                   linesep))
+                if structDef['variable']:
+                    line.append("{}position += {}".format(
+                        prefix, getVariableSize(structDef)))
+                else:
+                    line.append("{}position += {}".format(
+                        prefix, 3 * structDef['count']))
+            elif structDef['type'] == 'variable':
+                segmentStr = "_getStruct('{}', '{}', {})".format(
+                    structDef['endianChar'], structDef['formatChar'],
+                    structDef['countVar'])
+                if structDef['array']:
+                    line.append("packet['{}'] = list({}.unpack_from(rawData, "
+                                "position)){}".format(structDef['itemName'],
+                                                     segmentStr, linesep))
+                elif not structDef['padding']:
+                    line.append("[packet['{}']] = {}.unpack_from(rawData, "
+                                "position){}".format(structDef['itemName'],
+                                                    segmentStr, linesep))
+                line.append("{}position += {}".format(
+                    prefix if line else '', getVariableSize(structDef)))
             if line:
                 writeOut(outBufStr, ''.join(line), prefix)
+        enumItems = []
+        if options.get('decodeEnums', False):
+            enumItems = [item for item in getPacketLayout(
+                packetName, specification, layouts)
+                if item['enum'] in enumClasses]
+            for item in enumItems:
+                if item['count'] == 1:
+                    writeOut(outBufStr, "packet['{0}'] = {1}.members.get("
+                             "packet['{0}'], packet['{0}'])".format(
+                                 item['name'], item['enum']), prefix)
+                else:
+                    writeOut(outBufStr, "packet['{0}'] = [{1}.members.get("
+                             "value, value) for value in packet['{0}']]"
+                             .format(item['name'], item['enum']), prefix)
         writeOut(outBufStr, 'return packet', prefix)
         writeOut(outBufStr, 'directlyProvides(unpack_{}, I{}Unpacker)'.format(
                  packetName, extensionlessName))
+        if options.get('instrument', False):
+            if isVariable:
+                writeOut(outBufStr, "unpack_{0} = _instrument(unpack_{0}, "
+                         "'{0}', 'unpack', get_{0}_len)".format(packetName))
+            else:
+                writeOut(outBufStr, "unpack_{0} = _instrument(unpack_{0}, "
+                         "'{0}', 'unpack', get_{0}_len())".format(packetName))
+            writeOut(outBufStr, 'directlyProvides(unpack_{}, I{}Unpacker)'
+                     .format(packetName, extensionlessName))
         # Write the temporary buffer to the output file.
         writeOut(pyFile, outBufStr.getvalue())
         outBufStr.close()
         writeOut(pyFile, '')
 
-        # Create the validate function
-        writeOut(pyFile, 'def validate_{}(rawData):'.format(packetName))
-        writeOut(pyFile, '"""', prefix)
-        writeOut(pyFile, "Reads and validates a {} packet.".format(packetName), prefix)
-        writeOut(pyFile, '')
-        writeOut(pyFile, "Reads a {} structure from raw binary data".format(
-                 packetName), prefix)
-        writeOut(pyFile, "and validates it.", prefix)
-        writeOut(pyFile, '')
-        writeOut(pyFile, 'Args:', prefix)
-        writeOut(pyFile, 'rawData (str): The raw binary data to be unpacked.',
-                 2 * prefix)
-        writeOut(pyFile, '')
-        writeOut(pyFile, 'Returns:', prefix)
-        writeOut(pyFile, 'A structure representing the {} packet.'.format(packetName),
-                 2 * prefix)
-        writeOut(pyFile, '"""', prefix)
-        writeOut(pyFile, 'assert isinstance(rawData, str)', prefix)
-        writeOut(pyFile, 'packet = get_{}(rawData)'.format(packetName), prefix)
-        writeOut(pyFile, 'return packet', prefix)
+        # Create the function unpacking into an existing record
+        outputUnpackInto(packetName, structDefList, enumItems, pyFile)
+
+        outputValidators(packetName, specification, pyFile, layouts)
+        if packetName in columnFields:
+            outputColumnCodecs(packetName, specification,
+                               columnFields[packetName], pyFile, layouts)
+        if useRuntime:
+            writeOut(pyFile, "_recordUnpackers['{0}'] = unpack_{0}_into"
+                     .format(packetName))
+            writeOut(pyFile, "_fieldLayouts['{}'] = {{".format(packetName))
+            fieldLayout = getFieldLayout(packetName, specification, layouts)
+            for fieldNum, (fieldName, fieldPlace) in enumerate(
+                    fieldLayout.items()):
+                writeOut(pyFile, '{!r}: {!r}{}'.format(
+                    fieldName, fieldPlace,
+                    ',' if fieldNum < len(fieldLayout) - 1 else ''), prefix)
+            writeOut(pyFile, '}')
+            writeOut(pyFile, "_lengthFields['{}'] = {!r}".format(
+                packetName, getLengthFields(packetName, specification,
+                                            fieldLayout, layouts)))
+            writeOut(pyFile, "_resyncAnchors['{}'] = {!r}".format(
+                packetName, getResyncAnchor(packetName, specification,
+                                            fieldLayout, layouts)))
+            writeOut(pyFile, '')
+        writeOut(pyFile, '# Where each field of {} lives on the wire: a byte '
+                 'offset, a'.format(packetName))
+        writeOut(pyFile, '# tuple of the container offset and bit offset '
+                 'for bitfields,')
+        writeOut(pyFile, '# or None after an item of variable size')
+        writeOut(pyFile, '{}_OFFSETS = {{'.format(packetName.upper()))
+        fieldOffsets = getFieldOffsets(packetName, specification, layouts)
+        for fieldNum, (fieldName, fieldOffset) in enumerate(
+                fieldOffsets.items()):
+            writeOut(pyFile, '{!r}: {!r}{}'.format(
+                fieldName, fieldOffset,
+                ',' if fieldNum < len(fieldOffsets) - 1 else ''), prefix)
+        writeOut(pyFile, '}')
         writeOut(pyFile, '')
         writeOut(pyFile, '')
 
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Shared memory packet ring
+
+Passes packets between two processes on one host through a ring of
+fixed-size slots in shared memory, without pickling. The producer
+packs each packet straight into the next free slot with a generated
+pack_<packet>_into function and the consumer unpacks it in place,
+with a function taking a buffer and offset (such as one made by the
+generated make_unpacker) or through a view of the slot (such as for
+overlaying a generated ctypes structure).
+
+Each slot starts with a sequence number telling whose turn it is,
+so that there must be only one producer and one consumer. Python 3.8
+and later use multiprocessing.shared_memory; earlier versions map a
+file in /dev/shm (or the temporary directory) instead.
+"""
+
+from ctypes import c_char
+from mmap import mmap
+from os import ftruncate, open as openFile, close as closeFile, \
+    unlink as unlinkFile, O_CREAT, O_EXCL, O_RDWR
+from os.path import isdir, join
+from struct import pack_into, unpack_from
+from tempfile import gettempdir
+from time import sleep, time
+try:
+    from queue import Empty, Full
+except ImportError:
+    from Queue import Empty, Full
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    SharedMemory = None
+
+# The layout of the start of the ring: an identifying magic number,
+# the payload size of each slot and the number of slots
+ringHeaderFmt = '<4sII'
+ringMagic = b'SSPR'
+
+# The layout of the start of each slot: its sequence number and the
+# length of the packet in it
+slotHeaderFmt = '<QI'
+slotHeaderSize = 16
+
+# Slots are kept to whole cache lines so the two sides do not share
+# any line they are writing
+cacheLineSize = 64
+
+# The longest wait between checks of a slot, in seconds
+maxBackOff = 0.001
+
+
+def getSlotStride(slotSize):
+    """
+    Determines the space taken by each slot of a ring.
+
+    Args:
+        slotSize (int): The largest packet a slot holds.
+
+    Returns:
+        The number of bytes from the start of one slot to the next.
+
+    Examples:
+        >>> getSlotStride(31)
+        64
+        >>> getSlotStride(49)
+        128
+    """
+    return -(-(slotHeaderSize + slotSize) // cacheLineSize) * cacheLineSize
+
+
+class PacketRing(object):
+    """
+    A single-producer, single-consumer ring of packets.
+
+    Slot i starts with sequence number i. The producer may fill
+    slot i % slotCount on its nth write once its sequence number is
+    n, then sets it to n + 1; the consumer may read it once it is
+    n + 1, then sets it to n + slotCount to hand it back. This relies
+    on stores reaching the other process in the order they are made,
+    as they do on x86.
+
+    Examples:
+        >>> ring = PacketRing('structspec-doctest', 8, 4, create=True)
+        >>> def packInto(packet, buffer, offset):
+        ...     buffer[offset:offset + len(packet)] = packet
+        ...     return len(packet)
+        >>> ring.put(packInto, b'hello')
+        >>> print(ring.get().decode())
+        hello
+        >>> try:
+        ...     ring.get(timeout=0)
+        ... except Empty:
+        ...     print('Nothing waiting')
+        Nothing waiting
+        >>> ring.close()
+        >>> ring.unlink()
+    """
+
+    def __init__(self, name, slotSize=None, slotCount=None, create=False):
+        """
+        Creates or attaches to a ring.
+
+        Args:
+            name (str):      The name of the shared memory.
+            slotSize (int):  The largest packet a slot holds; only
+                             needed when creating the ring.
+            slotCount (int): The number of slots; only needed when
+                             creating the ring.
+            create (bool):   Whether to create the ring rather than
+                             attach to an existing one.
+
+        Raises:
+            ValueError: If the shared memory is not a ring.
+        """
+        self.name = name
+        headerSize = cacheLineSize
+        if create:
+            size = headerSize + slotCount * getSlotStride(slotSize)
+        else:
+            size = None
+        self.memory, self.buffer = self._openMemory(name, size)
+        if create:
+            pack_into(ringHeaderFmt, self.buffer, 0, ringMagic, slotSize,
+                      slotCount)
+            for slotNum in range(slotCount):
+                pack_into(slotHeaderFmt, self.buffer, headerSize +
+                          slotNum * getSlotStride(slotSize), slotNum, 0)
+        magic, slotSize, slotCount = unpack_from(ringHeaderFmt,
+                                                 self.buffer, 0)
+        if magic != ringMagic:
+            self.close()
+            raise ValueError('{} is not a packet ring'.format(name))
+        self.slotSize = slotSize
+        self.slotCount = slotCount
+        self.slotOffsets = [headerSize + slotNum * getSlotStride(slotSize)
+                            for slotNum in range(slotCount)]
+        self.slots = [(c_char * slotSize).from_buffer(
+            self.buffer, slotOffset + slotHeaderSize)
+            for slotOffset in self.slotOffsets]
+        self.writePosition = 0
+        self.readPosition = 0
+
+    @staticmethod
+    def _getPath(name):
+        """Gets the file mapped for a ring without shared_memory."""
+        return join('/dev/shm' if isdir('/dev/shm') else gettempdir(), name)
+
+    def _openMemory(self, name, size):
+        """Opens the shared memory, giving it and a writable buffer."""
+        if SharedMemory is not None:
+            if size is None:
+                memory = SharedMemory(name)
+            else:
+                memory = SharedMemory(name, True, size)
+            return memory, memory.buf
+        if size is None:
+            fileNum = openFile(self._getPath(name), O_RDWR)
+        else:
+            fileNum = openFile(self._getPath(name), O_RDWR | O_CREAT | O_EXCL)
+            ftruncate(fileNum, size)
+        try:
+            memory = mmap(fileNum, 0)
+        finally:
+            closeFile(fileNum)
+        return memory, memory
+
+    def _waitFor(self, slotNum, sequence, timeout, exception):
+        """Waits for a slot to reach a sequence number."""
+        slotOffset = self.slotOffsets[slotNum]
+        deadline = None if timeout is None else time() + timeout
+        backOff = 0
+        while unpack_from('<Q', self.buffer, slotOffset)[0] != sequence:
+            if deadline is not None and time() >= deadline:
+                raise exception()
+            sleep(backOff)
+            backOff = min(2 * backOff or 0.000001, maxBackOff)
+        return slotOffset
+
+    def put(self, packInto, packet, timeout=None):
+        """
+        Packs a packet straight into the next free slot.
+
+        Args:
+            packInto (function): A function packing the packet into a
+                                 buffer at an offset and giving the
+                                 number of bytes packed, such as a
+                                 generated pack_<packet>_into.
+            packet:              The packet to pack.
+            timeout (float):     The longest time in seconds to wait
+                                 for a free slot; forever if None.
+
+        Raises:
+            Full:        If no slot became free in time.
+            StructError: If the packet is too big for a slot.
+        """
+        slotNum = self.writePosition % self.slotCount
+        slotOffset = self._waitFor(slotNum, self.writePosition, timeout,
+                                   Full)
+        length = packInto(packet, self.slots[slotNum], 0)
+        pack_into('<I', self.buffer, slotOffset + 8, length)
+        self.writePosition += 1
+        pack_into('<Q', self.buffer, slotOffset, self.writePosition)
+
+    def _take(self, timeout):
+        """Waits for the next full slot, giving its number and length."""
+        slotNum = self.readPosition % self.slotCount
+        slotOffset = self._waitFor(slotNum, self.readPosition + 1, timeout,
+                                   Empty)
+        return slotNum, unpack_from('<I', self.buffer, slotOffset + 8)[0]
+
+    def _release(self, slotNum):
+        """Hands the slot just read back to the producer."""
+        self.readPosition += 1
+        pack_into('<Q', self.buffer, self.slotOffsets[slotNum],
+                  self.readPosition + self.slotCount - 1)
+
+    def get(self, unpackFrom=None, timeout=None):
+        """
+        Takes the next packet from the ring.
+
+        Args:
+            unpackFrom (function): A function unpacking a packet
+                                   from a buffer at an offset, such
+                                   as one made by the generated
+                                   make_unpacker; if None the packed
+                                   bytes are given.
+            timeout (float):       The longest time in seconds to
+                                   wait for a packet; forever if
+                                   None.
+
+        Returns:
+            The unpacked packet, or its packed bytes.
+
+        Raises:
+            Empty: If no packet arrived in time.
+        """
+        slotNum, length = self._take(timeout)
+        try:
+            if unpackFrom is None:
+                return self.slots[slotNum].raw[:length]
+            return unpackFrom(self.slots[slotNum], 0)
+        finally:
+            self._release(slotNum)
+
+    def view(self, timeout=None):
+        """
+        Waits for the next packet and gives a view of it in place.
+
+        The slot is not handed back until release is called, and
+        the view must not be used after that.
+
+        Args:
+            timeout (float): The longest time in seconds to wait for
+                             a packet; forever if None.
+
+        Returns:
+            A writable ctypes array of the slot's bytes (which any
+            ctypes structure can overlay with from_buffer) and the
+            length of the packet in it.
+
+        Raises:
+            Empty: If no packet arrived in time.
+        """
+        slotNum, length = self._take(timeout)
+        return self.slots[slotNum], length
+
+    def release(self):
+        """Hands back the slot given by the last call to view."""
+        self._release(self.readPosition % self.slotCount)
+
+    def close(self):
+        """Detaches from the ring, which must not be used after."""
+        self.slots = []
+        if SharedMemory is not None:
+            self.buffer = None
+        self.memory.close()
+
+    def unlink(self):
+        """Removes the ring once both sides have finished with it."""
+        if SharedMemory is not None:
+            self.memory.unlink()
+        else:
+            unlinkFile(self._getPath(self.name))
+
+
+# Execute the following when run from the command line.
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
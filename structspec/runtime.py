@@ -0,0 +1,756 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runtime support for generated Python handlers
+
+Holds what the Python handlers generated for every specification
+share rather than repeat: pools of records to unpack packets into,
+unpacking only some fields, reading compressed captures, scanning and
+resynchronizing captures and packing many packets at once.
+
+A generated module keeps tables describing its own packets (its
+_recordUnpackers, _fieldLayouts, _lengthFields, _resyncAnchors and
+_runPackers dictionaries) and wraps the functions here, handing them
+its globals so that they find its tables and packet functions.
+"""
+
+from bz2 import BZ2File
+from ctypes import c_char
+from gzip import GzipFile
+from importlib import import_module
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+from struct import Struct, calcsize
+from struct import error as StructError
+from sys import byteorder
+from threading import Event, Thread
+try:
+    from lzma import LZMAFile
+except ImportError:
+    LZMAFile = None
+try:
+    from queue import Empty, Full, Queue
+except ImportError:
+    from Queue import Empty, Full, Queue
+try:
+    from multiprocessing import get_start_method
+except ImportError:
+    # Before Python 3.4 pool workers are forked wherever they can be
+    from os import name as osName
+
+    def get_start_method():
+        return {'nt': 'spawn'}.get(osName, 'fork')
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The decompressing file types by file name extension
+decompressors = (('.gz', GzipFile), ('.bz2', BZ2File), ('.xz', LZMAFile),
+                 ('.lzma', LZMAFile))
+
+# The shared memory a pool worker packs into, and the packets being
+# packed when the workers are forked and so start out with them
+_sharedOutput = None
+_sharedRecords = None
+
+
+class RecordPool(object):
+    """
+    A free list of records to unpack packets into.
+
+    Unpacking into records taken from the pool, and handing them
+    back once finished with, keeps a steady stream of packets from
+    allocating anything new (and so from making work for the garbage
+    collector) once the pool has warmed up.
+
+    Generated modules subclass it, setting recordUnpackers to
+    their functions unpacking each packet into an existing record.
+    """
+
+    recordUnpackers = {}
+
+    def __init__(self, packetName, factory=dict, limit=None):
+        """
+        Makes an empty pool.
+
+        Args:
+            packetName (str):   The name of the packet.
+            factory (function): Makes a new record when the pool is
+                                empty; an object must come with any
+                                lists and nested records it needs.
+            limit (int):        The most records to keep for reuse;
+                                unlimited if None.
+
+        Raises:
+            ValueError: If the packet is unknown.
+        """
+        if packetName not in self.recordUnpackers:
+            raise ValueError('Unknown packet {}'.format(packetName))
+        self.unpackInto = self.recordUnpackers[packetName]
+        self.factory = factory
+        self.limit = limit
+        self.free = []
+
+    def unpack(self, rawData, position=0):
+        """
+        Unpacks a packet into a record from the pool.
+
+        Args:
+            rawData:        The raw binary data to be unpacked.
+            position (int): Where in it the packet starts.
+
+        Returns:
+            The record, to be handed back with release.
+        """
+        record = self.free.pop() if self.free else self.factory()
+        self.unpackInto(rawData, position, record)
+        return record
+
+    def release(self, record):
+        """Hands a record back to the pool for reuse."""
+        if self.limit is None or len(self.free) < self.limit:
+            self.free.append(record)
+
+
+def makeUnpacker(namespace, packetName, fields):
+    """
+    Makes a function unpacking only some fields of a packet.
+
+    The fields are read straight from their offsets, all those of
+    the same byte order with a single compiled format, so that the
+    rest of the packet (including whole substructures) is skipped.
+    Bitfields sharing a container read it once.
+
+    Args:
+        namespace (dict): The globals of the generated module.
+        packetName (str): The name of the packet.
+        fields (list):    The dotted names of the fields wanted;
+                          naming a substructure gives all its
+                          fields.
+
+    Returns:
+        A function taking raw binary data and an optional position
+        within it and giving a dictionary of just those fields,
+        nested as unpacking the whole packet would give them.
+
+    Raises:
+        ValueError: If a field is unknown or has no fixed offset.
+    """
+    layout = namespace['_fieldLayouts'].get(packetName)
+    if layout is None:
+        raise ValueError('Unknown packet {}'.format(packetName))
+    wanted = []
+    for field in fields:
+        names = [name for name in layout
+                 if name == field or name.startswith(field + '.')]
+        if not names:
+            raise ValueError('{} has no field {} at a fixed offset'.format(
+                packetName, field))
+        wanted.extend([name for name in names if name not in wanted])
+    runs = {}
+    for name in sorted(wanted, key=lambda name: layout[name][0]):
+        runs.setdefault(layout[name][1], []).append(name)
+    plans = []
+    for endianChar, names in runs.items():
+        start = end = layout[names[0]][0]
+        tokens = []
+        extractors = []
+        lastOffset = None
+        valueTotal = 0
+        for name in names:
+            offset, endianChar, token, valueCount, kind, extra = layout[name]
+            if offset != lastOffset:
+                if offset > end:
+                    tokens.append('{}x'.format(offset - end))
+                tokens.append(token)
+                end = offset + calcsize(endianChar + token)
+                index = valueTotal
+                valueTotal += valueCount
+                lastOffset = offset
+            if kind == 'int24' and extra[0] == 'native':
+                extra = (byteorder,) + extra[1:]
+            extractors.append((index, valueCount, name.split('.'), kind,
+                               extra))
+        plans.append((Struct(endianChar + ''.join(tokens)), start,
+                      extractors))
+    getInt24 = namespace.get('_getInt24')
+    getInt24Array = namespace.get('_getInt24Array')
+
+    def unpacker(rawData, position=0):
+        packet = {}
+        for compiled, start, extractors in plans:
+            values = compiled.unpack_from(rawData, position + start)
+            for index, valueCount, path, kind, extra in extractors:
+                if kind == 'value':
+                    value = values[index]
+                elif kind == 'list':
+                    value = list(values[index:index + valueCount])
+                elif kind == 'bits':
+                    value = (values[index] >> extra[0]) & extra[1]
+                elif extra[2] == 1:
+                    value = getInt24(values[index], 0, extra[0], extra[1])
+                else:
+                    value = getInt24Array(values[index], 0, extra[2],
+                                          extra[0], extra[1])
+                target = packet
+                for part in path[:-1]:
+                    target = target.setdefault(part, {})
+                target[path[-1]] = value
+        return packet
+    return unpacker
+
+
+class CaptureReader(object):
+    """
+    Reads a compressed capture file, decompressing in the background.
+
+    A thread decompresses chunks into a bounded queue, so that
+    decompression overlaps with unpacking while holding no more
+    than a few chunks in memory at once.
+    """
+
+    def __init__(self, source, chunkSize=1 << 20, queueDepth=4):
+        """
+        Starts decompressing.
+
+        Args:
+            source (file):    A decompressing file object.
+            chunkSize (int):  The number of bytes to decompress
+                              at a time.
+            queueDepth (int): The most chunks to hold waiting.
+        """
+        self.source = source
+        self.chunks = Queue(queueDepth)
+        self.stopping = Event()
+        self.pending = b''
+        self.ended = False
+        self.worker = Thread(target=self._decompress, args=(chunkSize,))
+        self.worker.daemon = True
+        self.worker.start()
+
+    def _decompress(self, chunkSize):
+        """Feeds the queue until the end of the source."""
+        try:
+            while True:
+                chunk = self.source.read(chunkSize)
+                self._put(chunk)
+                if not chunk:
+                    return
+        except Exception as err:
+            self._put(err)
+
+    def _put(self, item):
+        """Queues an item unless the reader is closed first."""
+        while not self.stopping.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def read(self, size=-1):
+        """
+        Reads decompressed data.
+
+        Args:
+            size (int): The most bytes to read; all the rest if
+                        negative.
+
+        Returns:
+            The bytes read, empty at the end of the file.
+        """
+        outList = [self.pending]
+        self.pending = b''
+        while not self.ended and (size < 0 or not outList[-1]):
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                self.ended = True
+                raise chunk
+            if not chunk:
+                self.ended = True
+            outList.append(chunk)
+        rawData = b''.join(outList)
+        if size >= 0:
+            rawData, self.pending = rawData[:size], rawData[size:]
+        return rawData
+
+    def close(self):
+        """Stops decompressing and closes the source."""
+        self.stopping.set()
+        while self.worker.is_alive():
+            try:
+                self.chunks.get(timeout=0.1)
+            except Empty:
+                pass
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+
+def openCapture(path, chunkSize=1 << 20, queueDepth=4):
+    """
+    Opens a capture file, compressed or not, for reading.
+
+    Files named with .gz, .bz2, .xz or .lzma extensions are
+    decompressed in the background as they are read.
+
+    Args:
+        path (str):       The name of the capture file.
+        chunkSize (int):  The number of bytes to decompress
+                          at a time.
+        queueDepth (int): The most decompressed chunks to hold
+                          waiting to be read.
+
+    Returns:
+        A file-like object with read and close methods.
+
+    Raises:
+        ValueError: If the file is compressed in a way this Python
+                    cannot decompress.
+    """
+    for extension, decompressor in decompressors:
+        if path.endswith(extension):
+            if decompressor is None:
+                raise ValueError('Cannot decompress {} files'.format(
+                    extension))
+            return CaptureReader(decompressor(path, 'rb'), chunkSize,
+                                 queueDepth)
+    return open(path, 'rb')
+
+
+def checkCondition(value, condition):
+    """
+    Tests a value against a condition of scan.
+
+    Args:
+        value:     The value of a field.
+        condition: A value to be equal to, a (low, high) tuple to
+                   lie within inclusively, or a list or set of values
+                   to be among.
+
+    Returns:
+        True if the value meets the condition.
+
+    Examples:
+        >>> checkCondition(3, (1, 3))
+        True
+        >>> checkCondition(3, [1, 2])
+        False
+        >>> checkCondition(3, 3)
+        True
+    """
+    if isinstance(condition, tuple):
+        return condition[0] <= value <= condition[1]
+    if isinstance(condition, (list, set, frozenset)):
+        return value in condition
+    return value == condition
+
+
+def checkColumnCondition(column, condition):
+    """Tests a whole NumPy column against a condition of scan."""
+    if isinstance(condition, tuple):
+        return (column >= condition[0]) & (column <= condition[1])
+    if isinstance(condition, (list, set, frozenset)):
+        return numpy.isin(column, list(condition))
+    return column == condition
+
+
+def _scanFixed(namespace, inFile, packetName, where, chunkSize):
+    """Yields the matching packets of a file of fixed-size packets."""
+    unpackPacket = namespace['unpack_' + packetName]
+    packetSize = namespace['get_{}_len'.format(packetName)]()
+    columns = namespace.get('_{}_columns'.format(packetName))
+    if namespace.get('numpy') is not None and columns is not None:
+        fields = tuple([field for field in columns if field[0] in where])
+    else:
+        fields = None
+        conditions = [(name.split('.'), condition)
+                      for name, condition in where.items()]
+        select = makeUnpacker(namespace, packetName, list(where))
+    readSize = max(1, chunkSize // packetSize) * packetSize
+    rawData = b''
+    offset = 0
+    while True:
+        chunk = inFile.read(readSize)
+        if not chunk:
+            break
+        rawData += chunk
+        count = len(rawData) // packetSize
+        if fields is not None:
+            records = numpy.frombuffer(
+                rawData, namespace['_getRecordType'](fields, packetSize),
+                count)
+            matching = numpy.ones(count, bool)
+            for name, key, fmt, fieldOffset, elementCount, kind, extra, \
+                    typecode in fields:
+                column = records[key]
+                if kind == 'bits':
+                    column = (column >> extra[0]) & ((1 << extra[1]) - 1)
+                elif kind == 'int24':
+                    column = namespace['_widenInt24'](column, *extra)
+                matching &= checkColumnCondition(column, where[name])
+            indices = numpy.flatnonzero(matching)
+        else:
+            indices = []
+            for index in range(count):
+                packet = select(rawData, index * packetSize)
+                for path, condition in conditions:
+                    value = packet
+                    for part in path:
+                        value = value[part]
+                    if not checkCondition(value, condition):
+                        break
+                else:
+                    indices.append(index)
+        for index in indices:
+            position = int(index) * packetSize
+            yield (offset + position,
+                   unpackPacket(rawData[position:position + packetSize]))
+        rawData = rawData[count * packetSize:]
+        offset += count * packetSize
+    if rawData:
+        raise ValueError('Capture ends part way through a {}'.format(
+            packetName))
+
+
+def _scanVariable(namespace, inFile, packetName, where, chunkSize):
+    """Yields the matching packets of a file of variable-size packets."""
+    unpackPacket = namespace['unpack_' + packetName]
+    getLength = namespace['get_{}_len'.format(packetName)]
+    minimumSize = getLength()
+    lengthFields = namespace['_lengthFields'][packetName]
+    conditions = [(name.split('.'), condition)
+                  for name, condition in where.items()]
+    select = makeUnpacker(namespace, packetName,
+                          list(where) + (lengthFields or []))
+    rawData = b''
+    offset = position = 0
+    ended = False
+    while not ended:
+        chunk = inFile.read(chunkSize)
+        ended = not chunk
+        rawData = rawData[position:] + chunk
+        offset += position
+        position = 0
+        while len(rawData) - position >= minimumSize:
+            selected = select(rawData, position)
+            if lengthFields is not None:
+                packet = None
+                packetSize = getLength(selected)
+            else:
+                # Decode the whole packet to learn its length, trying
+                # ever larger windows to avoid copying the whole chunk
+                window = max(4 * minimumSize, 256)
+                while True:
+                    try:
+                        packet = unpackPacket(
+                            rawData[position:position + window])
+                        break
+                    except StructError:
+                        if position + window >= len(rawData):
+                            packet = None
+                            break
+                        window *= 2
+                if packet is None:
+                    break
+                packetSize = getLength(packet)
+            if position + packetSize > len(rawData):
+                break
+            for path, condition in conditions:
+                value = selected
+                for part in path:
+                    value = value[part]
+                if not checkCondition(value, condition):
+                    break
+            else:
+                if packet is None:
+                    packet = unpackPacket(
+                        rawData[position:position + packetSize])
+                yield offset + position, packet
+            position += packetSize
+    if position < len(rawData):
+        raise ValueError('Capture ends part way through a {}'.format(
+            packetName))
+
+
+def scan(namespace, path, packetName, where=None, chunkSize=1 << 24):
+    """
+    Finds the packets in a capture file meeting some conditions.
+
+    The conditions are checked against fields read straight from
+    the raw data, all at once with NumPy for packets of fixed size,
+    and only the packets meeting them all are fully unpacked.
+
+    Args:
+        namespace (dict): The globals of the generated module.
+        path (str):       The name of a file holding packets of
+                          the one type laid end to end, which
+                          may be compressed (see openCapture).
+        packetName (str): The name of the packet.
+        where (dict):     Conditions keyed by dotted field name,
+                          each a value to be equal to, a (low, high)
+                          tuple to lie within inclusively, or a list
+                          or set of values to be among.
+        chunkSize (int):  The number of bytes to read at a time.
+
+    Yields:
+        A tuple of the offset within the file and the unpacked
+        contents of each matching packet.
+
+    Raises:
+        ValueError: If a condition is on an unknown field or one
+                    without a single value at a fixed offset, or
+                    if the file ends part way through a packet.
+    """
+    where = dict(where or {})
+    layout = namespace['_fieldLayouts'].get(packetName)
+    if layout is None:
+        raise ValueError('Unknown packet {}'.format(packetName))
+    for name in where:
+        if name not in layout or layout[name][4] == 'list' or \
+                layout[name][4] == 'int24' and layout[name][5][2] != 1:
+            raise ValueError('{} has no single {} at a fixed offset'.format(
+                packetName, name))
+    with openCapture(path) as inFile:
+        if namespace['_lengthFields'][packetName] == []:
+            matches = _scanFixed(namespace, inFile, packetName, where,
+                                 chunkSize)
+        else:
+            matches = _scanVariable(namespace, inFile, packetName, where,
+                                    chunkSize)
+        for match in matches:
+            yield match
+
+
+def _decodeChecked(unpackInto, checkPacket, rawData, position):
+    """Unpacks and checks a packet, giving it and its size or None."""
+    packet = {}
+    try:
+        size = unpackInto(rawData, position, packet)
+    except (StructError, ValueError):
+        return None
+    if not size or position + size > len(rawData) or checkPacket(packet):
+        return None
+    return packet, size
+
+
+def _isConfirmed(unpackInto, checkPacket, rawData, position, confirm,
+                 ended):
+    """Tests whether a run of good packets starts at a position."""
+    for count in range(confirm):
+        if ended and count and position == len(rawData):
+            return True
+        decoded = _decodeChecked(unpackInto, checkPacket, rawData,
+                                 position)
+        if decoded is None:
+            return False
+        position += decoded[1]
+    return True
+
+
+def _findCandidate(rawData, start, anchor, hits):
+    """
+    Finds where the next packet may start from its identifying field.
+
+    Where each pattern was last found is kept in hits (None if not
+    yet looked for) so that no stretch is searched twice.
+    """
+    if anchor is None:
+        return start
+    fieldOffset, patterns = anchor
+    best = -1
+    for index, pattern in enumerate(patterns):
+        hit = hits[index]
+        if hit is None or 0 <= hit < start + fieldOffset:
+            hit = hits[index] = rawData.find(pattern, start + fieldOffset)
+        if hit >= 0 and (best < 0 or hit < best):
+            best = hit
+    return best if best < 0 else best - fieldOffset
+
+
+def resync(namespace, path, packetName, confirm=3, chunkSize=1 << 24,
+           lookAhead=1 << 16):
+    """
+    Reads the packets of a capture file that may be corrupt.
+
+    Each packet is unpacked and checked against the constraints on
+    its values. Where that fails the capture is searched (with
+    bytes.find, so quickly) for the next place the packet's most
+    telling identifying field holds a permitted value, or tried at
+    every byte if it has none. That place is taken as the next packet
+    boundary once a run of packets starting there unpacks and checks
+    good, and the bytes passed over are reported.
+
+    Packets with no constraints on their values can only be found to
+    be corrupt when they cannot be unpacked at all.
+
+    Args:
+        namespace (dict): The globals of the generated module.
+        path (str):       The name of a file holding packets of
+                          the one type laid end to end, which
+                          may be compressed (see openCapture).
+        packetName (str): The name of the packet.
+        confirm (int):    How many good packets in a row confirm
+                          a boundary.
+        chunkSize (int):  The number of bytes to read at a time.
+        lookAhead (int):  The most bytes that many packets take up.
+
+    Yields:
+        A tuple of the offsets within the file of the start and end
+        of each packet and its unpacked contents, or None in place
+        of the contents for each range of bytes skipped.
+
+    Raises:
+        ValueError: If the packet is unknown.
+    """
+    unpackInto = namespace['_recordUnpackers'].get(packetName)
+    if unpackInto is None:
+        raise ValueError('Unknown packet {}'.format(packetName))
+    checkPacket = namespace['check_' + packetName]
+    anchor = namespace['_resyncAnchors'][packetName]
+    with openCapture(path) as inFile:
+        rawData = b''
+        offset = position = 0
+        ended = False
+        skipStart = None
+        hits = []
+        while True:
+            if not ended and len(rawData) - position < lookAhead:
+                chunk = inFile.read(chunkSize)
+                ended = not chunk
+                rawData = rawData[position:] + chunk
+                offset += position
+                position = 0
+                hits = [None] * (0 if anchor is None else len(anchor[1]))
+                continue
+            if skipStart is None:
+                if position >= len(rawData):
+                    return
+                decoded = _decodeChecked(unpackInto, checkPacket, rawData,
+                                         position)
+                if decoded is not None:
+                    packet, size = decoded
+                    yield (offset + position, offset + position + size,
+                           packet)
+                    position += size
+                    continue
+                skipStart = offset + position
+                position += 1
+            candidate = _findCandidate(rawData, position, anchor, hits)
+            if candidate < 0 or candidate >= len(rawData):
+                if ended:
+                    yield (skipStart, offset + len(rawData), None)
+                    return
+                # Keep enough to find a field straddling the chunks
+                position = max(position, len(rawData) - lookAhead + 1)
+            elif not ended and candidate > len(rawData) - lookAhead:
+                position = candidate
+            elif _isConfirmed(unpackInto, checkPacket, rawData, candidate,
+                              confirm, ended):
+                yield (skipStart, offset + candidate, None)
+                skipStart = None
+                position = candidate
+            else:
+                position = candidate + 1
+
+
+def _attachOutput(sharedOutput):
+    """Keeps the shared memory handed to a new pool worker."""
+    global _sharedOutput
+    _sharedOutput = sharedOutput
+
+
+def _packChunk(job):
+    """Packs a run of packets into shared memory, giving where it ends."""
+    moduleName, packetName, records, offset = job
+    if isinstance(records, slice):
+        records = _sharedRecords[records]
+    runPackers = import_module(moduleName)._runPackers
+    return runPackers[packetName](records, _sharedOutput, offset)
+
+
+def packMany(namespace, packetName, records, packetLen, processes,
+             chunkLen):
+    """
+    Packs packets end to end into a buffer sized exactly beforehand.
+
+    The packets are taken in runs of chunkLen, each sized from
+    packetLen if the packet is of fixed size or else from the counts
+    held in its packets, so that where every run starts is known up
+    front. Unless processes is None the runs are handed out to a pool
+    of processes packing into shared memory; forked processes already
+    have the packets, so are only told which to pack. Pool workers
+    find the generated module by its name, so it must be importable
+    (or already in sys.modules) under it.
+
+    Args:
+        namespace (dict): The globals of the generated module.
+        packetName (str): The name of the packet.
+        records (list):   The dictionaries of data to be packed.
+        packetLen (int):  The size of the packet, or None if it
+                          is of variable size.
+        processes (int):  How many worker processes to share the
+                          packing out among, or None.
+        chunkLen (int):   How many packets to hand a worker at once.
+
+    Returns:
+        A bytearray of the packed packets.
+
+    Raises:
+        StructError: If a packet cannot be packed or the packets
+                     do not match their counts.
+    """
+    global _sharedRecords
+    runPacker = namespace['_runPackers'][packetName]
+    if not isinstance(records, (list, tuple)):
+        records = list(records)
+    runs = [slice(start, start + chunkLen)
+            for start in range(0, len(records), chunkLen)]
+    if packetLen is None:
+        getLen = namespace['get_{}_len'.format(packetName)]
+        sizes = [sum([getLen(record) for record in records[run]])
+                 for run in runs]
+    else:
+        sizes = [packetLen * (min(run.stop, len(records)) - run.start)
+                 for run in runs]
+    ends = []
+    for size in sizes:
+        ends.append(size + (ends[-1] if ends else 0))
+    totalSize = ends[-1] if ends else 0
+    if processes is None or not totalSize:
+        output = bytearray(totalSize)
+        packedEnds = [runPacker(records, output, 0)]
+        ends = [totalSize]
+    else:
+        sharedOutput = RawArray(c_char, totalSize)
+        forking = get_start_method() == 'fork'
+        jobs = [(namespace['__name__'], packetName,
+                 run if forking else records[run], end - size)
+                for run, size, end in zip(runs, sizes, ends)]
+        if forking:
+            _sharedRecords = records
+        try:
+            pool = Pool(processes, _attachOutput, (sharedOutput,))
+            try:
+                packedEnds = pool.map(_packChunk, jobs, 1)
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            _sharedRecords = None
+        output = bytearray(memoryview(sharedOutput))
+    if packedEnds != ends:
+        raise StructError('{} packets do not match their counts'.format(
+            packetName))
+    return output
+
+
+# Execute the following when run from the command line.
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -12,7 +12,7 @@ http://tools.ietf.org/html/draft-fge-json-schema-validation-00 for
 core and validation, respectively).
 """
 
-from sys import exit
+from sys import exit, stdout
 from os.path import join
 from collections import OrderedDict
 from argparse import ArgumentParser, Namespace
@@ -24,21 +24,22 @@ except ImportError:
     from json import load as loadJson
 try:
     from jsonschema.exceptions import ValidationError
-    from jsonschema import validate as validateJson
+    from jsonschema.validators import validator_for
+
+    def loadValidator(jsonSchema):
+        return validator_for(jsonSchema)(jsonSchema)
 except ImportError:
     try:
         from jsonspec.validators.exceptions import ValidationError
         from jsonspec.validators import load as loadValidator
-
-        def validateJson(jsonObj, jsonSchema):
-            validator = loadValidator(schema)
-            validator.validate(sample)
     except ImportError:
         print("No supported JSON validation library found.")
         exit(1)
 from importlib import import_module
 from inspect import getmembers, ismodule
 from common import giveUp, isNonPortableType, getJsonPointer
+from analyze import outputAnalysis
+from watch import FileWatcher, defaultInterval
 # Fetch all language modules without knowing a priori what's available
 import languages
 from languages import *
@@ -75,7 +76,10 @@ def parseArguments(args=None):
                 specification='specification.json', \
                 languages=['Python', 'C'], \
                 schema='structspec-schema.json', \
-                include=False, test=False, verbose=False)
+                include=False, test=False, verbose=False, \
+                benchmark=False, decodeEnums=False, instrument=False, \
+                runtime=False, \
+                analyzeLayout=False, watch=None)
         >>> # Note that usually this is given no arguments so
         >>> # it'll just read from the command line.
         >>> # It's here given an empty list just for testing.
@@ -123,7 +127,9 @@ def parseArguments(args=None):
         help='Specification file defining binary packet formats. ' +
         'By default this is called {}'.format(defaultSpecification)
     )
-    defaultLanguageList = langModules.keys()
+    # Other languages (such as those building on the C and Python
+    # output) are only output when asked for
+    defaultLanguageList = ['Python', 'C']
     writtenLanguageList = ', '.join(defaultLanguageList[:-1])
     oxfordComma = ',' if len(defaultLanguageList) > 2 else ''
     writtenLanguageList = '{}{} and {}'.format(writtenLanguageList,
@@ -140,6 +146,38 @@ def parseArguments(args=None):
         '--include', '-i', action='store_true',
         help='Include identifier within individual packets.'
     )
+    parser.add_argument(
+        '--decode-enums', action='store_true', dest='decodeEnums',
+        help='Unpack fields typed by an enumeration as its members.'
+    )
+    parser.add_argument(
+        '--instrument', action='store_true',
+        help='Count calls, bytes, time and errors per packet in the ' +
+        'generated Python handlers.'
+    )
+    parser.add_argument(
+        '--runtime', action='store_true',
+        help='Add record pools, selective unpacking, capture scanning ' +
+        'and resynchronizing and bulk packing to the generated Python ' +
+        'handlers, which then need structspec installed to be used.'
+    )
+    parser.add_argument(
+        '--benchmark', action='store_true',
+        help='Also output micro-benchmarks for the generated handlers.'
+    )
+    parser.add_argument(
+        '--analyze-layout', action='store_true', dest='analyzeLayout',
+        help='Report padding, alignment holes, bitfield waste and ' +
+        'cache line crossings for each packet and suggest denser ' +
+        'orders instead of outputting handlers.'
+    )
+    parser.add_argument(
+        '--watch', type=float, nargs='?', const=defaultInterval,
+        metavar='SECONDS',
+        help='Keep running, regenerating the output whenever the ' +
+        'specification or schema changes; they are checked every ' +
+        '{} seconds by default.'.format(defaultInterval)
+    )
     parser.add_argument(
         '--test', action='store_true', help='Test program and exit.'
     )
@@ -197,7 +235,30 @@ def checkJsonPointer(specification, jsonPointer):
     return True
 
 
-def loadAndValidateInputs(args):
+def loadSchema(args):
+    """
+    Loads the schema and prepares a validator for it.
+
+    Args:
+        args (Namespace): The command-line arguments to use.
+
+    Returns:
+        A tuple containing the schema object (converted from JSON)
+        and a validator for specifications using it.
+    """
+    assert isinstance(args, Namespace)
+
+    try:
+        schemaFile = open(args.schema)
+        schema = loadJson(schemaFile)
+    except EnvironmentError as envErr:
+        giveUp("Schema environment error", envErr)
+    except JSONDecodeError as jsonErr:
+        giveUp("Schema JSON decode error", jsonErr)
+    return (schema, loadValidator(schema))
+
+
+def loadAndValidateInputs(args, schema=None, validator=None):
     """
     Loads the specification and schema and validates the former.
 
@@ -207,7 +268,11 @@ def loadAndValidateInputs(args):
     specification.
 
     Args:
-        args (Namespace): The command-line arguments to use.
+        args (Namespace):   The command-line arguments to use.
+        schema (dict):      An already loaded schema; if None it is
+                            loaded from the file named in args.
+        validator (object): The validator for an already loaded
+                            schema.
 
     Returns:
         A tuple containing the specification object (converted
@@ -216,11 +281,8 @@ def loadAndValidateInputs(args):
     """
     assert isinstance(args, Namespace)
 
-    try:
-        schemaFile = open(args.schema)
-        schema = loadJson(schemaFile)
-    except EnvironmentError as envErr:
-        giveUp("Schema environment error", envErr)
+    if schema is None:
+        schema, validator = loadSchema(args)
 
     try:
         specificationFile = open(args.specification)
@@ -234,7 +296,7 @@ def loadAndValidateInputs(args):
     try:
         if args.verbose:
             print("Validating specification...")
-        validateJson(specification, schema)
+        validator.validate(specification)
         if args.verbose:
             print("Specification validated.")
             # If verbose, provide good practice checks
@@ -273,8 +335,12 @@ def loadAndValidateInputs(args):
         giveUp("Validation error", valErr)
 
     options = {
+        'benchmark': args.benchmark,
+        'decodeEnums': args.decodeEnums,
         'includeIdentifier': args.include,
+        'instrument': args.instrument,
         'languages': args.languages,
+        'runtime': args.runtime,
         'schemaName': args.schema,
         'specificationName': args.specification,
         'verbose': args.verbose
@@ -282,6 +348,63 @@ def loadAndValidateInputs(args):
     return (specification, schema, options)
 
 
+def outputForInputs(specification, options, args):
+    """
+    Outputs whatever was asked for on the command line.
+
+    Args:
+        specification (dict): The specification object.
+        options (dict):       Options parsed from the command line.
+        args (Namespace):     The command-line arguments to use.
+    """
+    if args.analyzeLayout:
+        outputAnalysis(specification, stdout)
+        return
+    for language in args.languages:
+        langModules[language].outputForLanguage(specification, options)
+
+
+def watchInputs(args):
+    """
+    Regenerates the output each time the inputs change.
+
+    Keeps the parsed schema and its validator loaded, only reloading
+    them when the schema itself changes, and only regenerates the
+    output when the specification's content has actually changed
+    (so saving it unchanged or just reformatting it does nothing).
+    Errors are reported without stopping so that the next save can
+    fix them. Runs until interrupted.
+
+    Args:
+        args (Namespace): The command-line arguments to use.
+    """
+    assert isinstance(args, Namespace)
+    schema = validator = lastSpecification = None
+    try:
+        for changed in FileWatcher([args.specification, args.schema],
+                                   args.watch):
+            try:
+                if schema is None or args.schema in changed:
+                    schema, validator = loadSchema(args)
+                    lastSpecification = None
+                specification, schema, options = loadAndValidateInputs(
+                    args, schema, validator)
+                if specification == lastSpecification:
+                    continue
+                outputForInputs(specification, options, args)
+                lastSpecification = specification
+            except SystemExit:
+                # The problem has already been reported
+                continue
+            except Exception as err:
+                print("Output error: {!r}".format(err))
+                continue
+            if args.verbose:
+                print("Regenerated from {}.".format(args.specification))
+    except KeyboardInterrupt:
+        pass
+
+
 # Execute the following when run from the command line.
 def main():
     """
@@ -290,13 +413,14 @@ def main():
     Executes structspec interactively from the command line.
     """
     args = parseArguments()
-    if not args.test:
-        specification, schema, options = loadAndValidateInputs(args)
-        for language in args.languages:
-            langModules[language].outputForLanguage(specification, options)
-    else:
+    if args.test:
         import doctest
         doctest.testmod(verbose=args.verbose)
+    elif args.watch is not None:
+        watchInputs(args)
+    else:
+        specification, schema, options = loadAndValidateInputs(args)
+        outputForInputs(specification, options, args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic specification generator
+
+Makes up valid specifications of any size for testing and for
+benchmarking the code generators against large inputs. The number
+of packets, the fields per packet, the depth of substructure
+chains, the number of enumerations and the share of fields that
+are bitfields may all be set. The same settings and seed always
+give the same specification.
+
+Run it with:
+    python -m structspec.synthesize --packets 1000 --output big.json
+"""
+
+from collections import OrderedDict
+from argparse import ArgumentParser, Namespace
+from json import dump as dumpJson
+from random import Random
+from common import giveUp
+
+# The types synthesized fields are drawn from
+fieldTypes = ('uint8_t', 'int8_t', 'uint16_t', 'int16_t', 'uint32_t',
+              'int32_t', 'uint64_t', 'int64_t', 'float', 'double')
+
+# The types synthesized bitfields are drawn from
+bitFieldTypes = ('uint8_t', 'uint16_t', 'uint32_t')
+
+# How many options each synthesized enumeration has
+optionsPerEnum = 4
+
+
+def synthesizeEnumerations(enumCount):
+    """
+    Makes up the enumerations for a specification.
+
+    Args:
+        enumCount (int): How many enumerations to make.
+
+    Returns:
+        An ordered dictionary of enumeration definitions.
+
+    Examples:
+        >>> enums = synthesizeEnumerations(2)
+        >>> list(enums.keys())
+        ['Enum0', 'Enum1']
+        >>> list(enums['Enum1']['options'].keys())
+        ['ENUM1_OPTION0', 'ENUM1_OPTION1', 'ENUM1_OPTION2', 'ENUM1_OPTION3']
+    """
+    enums = OrderedDict()
+    for enumNum in range(enumCount):
+        options = OrderedDict()
+        for optionNum in range(optionsPerEnum):
+            optionName = 'ENUM{}_OPTION{}'.format(enumNum, optionNum)
+            if optionNum:
+                options[optionName] = {}
+            else:
+                options[optionName] = {'value': enumNum + 1}
+        enums['Enum{}'.format(enumNum)] = OrderedDict([
+            ('type', 'uint8_t'),
+            ('options', options)
+        ])
+    return enums
+
+
+def synthesizeField(random, enumCount, bitFieldDensity):
+    """
+    Makes up a single field definition.
+
+    Args:
+        random (Random):         The source of randomness.
+        enumCount (int):         How many enumerations there are.
+        bitFieldDensity (float): The chance of a bitfield.
+
+    Returns:
+        A dictionary defining the field.
+
+    Examples:
+        >>> field = synthesizeField(Random(1), 0, 1.0)
+        >>> field['type'] in bitFieldTypes, 1 <= field['size'] <= 7
+        (True, True)
+        >>> synthesizeField(Random(1), 0, 0.0)['type'] in fieldTypes
+        True
+    """
+    if random.random() < bitFieldDensity:
+        return {'type': random.choice(bitFieldTypes),
+                'size': random.randint(1, 7)}
+    choice = random.random()
+    if enumCount and choice < 0.1:
+        enumName = 'Enum{}'.format(random.randrange(enumCount))
+        return {'type': '#/enums/{}'.format(enumName),
+                'member': '#/enums/{}'.format(enumName)}
+    field = {'type': random.choice(fieldTypes)}
+    if choice < 0.2:
+        field['count'] = random.randint(2, 8)
+    elif choice < 0.25:
+        field = {'type': 'string', 'count': random.randint(2, 16)}
+    elif choice < 0.35 and not field['type'].startswith('u') and \
+            field['type'] not in ('float', 'double'):
+        field['min'] = -100
+        field['max'] = 100
+    elif choice < 0.4:
+        field['endianness'] = random.choice(('big', 'little'))
+    return field
+
+
+def synthesizeSpecification(packetCount=10, fieldCount=8, depth=2,
+                            enumCount=2, bitFieldDensity=0.25, seed=0):
+    """
+    Makes up a valid specification.
+
+    Packets are built in chains up to the given depth, each packet
+    in a chain holding the one before it as a substructure.
+
+    Args:
+        packetCount (int):       How many packets to make.
+        fieldCount (int):        How many fields each packet has,
+                                 not counting substructures.
+        depth (int):             The deepest substructure nesting.
+        enumCount (int):         How many enumerations to make.
+        bitFieldDensity (float): The share of fields that are
+                                 bitfields, from 0 to 1.
+        seed:                    Seed for the random choices.
+
+    Returns:
+        The specification object.
+
+    Examples:
+        >>> spec = synthesizeSpecification(packetCount=3, depth=1)
+        >>> list(spec['packets'].keys())
+        ['packet0', 'packet1', 'packet2']
+        >>> spec['packets']['packet1']['structure']['inner']
+        {'type': '#/packets/packet0'}
+        >>> 'inner' in spec['packets']['packet2']['structure']
+        False
+        >>> spec == synthesizeSpecification(packetCount=3, depth=1)
+        True
+    """
+    random = Random(seed)
+    specification = OrderedDict([
+        ('id', 'synthetic'),
+        ('title', 'Synthetic specification of {} packets'.format(
+            packetCount)),
+        ('endianness', 'big')
+    ])
+    if enumCount:
+        specification['enums'] = synthesizeEnumerations(enumCount)
+    packets = OrderedDict()
+    for packetNum in range(packetCount):
+        structure = OrderedDict()
+        if packetNum % (depth + 1):
+            structure['inner'] = {
+                'type': '#/packets/packet{}'.format(packetNum - 1)}
+        for fieldNum in range(fieldCount):
+            structure['field{}'.format(fieldNum)] = synthesizeField(
+                random, enumCount, bitFieldDensity)
+        packets['packet{}'.format(packetNum)] = OrderedDict([
+            ('endianness', random.choice(('big', 'little'))),
+            ('structure', structure)
+        ])
+    specification['packets'] = packets
+    return specification
+
+
+def parseArguments(args=None):
+    """
+    Parse command-line arguments
+
+    Examines the given command-line arguments and returns
+    an object containing the relevant arguments.
+
+    Args:
+        args (list): The command-line arguments to parse.
+
+    Returns:
+        A Namespace object with all the appropriately parsed
+        relevant arguments.
+
+    Examples:
+        >>> parseArguments(['--packets', '5']) == Namespace(
+        ...     bitFieldDensity=0.25, depth=2, enums=2, fields=8,
+        ...     output='synthetic.json', packets=5, seed=0)
+        True
+    """
+    assert args is None or isinstance(args, list)
+    parser = ArgumentParser(
+        description="Synthesize a valid packet structure specification " +
+        "of a given size."
+    )
+    parser.add_argument(
+        '--packets', '-p', type=int, default=10,
+        help='Number of packets; 10 by default.'
+    )
+    parser.add_argument(
+        '--fields', '-f', type=int, default=8,
+        help='Number of fields per packet; 8 by default.'
+    )
+    parser.add_argument(
+        '--depth', '-d', type=int, default=2,
+        help='Deepest substructure nesting; 2 by default.'
+    )
+    parser.add_argument(
+        '--enums', '-e', type=int, default=2,
+        help='Number of enumerations; 2 by default.'
+    )
+    parser.add_argument(
+        '--bitfield-density', '-b', type=float, default=0.25,
+        dest='bitFieldDensity',
+        help='Share of fields that are bitfields; 0.25 by default.'
+    )
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed for the random choices; 0 by default.'
+    )
+    parser.add_argument(
+        '--output', '-o', default='synthetic.json',
+        help='File to write the specification to; synthetic.json by ' +
+        'default.'
+    )
+    return parser.parse_args(args)
+
+
+def main():
+    """
+    The main routine when run from the command line.
+
+    Synthesizes a specification and writes it out as JSON.
+    """
+    args = parseArguments()
+    specification = synthesizeSpecification(
+        args.packets, args.fields, args.depth, args.enums,
+        args.bitFieldDensity, args.seed)
+    try:
+        with open(args.output, 'w') as outFile:
+            dumpJson(specification, outFile, indent=4)
+    except EnvironmentError as envErr:
+        giveUp("Output environment error", envErr)
+
+
+# Execute the following when run from the command line.
+if __name__ == "__main__":
+    main()
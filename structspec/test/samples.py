@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Sample specifications used by the structspec tests.
+"""
+
+from collections import OrderedDict
+
+telemetry = OrderedDict([
+    ('id', 'telemetry'),
+    ('title', 'Sample telemetry packets'),
+    ('endianness', 'big'),
+    ('enums', OrderedDict([
+        ('Kind', OrderedDict([
+            ('type', 'uint8_t'),
+            ('options', OrderedDict([
+                ('KIND_STATUS', {'value': 1}),
+                ('KIND_READING', {'value': 2}),
+                ('KIND_ALARM', {})
+            ]))
+        ])),
+        ('Limits', OrderedDict([
+            ('options', OrderedDict([
+                ('SAMPLE_COUNT', {'value': 4})
+            ]))
+        ]))
+    ])),
+    ('packets', OrderedDict([
+        ('header', OrderedDict([
+            ('structure', OrderedDict([
+                ('kind', {'type': '#/enums/Kind', 'member': '#/enums/Kind'}),
+                ('length', {'type': 'uint16_t', 'max': 1000})
+            ]))
+        ])),
+        ('reading', OrderedDict([
+            ('endianness', 'little'),
+            ('structure', OrderedDict([
+                ('head', {'type': '#/packets/header'}),
+                ('timestamp', {'type': 'uint32_t', 'min': 5}),
+                ('channel', {'type': 'uint8_t', 'size': 3}),
+                ('flags', {'type': 'uint8_t', 'size': 5}),
+                ('samples', {'type': 'int16_t',
+                             'count': '#/enums/Limits/options/SAMPLE_COUNT/value'}),
+                ('reserved', {'type': 'padding', 'count': 2}),
+                ('name', {'type': 'string', 'count': 6}),
+                ('sequence', {'type': 'uint16_t', 'endianness': 'big'}),
+                ('offset', {'type': 'int24_t', 'endianness': 'big'}),
+                ('gain', {'type': 'float'}),
+                ('total', {'type': 'int64_t'})
+            ]))
+        ])),
+        ('point', OrderedDict([
+            ('endianness', 'little'),
+            ('structure', OrderedDict([
+                ('timestamp', {'type': 'uint32_t'}),
+                ('values', {'type': 'int16_t', 'count': 3,
+                            'min': -10, 'max': 10}),
+                ('status', {'type': 'uint16_t', 'member': [0, 1, 65535]})
+            ]))
+        ]))
+    ]))
+])
+
+reading = {
+    'head': {'kind': 2, 'length': 300},
+    'timestamp': 1234567,
+    'channel': 5,
+    'flags': 17,
+    'samples': [1, -2, 300, -400],
+    'name': 'probe1',
+    'sequence': 513,
+    'offset': -70000,
+    'gain': 1.5,
+    'total': -(2 ** 40)
+}
+
+points = [
+    {'timestamp': 100, 'values': [1, 2, 3], 'status': 0},
+    {'timestamp': 200, 'values': [-3, 4, 5], 'status': 1},
+    {'timestamp': 300, 'values': [5, -6, 7], 'status': 65535}
+]
+
+logbook = OrderedDict([
+    ('id', 'logbook'),
+    ('title', 'Sample packets with variable counts'),
+    ('endianness', 'little'),
+    ('packets', OrderedDict([
+        ('entry', OrderedDict([
+            ('structure', OrderedDict([
+                ('level', {'type': 'uint8_t', 'max': 7}),
+                ('length', {'type': 'uint8_t'}),
+                ('text', {'type': 'string', 'count': 'length'}),
+                ('count', {'type': 'uint16_t', 'endianness': 'big'}),
+                ('values', {'type': 'int32_t', 'count': 'count'}),
+                ('crc', {'type': 'uint16_t'})
+            ]))
+        ])),
+        ('batch', OrderedDict([
+            ('structure', OrderedDict([
+                ('sequence', {'type': 'uint32_t'}),
+                ('first', {'type': '#/packets/entry'}),
+                ('second', {'type': '#/packets/entry'})
+            ]))
+        ]))
+    ]))
+])
+
+entries = [
+    {'level': 3, 'length': 5, 'text': 'hello', 'count': 2,
+     'values': [-1, 70000], 'crc': 4660},
+    {'level': 7, 'length': 0, 'text': '', 'count': 0, 'values': [],
+     'crc': 0}
+]
+
+audio = OrderedDict([
+    ('id', 'audio'),
+    ('title', 'Sample packets of 24-bit samples'),
+    ('endianness', 'little'),
+    ('packets', OrderedDict([
+        ('frame', OrderedDict([
+            ('structure', OrderedDict([
+                ('gain', {'type': 'uint24_t', 'endianness': 'big'}),
+                ('channels', {'type': 'int24_t', 'count': 4}),
+                ('length', {'type': 'uint8_t'}),
+                ('samples', {'type': 'int24_t', 'count': 'length',
+                             'endianness': 'big'})
+            ]))
+        ]))
+    ]))
+])
+
+frame = {
+    'gain': 0xabcdef,
+    'channels': [-2 ** 23, 2 ** 23 - 1, -1, 0],
+    'length': 3,
+    'samples': [1, -2, 65536]
+}
@@ -10,7 +10,41 @@ import unittest
 from doctest import DocTestSuite
 from os.path import join
 from importlib import import_module
+from imp import new_module
+from os import chdir, close, getcwd, getpid, pipe, read, remove
+from shutil import rmtree
+from subprocess import check_call, check_output
+from struct import error as StructError
+from socket import socketpair
+from sys import executable, modules, path as sysPath
+from tempfile import mkdtemp
+from binascii import hexlify
+from bz2 import BZ2File
+from gzip import GzipFile
+from threading import active_count
+from multiprocessing import Pool, Process
+try:
+    from queue import Empty, Full
+except ImportError:
+    from Queue import Empty, Full
+try:
+    from lzma import LZMAFile
+except ImportError:
+    LZMAFile = None
+from collections import OrderedDict
+from copy import deepcopy
+from ctypes import sizeof
+from distutils.spawn import find_executable
+from io import BytesIO
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
 from zope.interface.verify import verifyObject
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 if __name__ == '__main__':
     from sys import path
@@ -19,19 +53,41 @@ if __name__ == '__main__':
     path.append('.')
     chdir(normpath(join(getcwd(), dirname(__file__), '..', '..')))
 import structspec
+import structspec.analyze
+import structspec.bench
+import structspec.capture
 import structspec.common
+import structspec.container
 import structspec.interfaces
 import structspec.languages
 import structspec.languages.c
+import structspec.languages.cpython
+import structspec.languages.pyctypes
 import structspec.languages.python
+import structspec.ring
+import structspec.runtime
+import structspec.synthesize
+import structspec.writer
+import structspec.watch
+from structspec.test import samples
 
 
 def load_tests(loader, tests, ignore):
     tests.addTests(DocTestSuite(structspec))
+    tests.addTests(DocTestSuite(structspec.analyze))
+    tests.addTests(DocTestSuite(structspec.bench))
+    tests.addTests(DocTestSuite(structspec.capture))
     tests.addTests(DocTestSuite(structspec.common))
+    tests.addTests(DocTestSuite(structspec.container))
     tests.addTests(DocTestSuite(structspec.languages))
     tests.addTests(DocTestSuite(structspec.languages.c))
+    tests.addTests(DocTestSuite(structspec.languages.cpython))
+    tests.addTests(DocTestSuite(structspec.languages.pyctypes))
     tests.addTests(DocTestSuite(structspec.languages.python))
+    tests.addTests(DocTestSuite(structspec.ring))
+    tests.addTests(DocTestSuite(structspec.watch))
+    tests.addTests(DocTestSuite(structspec.writer))
+    tests.addTests(DocTestSuite(structspec.synthesize))
     return tests
 
 
@@ -54,10 +110,1727 @@ class TestStructSpec(unittest.TestCase):
         Test that the language modules all satisfy the proper interface.
         """
         for langModule in (structspec.languages.c,
+                           structspec.languages.cpython,
+                           structspec.languages.pyctypes,
                            structspec.languages.python):
             verifyObject(structspec.interfaces.ILanguage, langModule)
 
 
+def loadPythonCodec(specification, **extraOptions):
+    """
+    Generates the Python handlers for a specification as a module.
+
+    The runtime parts are included unless runtime=False is given.
+    """
+    pyFile = StringIO()
+    options = {'pyFilename': '{}.py'.format(specification['id']),
+               'runtime': True, 'verbose': False}
+    options.update(extraOptions)
+    structspec.languages.python.outputPython(specification, options, pyFile)
+    module = new_module(specification['id'])
+    exec(pyFile.getvalue(), module.__dict__)
+    return module
+
+
+def writeCCodec(specification, directory):
+    """
+    Generates the C handlers for a specification into a directory.
+    """
+    options = {'hFilename': '{}.h'.format(specification['id']),
+               'cFilename': '{}.c'.format(specification['id']),
+               'verbose': False}
+    with open(join(directory, options['hFilename']), 'w') as hFile, \
+            open(join(directory, options['cFilename']), 'w') as cFile:
+        structspec.languages.c.outputC(specification, options, hFile, cFile)
+    return options
+
+
+class TestEnumerations(unittest.TestCase):
+    """
+    Check the generated enumeration classes.
+    """
+
+    def test_lookups(self):
+        """
+        Test that enumeration values and names map to shared members.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        self.assertIs(codec.Kind(3), codec.Kind.KIND_ALARM)
+        self.assertEqual(codec.Kind.KIND_ALARM, codec.KIND_ALARM)
+        self.assertEqual(codec.Kind(2).name, 'KIND_READING')
+        self.assertEqual(codec.Kind.names[1], 'KIND_STATUS')
+        self.assertEqual(codec.Kind.values['KIND_ALARM'], 3)
+        self.assertEqual(repr(codec.Kind(1)), 'Kind.KIND_STATUS')
+        self.assertRaises(ValueError, codec.Kind, 9)
+
+    def test_decode(self):
+        """
+        Test that unpackers can return enumeration members.
+        """
+        codec = loadPythonCodec(samples.telemetry, decodeEnums=True)
+        rawData = codec.pack_reading(samples.reading)
+        reading = codec.unpack_reading(rawData)
+        self.assertIs(reading['head']['kind'], codec.Kind.KIND_READING)
+        self.assertEqual(reading, samples.reading)
+        self.assertEqual(codec.pack_reading(reading), rawData)
+        self.assertEqual(codec.unpack_header('\x09\x00\x01')['kind'], 9)
+
+
+class TestInstrumentation(unittest.TestCase):
+    """
+    Check the optional instrumentation counters.
+    """
+
+    def test_counters(self):
+        """
+        Test that instrumented handlers count calls, bytes and errors.
+        """
+        self.assertFalse(hasattr(loadPythonCodec(samples.telemetry),
+                                 'snapshot_counters'))
+        codec = loadPythonCodec(samples.telemetry, instrument=True)
+        rawData = codec.pack_reading(samples.reading)
+        for attempt in range(3):
+            self.assertEqual(codec.unpack_reading(rawData), samples.reading)
+        self.assertRaises(StructError, codec.unpack_point, '')
+        snapshot = codec.snapshot_counters()
+        self.assertEqual(snapshot['reading']['pack']['calls'], 1)
+        self.assertEqual(snapshot['reading']['pack']['bytes'], len(rawData))
+        self.assertEqual(snapshot['reading']['unpack']['calls'], 3)
+        self.assertEqual(snapshot['reading']['unpack']['bytes'],
+                         3 * len(rawData))
+        self.assertTrue(snapshot['reading']['unpack']['nanoseconds'] > 0)
+        self.assertEqual(snapshot['header']['unpack']['calls'], 3)
+        self.assertEqual(snapshot['point']['unpack'],
+                         {'calls': 0, 'bytes': 0, 'nanoseconds': 0,
+                          'errors': 1})
+        codec.reset_counters()
+        self.assertEqual(codec.snapshot_counters()['reading']['unpack']
+                         ['calls'], 0)
+
+
+class TestValidation(unittest.TestCase):
+    """
+    Check the generated validators against sample constraints.
+    """
+
+    def setUp(self):
+        self.codec = loadPythonCodec(samples.telemetry)
+
+    def test_validate(self):
+        """
+        Test that validation passes good packets and names bad values.
+        """
+        codec = self.codec
+        rawData = codec.pack_reading(samples.reading)
+        self.assertEqual(codec.validate_reading(rawData), samples.reading)
+        badReading = dict(samples.reading, timestamp=1,
+                          head={'kind': 7, 'length': 300})
+        self.assertEqual(codec.check_reading(badReading),
+                         ['head.kind', 'timestamp'])
+        self.assertRaises(ValueError, codec.validate_reading,
+                          codec.pack_reading(badReading))
+        for point in samples.points:
+            self.assertEqual(codec.check_point(point), [])
+        self.assertEqual(codec.check_point(dict(samples.points[0],
+                                                values=[1, 11, 3],
+                                                status=2)),
+                         ['values', 'status'])
+
+    def test_bitfield_widths(self):
+        """
+        Test that bitfield values too wide for them are refused.
+        """
+        codec = self.codec
+        badReading = dict(samples.reading, channel=9)
+        self.assertEqual(codec.check_reading(badReading), ['channel'])
+        self.assertEqual(codec.check_reading(dict(samples.reading,
+                                                  flags=-1)), ['flags'])
+        self.assertRaises(StructError, codec.pack_reading, badReading)
+        self.assertRaises(StructError, codec.pack_reading_into, badReading,
+                          bytearray(codec.get_reading_len()))
+        self.assertRaises(StructError, codec.pack_many_reading,
+                          [samples.reading, badReading])
+
+    @unittest.skipUnless(numpy, 'NumPy not available.')
+    def test_validate_batch(self):
+        """
+        Test that batch validation finds the rows with bad values.
+        """
+        codec = self.codec
+        columns = {
+            'head.kind': numpy.array([2, 7, 1, 3]),
+            'head.length': numpy.array([1, 2, 2000, 3]),
+            'timestamp': numpy.array([9, 9, 9, 4])
+        }
+        self.assertEqual(list(codec.validate_reading_batch(columns)),
+                         [1, 2, 3])
+        points = numpy.array(
+            [(point['timestamp'], point['values'], point['status'])
+             for point in samples.points] + [(1, (0, 20, 0), 0),
+                                             (1, (0, 0, 0), 5)],
+            dtype=[('timestamp', '<u4'), ('values', '<i2', (3,)),
+                   ('status', '<u2')])
+        self.assertEqual(list(codec.validate_point_batch(points)), [3, 4])
+
+
+@unittest.skipUnless(find_executable('cc'), 'No C compiler available.')
+class TestCCodec(unittest.TestCase):
+    """
+    Check generated C handlers against the generated Python ones.
+    """
+    roundTripSource = r"""
+#include <stdio.h>
+#include <stdlib.h>
+#include "telemetry.h"
+
+int main(int argc, char **argv)
+{
+  uint8_t buffer[READING_LEN];
+  reading packet;
+  size_t i;
+  for (i = 0; i < READING_LEN; i++)
+    sscanf(argv[1] + 2 * i, "%2hhx", &buffer[i]);
+  if (unpack_reading(buffer, READING_LEN - 1, &packet) != -1)
+    return 1;
+  if (unpack_reading(buffer, READING_LEN, &packet) != READING_LEN)
+    return 2;
+  printf("%u %d %u ", (unsigned)packet.timestamp, (int)packet.samples[3],
+         (unsigned)packet.flags);
+  for (i = 0; i < READING_LEN; i++)
+    buffer[i] = 0xff;
+  if (pack_reading(&packet, buffer, READING_LEN) != READING_LEN)
+    return 3;
+  for (i = 0; i < READING_LEN; i++)
+    printf("%02x", buffer[i]);
+  return 0;
+}
+"""
+    arraySource = r"""
+#include <stdio.h>
+#include "telemetry.h"
+
+int main(int argc, char **argv)
+{
+  uint8_t buffer[3 * READING_LEN];
+  reading readings[3];
+  point points[3];
+  size_t i;
+  for (i = 0; i < 3 * READING_LEN; i++)
+    sscanf(argv[1] + 2 * i, "%2hhx", &buffer[i]);
+  if (unpack_reading_array(buffer, 3, readings) != 3 * READING_LEN)
+    return 1;
+  for (i = 0; i < 3 * POINT_LEN; i++)
+    sscanf(argv[2] + 2 * i, "%2hhx", &buffer[i]);
+  if (unpack_point_array(buffer, 3, points) != 3 * POINT_LEN)
+    return 2;
+  for (i = 0; i < 3; i++)
+    printf("%u %d %u %d %u ", (unsigned)readings[i].timestamp,
+           (int)readings[i].samples[i], (unsigned)points[i].timestamp,
+           (int)points[i].values[1], (unsigned)points[i].status);
+  return 0;
+}
+"""
+    offsetsSource = r"""
+#include <stdio.h>
+#include "telemetry.h"
+
+int main(void)
+{
+  printf("%d %d %d %d %d", READING_OFFSET_HEAD_LENGTH, READING_OFFSET_FLAGS,
+         READING_BIT_OFFSET_FLAGS, READING_OFFSET_TOTAL, POINT_OFFSET_STATUS);
+  return 0;
+}
+"""
+
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_round_trip(self):
+        """
+        Test that C unpacks then packs what Python packed unchanged.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        rawData = codec.pack_reading(samples.reading)
+        self.assertEqual(len(rawData), codec.get_reading_len())
+        self.assertEqual(codec.unpack_reading(rawData), samples.reading)
+        writeCCodec(samples.telemetry, self.directory)
+        with open(join(self.directory, 'main.c'), 'w') as mainFile:
+            mainFile.write(self.roundTripSource)
+        program = join(self.directory, 'roundtrip')
+        check_call(['cc', '-std=c99', '-Wall', '-Werror', '-o', program,
+                    join(self.directory, 'main.c'),
+                    join(self.directory, 'telemetry.c')])
+        output = check_output([program, hexlify(rawData)]).split()
+        self.assertEqual(output[:3], ['1234567', '-400', '17'])
+        self.assertEqual(output[3], hexlify(rawData))
+
+    def test_array(self):
+        """
+        Test that C unpacks runs of packets as Python packed them.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        readings = [dict(samples.reading, timestamp=timestamp)
+                    for timestamp in (1, 2, 3)]
+        readingData = ''.join([codec.pack_reading(reading)
+                               for reading in readings])
+        pointData = ''.join([codec.pack_point(point)
+                             for point in samples.points])
+        writeCCodec(samples.telemetry, self.directory)
+        with open(join(self.directory, 'main.c'), 'w') as mainFile:
+            mainFile.write(self.arraySource)
+        program = join(self.directory, 'array')
+        check_call(['cc', '-std=c99', '-O2', '-Wall', '-Werror', '-o',
+                    program, join(self.directory, 'main.c'),
+                    join(self.directory, 'telemetry.c')])
+        output = check_output([program, hexlify(readingData),
+                               hexlify(pointData)]).split()
+        expected = []
+        for recordNum, point in enumerate(samples.points):
+            expected.extend([
+                str(readings[recordNum]['timestamp']),
+                str(readings[recordNum]['samples'][recordNum]),
+                str(point['timestamp']), str(point['values'][1]),
+                str(point['status'])])
+        self.assertEqual(output, expected)
+
+    def test_offsets(self):
+        """
+        Test that C offset constants agree with the Python ones.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        writeCCodec(samples.telemetry, self.directory)
+        with open(join(self.directory, 'main.c'), 'w') as mainFile:
+            mainFile.write(self.offsetsSource)
+        program = join(self.directory, 'offsets')
+        check_call(['cc', '-std=c99', '-Wall', '-Werror', '-o', program,
+                    join(self.directory, 'main.c'),
+                    join(self.directory, 'telemetry.c')])
+        self.assertEqual(check_output([program]).split(), [str(offset) for
+                         offset in (codec.READING_OFFSETS['head.length'],) +
+                         codec.READING_OFFSETS['flags'] +
+                         (codec.READING_OFFSETS['total'],
+                          codec.POINT_OFFSETS['status'])])
+
+    def test_benchmark(self):
+        """
+        Test that the generated C micro-benchmark builds and runs.
+        """
+        options = writeCCodec(samples.telemetry, self.directory)
+        options['benchFilename'] = 'telemetry_bench.c'
+        with open(join(self.directory, 'telemetry_bench.c'), 'w') as \
+                benchFile:
+            structspec.languages.c.outputCBenchmark(samples.telemetry,
+                                                    options, benchFile)
+        program = join(self.directory, 'bench')
+        check_call(['cc', '-std=c99', '-O2', '-Wall', '-Werror', '-o',
+                    program, join(self.directory, 'telemetry_bench.c'),
+                    join(self.directory, 'telemetry.c')])
+        output = check_output([program]).splitlines()
+        self.assertEqual([line.split()[0] for line in output],
+                         ['packet', 'header', 'reading', 'point'])
+
+
+@unittest.skipUnless(find_executable('cc'), 'No C compiler available.')
+class TestCPythonExtension(unittest.TestCase):
+    """
+    Check the generated extension against the generated Python module.
+    """
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.workingDirectory = getcwd()
+
+    def tearDown(self):
+        chdir(self.workingDirectory)
+        rmtree(self.directory)
+
+    def test_extension(self):
+        """
+        Test that the extension packs and unpacks as Python does.
+        """
+        chdir(self.directory)
+        options = {'specificationName': 'telemetry.json', 'verbose': False}
+        structspec.languages.python.outputForLanguage(samples.telemetry,
+                                                      options)
+        structspec.languages.cpython.outputForLanguage(samples.telemetry,
+                                                       options)
+        check_call([executable, 'setup_telemetry.py', '-q', 'build_ext',
+                    '--inplace'])
+        sysPath.insert(0, self.directory)
+        try:
+            pure = import_module('telemetry')
+            accelerated = import_module('telemetry_accel')
+            extension = import_module('_telemetry')
+        finally:
+            sysPath.remove(self.directory)
+        self.assertTrue(accelerated.accelerated)
+        self.assertIs(accelerated.unpack_reading, extension.unpack_reading)
+        self.assertIs(accelerated.get_reading_len, pure.get_reading_len)
+        for packetName, packet in (('reading', samples.reading),
+                                   ('point', samples.points[2])):
+            pack = getattr(extension, 'pack_' + packetName)
+            unpack = getattr(extension, 'unpack_' + packetName)
+            rawData = getattr(pure, 'pack_' + packetName)(packet)
+            self.assertEqual(pack(packet), rawData)
+            self.assertEqual(unpack(rawData),
+                             getattr(pure, 'unpack_' + packetName)(rawData))
+        self.assertRaises(StructError, extension.unpack_reading, rawData)
+        self.assertRaises(KeyError, extension.pack_point, {})
+        self.assertRaises(StructError, extension.pack_point,
+                          dict(samples.points[0], status=65536))
+        # Both refuse values too wide for their bitfields
+        for channel in (8, -1):
+            badReading = dict(samples.reading, channel=channel)
+            self.assertRaises(StructError, pure.pack_reading, badReading)
+            self.assertRaises(StructError, extension.pack_reading,
+                              badReading)
+        rawData = pure.pack_reading(dict(samples.reading, channel=7))
+        self.assertEqual(extension.unpack_reading(rawData)['channel'], 7)
+
+    def test_variable_packets(self):
+        """
+        Test that packets of variable size are left to pure Python.
+        """
+        chdir(self.directory)
+        specification = deepcopy(samples.telemetry)
+        specification['id'] = 'mixed'
+        specification['packets']['entry'] = samples.logbook['packets'][
+            'entry']
+        options = {'specificationName': 'mixed.json', 'verbose': False}
+        for langModule in (structspec.languages.python,
+                           structspec.languages.cpython,
+                           structspec.languages.c):
+            langModule.outputForLanguage(specification, options)
+        self.assertFalse(options.get('codecOnly', False))
+        # The C output is whole; only the extension's copy leaves out entry
+        with open('mixed.h') as hFile:
+            self.assertTrue('} entry;' in hFile.read())
+        with open('_mixed_codec.h') as hFile:
+            self.assertFalse('} entry;' in hFile.read())
+        check_call([executable, 'setup_mixed.py', '-q', 'build_ext',
+                    '--inplace'])
+        sysPath.insert(0, self.directory)
+        try:
+            pure = import_module('mixed')
+            accelerated = import_module('mixed_accel')
+            extension = import_module('_mixed')
+        finally:
+            sysPath.remove(self.directory)
+        self.assertTrue(accelerated.accelerated)
+        self.assertIs(accelerated.unpack_reading, extension.unpack_reading)
+        self.assertFalse(hasattr(extension, 'unpack_entry'))
+        self.assertIs(accelerated.unpack_entry, pure.unpack_entry)
+        rawData = pure.pack_entry(samples.entries[0])
+        self.assertEqual(accelerated.unpack_entry(rawData),
+                         samples.entries[0])
+
+
+class TestCtypesStructures(unittest.TestCase):
+    """
+    Check the generated ctypes structures against the Python handlers.
+    """
+
+    def loadStructures(self, specification):
+        pyFile = StringIO()
+        structspec.languages.pyctypes.outputCtypes(specification, {}, pyFile)
+        module = new_module(specification['id'] + '_ctypes')
+        exec(pyFile.getvalue(), module.__dict__)
+        return module
+
+    def test_overlay(self):
+        """
+        Test that structures overlaid on packed data see the packed values.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        structures = self.loadStructures(samples.telemetry)
+        self.assertEqual(sizeof(structures.reading), codec.get_reading_len())
+        rawData = bytearray(codec.pack_reading(samples.reading))
+        reading = structures.reading.from_buffer(rawData)
+        for fieldName in ('timestamp', 'channel', 'flags', 'name',
+                          'sequence', 'gain', 'total'):
+            self.assertEqual(getattr(reading, fieldName),
+                             samples.reading[fieldName])
+        self.assertEqual(list(reading.samples), samples.reading['samples'])
+        self.assertEqual(reading.head.length,
+                         samples.reading['head']['length'])
+        reading.channel = 6
+        reading.head.kind = 1
+        self.assertEqual(codec.unpack_reading(str(rawData)),
+                         dict(samples.reading, channel=6,
+                              head=dict(samples.reading['head'], kind=1)))
+        for point in samples.points:
+            overlay = structures.point.from_buffer_copy(
+                codec.pack_point(point))
+            self.assertEqual(overlay.status, point['status'])
+            self.assertEqual(list(overlay.values), point['values'])
+
+    def test_big_endian_bitfields(self):
+        """
+        Test that big endian bitfields sit where the Python handlers put them.
+        """
+        specification = deepcopy(samples.telemetry)
+        specification['packets']['reading']['endianness'] = 'big'
+        codec = loadPythonCodec(specification)
+        structures = self.loadStructures(specification)
+        reading = structures.reading.from_buffer_copy(
+            codec.pack_reading(samples.reading))
+        self.assertEqual((reading.channel, reading.flags, reading.timestamp),
+                         (samples.reading['channel'],
+                          samples.reading['flags'],
+                          samples.reading['timestamp']))
+
+    def test_mixed_endianness(self):
+        """
+        Test that items of either byte order in packets of either read right.
+        """
+        for packetEndianness, itemEndianness in (('big', 'little'),
+                                                 ('little', 'big')):
+            specification = OrderedDict([
+                ('id', 'mixed'),
+                ('title', 'Packets mixing byte orders'),
+                ('endianness', packetEndianness),
+                ('packets', OrderedDict([
+                    ('mixed', OrderedDict([
+                        ('structure', OrderedDict([
+                            ('a', {'type': 'uint8_t', 'size': 3,
+                                   'endianness': itemEndianness}),
+                            ('b', {'type': 'uint8_t', 'size': 10,
+                                   'endianness': itemEndianness}),
+                            ('c', {'type': 'int16_t', 'count': 3,
+                                   'endianness': itemEndianness}),
+                            ('d', {'type': 'float',
+                                   'endianness': itemEndianness}),
+                            ('e', {'type': 'uint32_t'}),
+                            ('f', {'type': 'int24_t'}),
+                            ('g', {'type': 'uint24_t', 'count': 2,
+                                   'endianness': itemEndianness}),
+                            ('h', {'type': 'int16_t'})
+                        ]))
+                    ]))
+                ]))
+            ])
+            packet = {'a': 5, 'b': 1000, 'c': [1, -300, 32000], 'd': 2.5,
+                      'e': 0x12345678, 'f': -70000, 'g': [0xabcdef, 1],
+                      'h': -2}
+            codec = loadPythonCodec(specification)
+            structures = self.loadStructures(specification)
+            self.assertEqual(sizeof(structures.mixed), codec.get_mixed_len())
+            rawData = bytearray(codec.pack_mixed(packet))
+            overlay = structures.mixed.from_buffer(rawData)
+            unpacked = codec.unpack_mixed(str(rawData))
+            for fieldName, value in unpacked.items():
+                if isinstance(value, list):
+                    self.assertEqual(list(getattr(overlay, fieldName)), value)
+                else:
+                    self.assertEqual(getattr(overlay, fieldName), value)
+            overlay.b = 7
+            overlay.c[1] = 9
+            overlay.f = 8388607
+            overlay.g = [2, 3]
+            self.assertEqual(codec.unpack_mixed(str(rawData)),
+                             dict(packet, b=7, c=[1, 9, 32000], f=8388607,
+                                  g=[2, 3]))
+            self.assertRaises(ValueError, setattr, overlay, 'f', 1 << 23)
+
+
+class TestBenchmarks(unittest.TestCase):
+    """
+    Check the benchmark harness.
+    """
+
+    def test_round_trips(self):
+        """
+        Test that every benchmark packet survives a round trip.
+        """
+        for specification in structspec.bench.specifications.values():
+            codec = structspec.bench.loadCodec(specification)
+            for packetName in specification['packets']:
+                record = structspec.bench.sampleRecord(packetName,
+                                                       specification)
+                rawData = getattr(codec, 'pack_' + packetName)(record)
+                self.assertEqual(
+                    len(rawData),
+                    getattr(codec, 'get_{}_len'.format(packetName))())
+                self.assertEqual(
+                    getattr(codec, 'unpack_' + packetName)(rawData), record)
+
+    def test_results(self):
+        """
+        Test that each operation is measured.
+        """
+        results = structspec.bench.runBenchmarks(['bitfields'], 10, 1)
+        self.assertEqual(list(results.keys()),
+                         ['bitfields.status.pack', 'bitfields.status.unpack',
+                          'bitfields.status.len'])
+        for result in results.values():
+            self.assertTrue(result['opsPerSecond'] > 0)
+            self.assertTrue(result['mbPerSecond'] > 0)
+
+    def test_writers(self):
+        """
+        Test that each way of writing packets is measured.
+        """
+        results = structspec.bench.runWriterBenchmarks(100, 1)
+        self.assertEqual(list(results.keys()),
+                         ['unbuffered', 'buffered', 'writer', 'writerMany'])
+        self.assertEqual(results['unbuffered']['writes'], 100)
+        self.assertEqual(results['writer']['writes'], 1)
+        for result in results.values():
+            self.assertTrue(result['packetsPerSecond'] > 0)
+
+
+class TestSynthesis(unittest.TestCase):
+    """
+    Check synthesized specifications and the scaling benchmark.
+    """
+
+    def test_round_trips(self):
+        """
+        Test that synthesized packets survive a round trip.
+        """
+        specification = structspec.synthesize.synthesizeSpecification(
+            packetCount=12, fieldCount=10, depth=3, enumCount=3,
+            bitFieldDensity=0.4, seed=7)
+        codec = structspec.bench.loadCodec(specification)
+        for packetName in specification['packets']:
+            record = structspec.bench.sampleRecord(packetName, specification)
+            rawData = getattr(codec, 'pack_' + packetName)(record)
+            self.assertEqual(getattr(codec, 'unpack_' + packetName)(rawData),
+                             record)
+            self.assertEqual(getattr(codec, 'check_' + packetName)(record),
+                             [])
+
+    def test_scaling(self):
+        """
+        Test that the scaling benchmark times each stage at each size.
+        """
+        results = structspec.bench.runScalingBenchmarks([2, 4],
+                                                        ['Python', 'C'])
+        self.assertEqual(list(results.keys()), ['load', 'Python', 'C'])
+        for result in results.values():
+            self.assertEqual(len(result['seconds']), 2)
+
+
+class TestVariableCounts(unittest.TestCase):
+    """
+    Check items whose count is held by another item.
+    """
+
+    def test_round_trips(self):
+        """
+        Test that packets of varying size survive a round trip.
+        """
+        codec = loadPythonCodec(samples.logbook)
+        for entry in samples.entries:
+            rawData = codec.pack_entry(entry)
+            self.assertEqual(len(rawData), codec.get_entry_len(entry))
+            self.assertEqual(codec.unpack_entry(rawData), entry)
+        self.assertEqual(codec.get_entry_len(), 6)
+        batch = {'sequence': 9, 'first': samples.entries[0],
+                 'second': samples.entries[1]}
+        rawData = codec.pack_batch(batch)
+        self.assertEqual(len(rawData), codec.get_batch_len(batch))
+        self.assertEqual(codec.validate_batch(rawData), batch)
+        self.assertEqual(hexlify(rawData[:16]),
+                         b'09000000030568656c6c6f0002ffffff')
+
+    def test_mismatched_count(self):
+        """
+        Test that a count disagreeing with its values is refused.
+        """
+        codec = loadPythonCodec(samples.logbook)
+        self.assertRaises(StructError, codec.pack_entry,
+                          dict(samples.entries[0], count=3))
+
+    def test_bounded_cache(self):
+        """
+        Test that only so many compiled formats are kept.
+        """
+        codec = loadPythonCodec(samples.logbook)
+        for count in range(codec._structCacheSize * 2):
+            entry = dict(samples.entries[1], count=count,
+                         values=list(range(count)))
+            self.assertEqual(codec.unpack_entry(codec.pack_entry(entry)),
+                             entry)
+        if codec.lru_cache is None:
+            self.assertEqual(len(codec._structCache),
+                             codec._structCacheSize)
+        else:
+            self.assertEqual(codec._getStruct.cache_info().currsize,
+                             codec._structCacheSize)
+
+
+class TestInt24(unittest.TestCase):
+    """
+    Check the conversion of 24-bit integers.
+    """
+
+    def test_round_trips(self):
+        """
+        Test that 24-bit values convert alike with and without NumPy.
+        """
+        codec = loadPythonCodec(samples.audio)
+        rawData = codec.pack_frame(samples.frame)
+        self.assertEqual(hexlify(rawData),
+                         b'abcdef000080ffff7fffffff00000003'
+                         b'000001fffffe010000')
+        self.assertEqual(codec.unpack_frame(rawData), samples.frame)
+        codec.numpy = None
+        self.assertEqual(codec.pack_frame(samples.frame), rawData)
+        self.assertEqual(codec.unpack_frame(rawData), samples.frame)
+
+    def test_out_of_range(self):
+        """
+        Test that values beyond 24 bits are refused.
+        """
+        codec = loadPythonCodec(samples.audio)
+        for badFrame in (dict(samples.frame, gain=2 ** 24),
+                         dict(samples.frame, channels=[2 ** 23, 0, 0, 0]),
+                         dict(samples.frame, samples=[0])):
+            self.assertRaises((StructError, OverflowError, ValueError),
+                              codec.pack_frame, badFrame)
+
+
+class TestColumns(unittest.TestCase):
+    """
+    Check columnar packing and unpacking.
+    """
+
+    def setUp(self):
+        self.codec = loadPythonCodec(samples.telemetry)
+        self.readings = [dict(samples.reading, timestamp=timestamp,
+                              channel=timestamp % 8,
+                              samples=[timestamp, -timestamp, 0, 7])
+                         for timestamp in range(5, 10)]
+        self.rawData = b''.join([self.codec.pack_reading(reading)
+                                 for reading in self.readings])
+
+    def checkColumns(self, columns):
+        """
+        Check columns unpacked from the sample readings.
+        """
+        self.assertEqual(list(columns.keys()), [
+            'head.kind', 'head.length', 'timestamp', 'channel', 'flags',
+            'samples', 'name', 'sequence', 'offset', 'gain', 'total'])
+        self.assertEqual(list(columns['timestamp']), [5, 6, 7, 8, 9])
+        self.assertEqual(list(columns['channel']), [5, 6, 7, 0, 1])
+        self.assertEqual(list(columns['head.length']), [300] * 5)
+        self.assertEqual(list(columns['offset']), [-70000] * 5)
+        self.assertEqual(list(columns['name']), [b'probe1'] * 5)
+        self.assertEqual(self.codec.pack_columns_reading(columns),
+                         self.rawData)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not available')
+    def test_numpy_columns(self):
+        """
+        Test that NumPy columns are native, shaped and round trip.
+        """
+        columns = self.codec.unpack_columns_reading(self.rawData)
+        self.checkColumns(columns)
+        self.assertEqual(columns['samples'].shape, (5, 4))
+        self.assertEqual(list(columns['samples'][:, 1]), [-5, -6, -7, -8, -9])
+        self.assertTrue(columns['head.length'].dtype.isnative)
+        self.assertEqual(
+            len(self.codec.unpack_columns_reading(self.rawData, 2)['flags']),
+            2)
+        self.assertRaises(ValueError, self.codec.unpack_columns_reading,
+                          self.rawData[:-1], 5)
+
+    def test_array_columns(self):
+        """
+        Test that array module columns round trip without NumPy.
+        """
+        self.codec.numpy = None
+        columns = self.codec.unpack_columns_reading(bytearray(self.rawData))
+        self.checkColumns(columns)
+        self.assertEqual(columns['samples'][4:8].tolist(), [6, -6, 0, 7])
+
+    def test_unsupported(self):
+        """
+        Test that packets varying in size get no columnar functions.
+        """
+        codec = loadPythonCodec(samples.logbook)
+        self.assertFalse(hasattr(codec, 'unpack_columns_entry'))
+
+
+class TestCapture(unittest.TestCase):
+    """
+    Check the synthetic capture file generator.
+    """
+
+    def test_valid_packets(self):
+        """
+        Test that a capture holds only valid packets.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        for packetName in ('header', 'point'):
+            outFile = BytesIO()
+            packetCount, byteCount = structspec.capture.writeCapture(
+                samples.telemetry, [packetName], 4000, outFile, seed=3,
+                chunkSize=1000)
+            rawData = outFile.getvalue()
+            packetLen = getattr(codec, 'get_{}_len'.format(packetName))()
+            self.assertEqual(len(rawData), byteCount)
+            self.assertEqual(byteCount, packetCount * packetLen)
+            self.assertTrue(byteCount >= 4000)
+            packets = []
+            for position in range(0, byteCount, packetLen):
+                packet = rawData[position:position + packetLen]
+                getattr(codec, 'validate_' + packetName)(packet)
+                packets.append(getattr(codec, 'unpack_' + packetName)(packet))
+            if packetName == 'header':
+                self.assertEqual(set([packet['kind'] for packet in packets]),
+                                 set([1, 2, 3]))
+            else:
+                self.assertEqual(set([packet['status'] for packet in packets]),
+                                 set([0, 1, 65535]))
+
+    def test_deterministic(self):
+        """
+        Test that a seed gives the same capture with any process count.
+        """
+        captures = []
+        for processes, seed in ((1, 5), (2, 5), (1, 6)):
+            outFile = BytesIO()
+            structspec.capture.writeCapture(samples.telemetry,
+                                            ['header', 'point'], 3000,
+                                            outFile, seed, processes, 1000)
+            captures.append(outFile.getvalue())
+        self.assertEqual(captures[0], captures[1])
+        self.assertNotEqual(captures[0], captures[2])
+
+    def test_counted_items(self):
+        """
+        Test that items counted by other items are sized by them.
+        """
+        codec = loadPythonCodec(samples.logbook)
+        for packetName in ('entry', 'batch'):
+            outFile = BytesIO()
+            packetCount, byteCount = structspec.capture.writeCapture(
+                samples.logbook, [packetName], 20000, outFile, seed=2,
+                chunkSize=5000)
+            rawData = outFile.getvalue()
+            getLen = getattr(codec, 'get_{}_len'.format(packetName))
+            unpack = getattr(codec, 'unpack_' + packetName)
+            position = 0
+            entries = []
+            while position < byteCount:
+                packet = unpack(rawData[position:])
+                position += getLen(packet)
+                if packetName == 'entry':
+                    entries.append(packet)
+                else:
+                    entries.extend([packet['first'], packet['second']])
+            self.assertEqual(position, byteCount)
+            self.assertEqual(len(entries),
+                             packetCount * (1 if packetName == 'entry' else 2))
+            for entry in entries:
+                self.assertEqual(len(entry['text']), entry['length'])
+                self.assertEqual(len(entry['values']), entry['count'])
+                self.assertTrue(entry['count'] <=
+                                structspec.capture.maxCount)
+            self.assertTrue(any([entry['text'] for entry in entries]))
+
+
+class TestProjection(unittest.TestCase):
+    """
+    Check unpacking of selected fields only.
+    """
+
+    def setUp(self):
+        self.codec = loadPythonCodec(samples.telemetry)
+        self.rawData = self.codec.pack_reading(samples.reading)
+
+    def test_fields(self):
+        """
+        Test that selected fields match those of the whole packet.
+        """
+        packet = self.codec.unpack_reading(self.rawData)
+        unpacker = self.codec.make_unpacker(
+            'reading', ['timestamp', 'head.kind', 'channel', 'offset'])
+        self.assertEqual(unpacker(self.rawData), {
+            'timestamp': packet['timestamp'],
+            'head': {'kind': packet['head']['kind']},
+            'channel': packet['channel'], 'offset': -70000})
+        self.assertEqual(unpacker(b'\0' * 5 + self.rawData, 5),
+                         unpacker(self.rawData))
+
+    def test_substructures(self):
+        """
+        Test that naming a substructure gives all its fields.
+        """
+        packet = self.codec.unpack_reading(self.rawData)
+        self.assertEqual(
+            self.codec.make_unpacker('reading', ['head', 'samples'])(
+                self.rawData),
+            {'head': packet['head'], 'samples': packet['samples']})
+
+    def test_unknown(self):
+        """
+        Test that unknown packets and fields are rejected.
+        """
+        self.assertRaises(ValueError, self.codec.make_unpacker, 'nothing',
+                          ['timestamp'])
+        self.assertRaises(ValueError, self.codec.make_unpacker, 'reading',
+                          ['head.nothing'])
+        codec = loadPythonCodec(samples.logbook)
+        self.assertRaises(ValueError, codec.make_unpacker, 'entry', ['crc'])
+
+
+class TestScan(unittest.TestCase):
+    """
+    Check filtering of capture files on raw fields.
+    """
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.capture = join(self.directory, 'capture.bin')
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def writeCapture(self, packer, packets):
+        """
+        Write out packets laid end to end.
+        """
+        with open(self.capture, 'wb') as captureFile:
+            for packet in packets:
+                captureFile.write(packer(packet))
+
+    def checkReadings(self, codec):
+        """
+        Check scanning readings differing in timestamp and channel.
+        """
+        readings = [dict(samples.reading, timestamp=timestamp,
+                         channel=timestamp % 8)
+                    for timestamp in range(100)]
+        self.writeCapture(codec.pack_reading, readings)
+        packetLen = codec.get_reading_len()
+        matches = list(codec.scan(self.capture, 'reading', {
+            'channel': 3, 'timestamp': (10, 50), 'head.kind': [2, 4]},
+            chunkSize=100))
+        self.assertEqual([offset for offset, packet in matches],
+                         [timestamp * packetLen
+                          for timestamp in (11, 19, 27, 35, 43)])
+        self.assertEqual(matches[0][1],
+                         codec.unpack_reading(codec.pack_reading(
+                             readings[11])))
+        self.assertEqual(
+            len(list(codec.scan(self.capture, 'reading', {'offset': 0}))), 0)
+        self.assertEqual(len(list(codec.scan(self.capture, 'reading'))), 100)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not available')
+    def test_numpy_scan(self):
+        """
+        Test scanning packets of fixed size with NumPy.
+        """
+        self.checkReadings(loadPythonCodec(samples.telemetry))
+
+    def test_plain_scan(self):
+        """
+        Test scanning packets of fixed size without NumPy.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        codec.numpy = None
+        self.checkReadings(codec)
+
+    def test_variable_scan(self):
+        """
+        Test scanning packets varying in size.
+        """
+        codec = loadPythonCodec(samples.logbook)
+        entries = samples.entries * 20
+        self.writeCapture(codec.pack_entry, entries)
+        matches = list(codec.scan(self.capture, 'entry',
+                                  {'level': samples.entries[1]['level']},
+                                  chunkSize=7))
+        self.assertEqual(len(matches), 20)
+        self.assertEqual(matches[1][0], 2 * matches[0][0] +
+                         codec.get_entry_len(samples.entries[1]))
+        batches = [{'sequence': sequence, 'first': samples.entries[0],
+                    'second': samples.entries[1]} for sequence in range(9)]
+        self.writeCapture(codec.pack_batch, batches)
+        self.assertEqual([packet['sequence'] for offset, packet in
+                          codec.scan(self.capture, 'batch',
+                                     {'sequence': (3, 5)}, chunkSize=20)],
+                         [3, 4, 5])
+
+    def test_compressed_scan(self):
+        """
+        Test scanning compressed captures as they are decompressed.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        readings = [dict(samples.reading, timestamp=timestamp)
+                    for timestamp in range(500)]
+        rawData = b''.join([codec.pack_reading(reading)
+                            for reading in readings])
+        compressors = [('gz', GzipFile), ('bz2', BZ2File)]
+        if LZMAFile is not None:
+            compressors.append(('xz', LZMAFile))
+        for extension, compressor in compressors:
+            capture = '{}.{}'.format(self.capture, extension)
+            compressedFile = compressor(capture, 'wb')
+            compressedFile.write(rawData)
+            compressedFile.close()
+            with codec.open_capture(capture, 1000, 2) as captureFile:
+                self.assertEqual(captureFile.read(10), rawData[:10])
+                self.assertEqual(captureFile.read(), rawData[10:])
+                self.assertEqual(captureFile.read(10), b'')
+            self.assertEqual(
+                [packet['timestamp'] for offset, packet in
+                 codec.scan(capture, 'reading', {'timestamp': (7, 9)})],
+                [7, 8, 9])
+            matches = codec.scan(capture, 'reading')
+            next(matches)
+            matches.close()
+            self.assertEqual(active_count(), 1)
+
+    def test_bad_scans(self):
+        """
+        Test that bad conditions and truncated captures are rejected.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        self.writeCapture(codec.pack_reading, [samples.reading])
+        self.assertRaises(ValueError, list, codec.scan(
+            self.capture, 'reading', {'samples': 0}))
+        self.assertRaises(ValueError, list, codec.scan(
+            self.capture, 'nothing'))
+        with open(self.capture, 'ab') as captureFile:
+            captureFile.write(b'\0')
+        self.assertRaises(ValueError, list, codec.scan(
+            self.capture, 'reading'))
+
+
+class TestResync(unittest.TestCase):
+    """
+    Check recovery of packets from corrupt capture files.
+    """
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.capture = join(self.directory, 'capture.bin')
+        self.codec = loadPythonCodec(samples.telemetry)
+        self.packetLen = self.codec.get_point_len()
+        points = [dict(samples.points[timestamp % 3], timestamp=timestamp)
+                  for timestamp in range(2000)]
+        self.rawData = bytearray(b''.join([self.codec.pack_point(point)
+                                           for point in points]))
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def resync(self, rawData, **options):
+        """
+        Write out a capture and read it back, checking coverage.
+        """
+        with open(self.capture, 'wb') as captureFile:
+            captureFile.write(bytes(rawData))
+        results = list(self.codec.resync(self.capture, 'point', **options))
+        self.assertEqual(results[0][0], 0)
+        self.assertEqual(results[-1][1], len(rawData))
+        for previous, following in zip(results, results[1:]):
+            self.assertEqual(previous[1], following[0])
+        return results
+
+    def test_clean(self):
+        """
+        Test that nothing is skipped in an undamaged capture.
+        """
+        results = self.resync(self.rawData)
+        self.assertEqual([packet['timestamp'] for start, end, packet
+                          in results], list(range(2000)))
+        self.assertEqual(self.codec._resyncAnchors['point'][0],
+                         self.codec.POINT_OFFSETS['status'])
+
+    def test_damaged(self):
+        """
+        Test skipping over altered and missing bytes.
+        """
+        packetLen = self.packetLen
+        self.rawData[5 * packetLen + 3] = 0xff
+        self.rawData[5 * packetLen + 10] = 0x77
+        del self.rawData[100 * packetLen + 4:100 * packetLen + 9]
+        results = self.resync(self.rawData, chunkSize=1000, lookAhead=200)
+        self.assertEqual([result for result in results if result[2] is None],
+                         [(5 * packetLen, 6 * packetLen, None),
+                          (100 * packetLen, 101 * packetLen - 5, None)])
+        self.assertEqual(
+            [packet['timestamp'] for start, end, packet in results
+             if packet is not None],
+            [timestamp for timestamp in range(2000)
+             if timestamp not in (5, 100)])
+
+    def test_ends(self):
+        """
+        Test skipping over leading garbage and a truncated last packet.
+        """
+        results = self.resync(b'\xff\x01' + self.rawData[:-3],
+                              chunkSize=50, lookAhead=100)
+        self.assertEqual(results[0], (0, 2, None))
+        self.assertEqual(results[-1], (2 + 1999 * self.packetLen,
+                                       len(self.rawData) - 1, None))
+        self.assertEqual(len(results), 2001)
+        self.assertRaises(ValueError, list,
+                          self.codec.resync(self.capture, 'nothing'))
+
+
+class TestOffsets(unittest.TestCase):
+    """
+    Check the generated tables of field offsets.
+    """
+
+    def test_fixed_offsets(self):
+        """
+        Test that fields are found at their offsets in packed data.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        rawData = bytearray(codec.pack_reading(samples.reading))
+        offsets = codec.READING_OFFSETS
+        self.assertEqual(offsets['head'], offsets['head.kind'])
+        self.assertEqual(rawData[offsets['head.kind']],
+                         samples.reading['head']['kind'])
+        self.assertEqual(rawData[offsets['timestamp']],
+                         samples.reading['timestamp'] & 0xff)
+        container, bitOffset = offsets['flags']
+        self.assertEqual((rawData[container] >> bitOffset) & 0x1f,
+                         samples.reading['flags'])
+        self.assertEqual(bytes(rawData[offsets['name']:offsets['sequence']]),
+                         samples.reading['name'])
+
+    def test_variable_offsets(self):
+        """
+        Test that fields after items of variable size have no offset.
+        """
+        codec = loadPythonCodec(samples.logbook)
+        self.assertEqual(codec.ENTRY_OFFSETS['text'], 2)
+        self.assertEqual(codec.ENTRY_OFFSETS['count'], None)
+        self.assertEqual(codec.BATCH_OFFSETS['first.length'], 5)
+        self.assertEqual(codec.BATCH_OFFSETS['second'], None)
+
+    def test_native_offsets(self):
+        """
+        Test that native packets are packed unaligned, as laid out.
+        """
+        specification = OrderedDict([
+            ('id', 'native'),
+            ('title', 'Native packets'),
+            ('endianness', 'native'),
+            ('packets', OrderedDict([
+                ('sample', OrderedDict([
+                    ('structure', OrderedDict([
+                        ('a', {'type': 'uint8_t'}),
+                        ('b', {'type': 'uint32_t'}),
+                        ('c', {'type': 'int32_t'}),
+                        ('d', {'type': 'uint16_t'})
+                    ]))
+                ]))
+            ]))
+        ])
+        packet = {'a': 1, 'b': 0x12345678, 'c': -2, 'd': 0xabcd}
+        codec = loadPythonCodec(specification)
+        rawData = codec.pack_sample(packet)
+        self.assertEqual(len(rawData), 11)
+        self.assertEqual(codec.get_sample_len(), 11)
+        self.assertEqual(codec.SAMPLE_OFFSETS,
+                         {'a': 0, 'b': 1, 'c': 5, 'd': 9})
+        self.assertEqual(codec.unpack_sample(rawData), packet)
+        self.assertEqual(codec.make_unpacker('sample', ['c', 'd'])(rawData),
+                         {'c': -2, 'd': 0xabcd})
+        columns = codec.unpack_columns_sample(rawData * 2)
+        self.assertEqual(list(columns['b']), [0x12345678] * 2)
+        self.assertEqual(bytes(codec.pack_columns_sample(columns)),
+                         rawData * 2)
+
+
+class TestLayoutAnalysis(unittest.TestCase):
+    """
+    Check the packet layout analysis.
+    """
+
+    def test_suggestions(self):
+        """
+        Test that suggested orders are denser yet still valid.
+        """
+        specification = structspec.bench.specifications['bitfields']
+        order, wireSize, cSize = structspec.analyze.suggestOrder(
+            'status', specification)
+        self.assertTrue(wireSize < structspec.common.getPacketSize(
+            'status', specification))
+        self.assertTrue(cSize < structspec.analyze.getCLayout(
+            'status', specification)[0])
+        packet = specification['packets']['status']
+        self.assertEqual(sorted(order), sorted(packet['structure'].keys()))
+        suggested = deepcopy(specification)
+        suggested['packets']['status']['structure'] = OrderedDict(
+            [(name, packet['structure'][name]) for name in order])
+        codec = loadPythonCodec(suggested)
+        self.assertEqual(codec.get_status_len(), wireSize)
+        record = structspec.bench.sampleRecord('status', suggested)
+        self.assertEqual(codec.unpack_status(codec.pack_status(record)),
+                         record)
+
+    def test_counts_first(self):
+        """
+        Test that counts still come before the items they count.
+        """
+        order = structspec.analyze.suggestOrder('entry', samples.logbook)[0]
+        self.assertTrue(order.index('length') < order.index('text'))
+        self.assertTrue(order.index('count') < order.index('values'))
+
+    def test_report(self):
+        """
+        Test that every packet is reported on.
+        """
+        outFile = StringIO()
+        structspec.analyze.outputAnalysis(samples.telemetry, outFile)
+        report = outFile.getvalue()
+        for packetName in samples.telemetry['packets']:
+            self.assertTrue('\n{}: '.format(packetName) in '\n' + report)
+        self.assertTrue('Explicit padding: 2 bytes' in report)
+
+    @unittest.skipUnless(find_executable('cc'), 'No C compiler available.')
+    def test_c_sizes(self):
+        """
+        Test that the analysed C sizes agree with the compiler's.
+        """
+        directory = mkdtemp()
+        try:
+            writeCCodec(samples.telemetry, directory)
+            packetNames = samples.telemetry['packets'].keys()
+            with open(join(directory, 'main.c'), 'w') as mainFile:
+                mainFile.write('#include <stdio.h>\n#include "telemetry.h"\n'
+                               'int main(void) {\n')
+                for packetName in packetNames:
+                    mainFile.write('    printf("%zu\\n", sizeof({}));\n'
+                                   .format(packetName))
+                mainFile.write('    return 0;\n}\n')
+            program = join(directory, 'sizes')
+            check_call(['cc', '-std=c99', '-Wall', '-Werror', '-o', program,
+                        join(directory, 'main.c'),
+                        join(directory, 'telemetry.c')])
+            self.assertEqual(check_output([program]).split(), [
+                str(structspec.analyze.getCLayout(packetName,
+                                                  samples.telemetry)[0])
+                for packetName in packetNames])
+        finally:
+            rmtree(directory)
+
+
+def produceReadings(ringName, count):
+    """
+    Put readings into a packet ring from another process.
+    """
+    codec = loadPythonCodec(samples.telemetry)
+    ring = structspec.ring.PacketRing(ringName)
+    for timestamp in range(count):
+        ring.put(codec.pack_reading_into,
+                 dict(samples.reading, timestamp=timestamp,
+                      channel=timestamp % 8), timeout=10)
+    ring.close()
+
+
+class HeaderRecord(object):
+    """
+    A header record with slots for unpacking into.
+    """
+    __slots__ = ('kind', 'length')
+
+
+class ReadingRecord(object):
+    """
+    A reading record with slots for unpacking into.
+    """
+    __slots__ = tuple(samples.reading)
+
+    def __init__(self):
+        self.head = HeaderRecord()
+        self.samples = []
+
+
+class TestUnpackInto(unittest.TestCase):
+    """
+    Check unpacking into existing records.
+    """
+
+    def test_dicts(self):
+        """
+        Test that dictionaries are filled and then reused.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        rawData = codec.pack_reading(samples.reading)
+        record = {}
+        self.assertEqual(codec.unpack_reading_into(b'ab' + rawData, 2,
+                                                   record), len(rawData))
+        self.assertEqual(record, codec.unpack_reading(rawData))
+        head, sampleList = record['head'], record['samples']
+        otherReading = dict(samples.reading, samples=[4, 3, 2, 1],
+                            head={'kind': 1, 'length': 8})
+        codec.unpack_reading_into(codec.pack_reading(otherReading), 0,
+                                  record)
+        self.assertEqual(record, otherReading)
+        self.assertTrue(record['head'] is head)
+        self.assertTrue(record['samples'] is sampleList)
+
+    def test_objects(self):
+        """
+        Test that objects with slots are filled, including nested ones.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        record = ReadingRecord()
+        codec.unpack_reading_into(codec.pack_reading(samples.reading), 0,
+                                  record)
+        self.assertEqual(dict((name, getattr(record, name))
+                              for name in ReadingRecord.__slots__
+                              if name != 'head'),
+                         dict((name, value)
+                              for name, value in samples.reading.items()
+                              if name != 'head'))
+        self.assertEqual((record.head.kind, record.head.length), (2, 300))
+
+    def test_variable(self):
+        """
+        Test unpacking packets of varying size into the same record.
+        """
+        codec = loadPythonCodec(samples.logbook)
+        record = {}
+        rawData = b''.join([codec.pack_entry(entry)
+                            for entry in samples.entries])
+        position = 0
+        for entry in samples.entries:
+            position += codec.unpack_entry_into(rawData, position, record)
+            self.assertEqual(record, entry)
+        self.assertEqual(position, len(rawData))
+        codec = loadPythonCodec(samples.audio)
+        record = {}
+        self.assertEqual(codec.unpack_frame_into(
+            codec.pack_frame(samples.frame), 0, record), 25)
+        self.assertEqual(record, samples.frame)
+
+    def test_pool(self):
+        """
+        Test that a pool hands out released records again.
+        """
+        codec = loadPythonCodec(samples.telemetry)
+        rawData = codec.pack_reading(samples.reading)
+        pool = codec.RecordPool('reading', ReadingRecord, 1)
+        first, second = pool.unpack(rawData), pool.unpack(rawData)
+        self.assertFalse(first is second)
+        pool.release(first)
+        pool.release(second)
+        self.assertTrue(pool.unpack(rawData) is first)
+        self.assertEqual(pool.unpack(rawData).name, 'probe1')
+        self.assertRaises(ValueError, codec.RecordPool, 'unknown')
+
+    def test_without_runtime(self):
+        """
+        Test that the runtime parts are left out unless asked for.
+        """
+        pyFile = StringIO()
+        structspec.languages.python.outputPython(
+            samples.telemetry, {'pyFilename': 'telemetry.py'}, pyFile)
+        self.assertFalse('structspec' in pyFile.getvalue())
+        codec = loadPythonCodec(samples.telemetry, runtime=False)
+        for name in ('RecordPool', 'make_unpacker', 'scan', 'resync',
+                     'pack_many_reading', '_fieldLayouts'):
+            self.assertFalse(hasattr(codec, name))
+        record = {}
+        rawData = codec.pack_reading(samples.reading)
+        codec.unpack_reading_into(rawData, 0, record)
+        self.assertEqual(record, samples.reading)
+
+
+class TestPacketRing(unittest.TestCase):
+    """
+    Check passing packets between processes through shared memory.
+    """
+
+    def setUp(self):
+        self.codec = loadPythonCodec(samples.telemetry)
+        self.ringName = 'structspec-test-{}'.format(getpid())
+        self.ring = structspec.ring.PacketRing(
+            self.ringName, self.codec.get_reading_len(), 8, create=True)
+
+    def tearDown(self):
+        self.ring.close()
+        self.ring.unlink()
+
+    def test_processes(self):
+        """
+        Test that packets arrive in order from another process.
+        """
+        producer = Process(target=produceReadings,
+                           args=(self.ringName, 100))
+        producer.start()
+        unpacker = self.codec.make_unpacker('reading',
+                                            ['timestamp', 'channel'])
+        packets = [self.ring.get(unpacker, timeout=10) for count in range(50)]
+        packets.extend([self.codec.unpack_reading(self.ring.get(timeout=10))
+                        for count in range(50)])
+        producer.join()
+        self.assertEqual([packet['timestamp'] for packet in packets],
+                         list(range(100)))
+        self.assertEqual(packets[13], {'timestamp': 13, 'channel': 5})
+        self.assertEqual(packets[60], self.codec.unpack_reading(
+            self.codec.pack_reading(dict(samples.reading, timestamp=60,
+                                         channel=4))))
+
+    def test_views(self):
+        """
+        Test that slots can be read in place and wrap around.
+        """
+        for timestamp in range(20):
+            self.ring.put(self.codec.pack_reading_into,
+                          dict(samples.reading, timestamp=timestamp))
+            slot, length = self.ring.view()
+            self.assertEqual(length, self.codec.get_reading_len())
+            self.assertEqual(self.codec.unpack_reading(slot.raw[:length]),
+                             dict(samples.reading, timestamp=timestamp))
+            self.ring.release()
+
+    def test_full_and_empty(self):
+        """
+        Test that the ring refuses to overfill or give too much.
+        """
+        self.assertRaises(Empty, self.ring.get, None, 0)
+        for timestamp in range(8):
+            self.ring.put(self.codec.pack_reading_into, samples.reading, 0)
+        self.assertRaises(Full, self.ring.put, self.codec.pack_reading_into,
+                          samples.reading, 0)
+        self.ring.get()
+        self.ring.put(self.codec.pack_reading_into, samples.reading, 0)
+        smallRing = structspec.ring.PacketRing(self.ringName + '-small', 2,
+                                               1, create=True)
+        try:
+            self.assertRaises(StructError, smallRing.put,
+                              self.codec.pack_reading_into, samples.reading,
+                              0)
+        finally:
+            smallRing.close()
+            smallRing.unlink()
+
+
+class TestPacketWriter(unittest.TestCase):
+    """
+    Check writing packets through a buffer.
+    """
+
+    def setUp(self):
+        self.codec = loadPythonCodec(samples.telemetry)
+        self.readings = [dict(samples.reading, timestamp=timestamp)
+                         for timestamp in range(10)]
+        self.rawData = b''.join([self.codec.pack_reading(reading)
+                                 for reading in self.readings])
+
+    def test_files(self):
+        """
+        Test that packets are written in order through a full buffer.
+        """
+        outFile = BytesIO()
+        packetLen = self.codec.get_reading_len()
+        with structspec.writer.PacketWriter(outFile,
+                                            4 * packetLen + 1) as writer:
+            for reading in self.readings:
+                writer.write(self.codec.pack_reading_into, reading)
+            self.assertEqual(outFile.getvalue(), self.rawData[:8 * packetLen])
+        self.assertEqual(outFile.getvalue(), self.rawData)
+        self.assertEqual(writer.writes, 3)
+        outFile = BytesIO()
+        writer = structspec.writer.PacketWriter(outFile, 4 * packetLen + 1)
+        writer.writeMany(self.codec.pack_reading_into, self.readings)
+        writer.close()
+        self.assertEqual(outFile.getvalue(), self.rawData)
+        self.assertEqual(writer.writes, 3)
+        self.assertRaises(StructError, structspec.writer.PacketWriter(
+            outFile, packetLen - 1).write, self.codec.pack_reading_into,
+            samples.reading)
+
+    def test_policies(self):
+        """
+        Test flushing after a number of packets or a time.
+        """
+        outFile = BytesIO()
+        writer = structspec.writer.PacketWriter(outFile, maxPackets=4)
+        writer.writeMany(self.codec.pack_reading_into, self.readings)
+        self.assertEqual(writer.writes, 2)
+        writer.close()
+        self.assertEqual(outFile.getvalue(), self.rawData)
+        outFile = BytesIO()
+        writer = structspec.writer.PacketWriter(outFile, maxDelay=0)
+        for reading in self.readings[:3]:
+            writer.write(self.codec.pack_reading_into, reading)
+        self.assertEqual(outFile.getvalue(), self.rawData[
+            :2 * self.codec.get_reading_len()])
+
+    def test_sockets(self):
+        """
+        Test that raw data too big for the buffer goes out with it.
+        """
+        sender, receiver = socketpair()
+        try:
+            writer = structspec.writer.PacketWriter(sender, 100)
+            writer.writeRaw(self.rawData[:50])
+            writer.writeRaw(self.rawData[50:])
+            self.assertEqual(writer.writes, 1)
+            received = []
+            while sum(map(len, received)) < len(self.rawData):
+                received.append(receiver.recv(1 << 16))
+            self.assertEqual(b''.join(received), self.rawData)
+        finally:
+            sender.close()
+            receiver.close()
+
+    def test_descriptors(self):
+        """
+        Test writing to a file descriptor.
+        """
+        readEnd, writeEnd = pipe()
+        try:
+            with structspec.writer.PacketWriter(writeEnd, 100) as writer:
+                writer.writeRaw(b'head')
+                writer.writeRaw(self.rawData)
+            self.assertEqual(read(readEnd, 1 << 16), b'head' + self.rawData)
+        finally:
+            close(readEnd)
+            close(writeEnd)
+
+
+class TestPackMany(unittest.TestCase):
+    """
+    Check packing many packets at once.
+    """
+
+    def setUp(self):
+        self.telemetry = loadPythonCodec(samples.telemetry)
+        self.logbook = loadPythonCodec(samples.logbook)
+        # Pool workers find the packing functions by module name
+        for codec in (self.telemetry, self.logbook):
+            modules[codec.__name__] = codec
+        self.points = [dict(samples.points[timestamp % 3],
+                            timestamp=timestamp)
+                       for timestamp in range(1000)]
+        self.entries = samples.entries * 100
+
+    def tearDown(self):
+        for codec in (self.telemetry, self.logbook):
+            del modules[codec.__name__]
+
+    def test_fixed(self):
+        """
+        Test packing packets of fixed size.
+        """
+        packed = self.telemetry.pack_many_point(self.points)
+        self.assertTrue(isinstance(packed, bytearray))
+        self.assertEqual(bytes(packed), b''.join(
+            [self.telemetry.pack_point(point) for point in self.points]))
+        self.assertEqual(self.telemetry.pack_many_point(iter(self.points)),
+                         packed)
+        readings = [dict(samples.reading, timestamp=timestamp)
+                    for timestamp in range(10)]
+        self.assertEqual(bytes(self.telemetry.pack_many_reading(readings)),
+                         b''.join([self.telemetry.pack_reading(reading)
+                                   for reading in readings]))
+        self.assertEqual(self.telemetry.pack_many_point([]), bytearray())
+
+    def test_variable(self):
+        """
+        Test packing packets sized by the counts they hold.
+        """
+        self.assertEqual(bytes(self.logbook.pack_many_entry(self.entries)),
+                         b''.join([self.logbook.pack_entry(entry)
+                                   for entry in self.entries]))
+        batches = [{'sequence': sequence, 'first': samples.entries[0],
+                    'second': samples.entries[1]} for sequence in range(9)]
+        self.assertEqual(bytes(self.logbook.pack_many_batch(batches)),
+                         b''.join([self.logbook.pack_batch(batch)
+                                   for batch in batches]))
+        badEntry = dict(samples.entries[1],
+                        count=samples.entries[1]['count'] - 1)
+        self.assertRaises(StructError, self.logbook.pack_many_entry,
+                          [samples.entries[0], badEntry])
+
+    def test_processes(self):
+        """
+        Test sharing packing out among worker processes.
+        """
+        packed = self.telemetry.pack_many_point(self.points)
+        self.assertEqual(self.telemetry.pack_many_point(self.points, 2, 64),
+                         packed)
+        packed = self.logbook.pack_many_entry(self.entries)
+        self.assertEqual(self.logbook.pack_many_entry(self.entries, 2, 7),
+                         packed)
+        # Workers that are not forked are sent their packets instead
+        startMethod = structspec.runtime.get_start_method
+        structspec.runtime.get_start_method = lambda: 'spawn'
+        try:
+            self.assertEqual(self.logbook.pack_many_entry(self.entries, 2, 7),
+                             packed)
+        finally:
+            structspec.runtime.get_start_method = startMethod
+        badEntry = dict(samples.entries[1],
+                        count=samples.entries[1]['count'] - 1)
+        self.assertRaises(StructError, self.logbook.pack_many_entry,
+                          self.entries + [badEntry], 2, 7)
+
+
+def decodeContainerBlock(job):
+    """
+    Decodes a container block in another process.
+    """
+    path, block = job
+    with open(path, 'rb') as inFile:
+        inFile.seek(block['offset'])
+        return structspec.container.decodeBlock(
+            inFile.read(block['storedSize']), block)
+
+
+class TestContainer(unittest.TestCase):
+    """
+    Check indexed packet containers.
+    """
+
+    def setUp(self):
+        self.codec = loadPythonCodec(samples.telemetry)
+        self.readings = [dict(samples.reading, timestamp=timestamp * 10)
+                         for timestamp in range(100)]
+        self.directory = mkdtemp()
+        self.path = join(self.directory, 'readings.sspc')
+        self.writeContainer()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def writeContainer(self, compression='zlib'):
+        """
+        Writes the readings into a container.
+        """
+        packetLen = self.codec.get_reading_len()
+        with open(self.path, 'wb') as outFile:
+            with structspec.container.ContainerWriter(
+                    outFile, samples.telemetry, 16 * packetLen,
+                    compression) as writer:
+                for reading in self.readings:
+                    writer.write(self.codec.pack_reading(reading),
+                                 reading['timestamp'])
+
+    def test_round_trip(self):
+        """
+        Test that every packet comes back from its block.
+        """
+        for compression in (None, 'zlib', 'bz2'):
+            self.writeContainer(compression)
+            with open(self.path, 'rb') as inFile:
+                reader = structspec.container.ContainerReader(
+                    inFile, samples.telemetry)
+                self.assertEqual(reader.specificationId, 'telemetry')
+                self.assertEqual(len(reader.blocks), 7)
+                self.assertEqual(sum([block['count']
+                                      for block in reader.blocks]), 100)
+                packets = []
+                for blockNum in range(len(reader.blocks)):
+                    packets.extend(reader.readPackets(
+                        blockNum, self.codec.unpack_reading_into))
+                self.assertEqual(packets, self.readings)
+                self.assertEqual(reader.verify(), [])
+
+    def test_seeks(self):
+        """
+        Test finding the blocks holding a range of keys.
+        """
+        with open(self.path, 'rb') as inFile:
+            reader = structspec.container.ContainerReader(inFile)
+            self.assertEqual(reader.blocks[1]['minKey'], 160)
+            self.assertEqual(reader.blocks[1]['maxKey'], 310)
+            self.assertEqual(reader.findBlocks(300, 330), [1, 2])
+            self.assertEqual(reader.findBlocks(985), [6])
+            self.assertEqual(reader.findBlocks(end=-1), [])
+            packets = reader.readPackets(reader.findBlocks(500, 500)[0],
+                                         self.codec.unpack_reading_into)
+            self.assertTrue(self.readings[50] in packets)
+
+    def test_parallel(self):
+        """
+        Test decoding blocks in other processes.
+        """
+        with open(self.path, 'rb') as inFile:
+            blocks = structspec.container.ContainerReader(inFile).blocks
+        pool = Pool(2)
+        try:
+            rawData = b''.join(pool.map(decodeContainerBlock,
+                                        [(self.path, block)
+                                         for block in blocks]))
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(rawData, b''.join([self.codec.pack_reading(reading)
+                                            for reading in self.readings]))
+
+    def test_damage(self):
+        """
+        Test that damage and mismatches are found.
+        """
+        with open(self.path, 'rb') as inFile:
+            rawData = inFile.read()
+        blocks = structspec.container.ContainerReader(BytesIO(rawData)).blocks
+        damaged = bytearray(rawData)
+        damaged[blocks[3]['offset'] + 5] ^= 0xff
+        reader = structspec.container.ContainerReader(BytesIO(damaged))
+        self.assertEqual(reader.verify(), [3])
+        self.assertRaises(ValueError, reader.readBlock, 3)
+        self.assertRaises(ValueError, structspec.container.ContainerReader,
+                          BytesIO(rawData[:-1]))
+        self.assertRaises(ValueError, structspec.container.ContainerReader,
+                          BytesIO(rawData), samples.logbook)
+        self.assertRaises(ValueError, structspec.container.ContainerReader,
+                          BytesIO(b'SSPR' + rawData[4:]))
+
+
+class TestFileWatcher(unittest.TestCase):
+    """
+    Check watching the input files for changes.
+    """
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.specName = join(self.directory, 'spec.json')
+        self.schemaName = join(self.directory, 'schema.json')
+        with open(self.schemaName, 'w') as schemaFile:
+            schemaFile.write('{}')
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_changes(self):
+        """
+        Test that everything is given first and then only changes.
+        """
+        watcher = structspec.watch.FileWatcher(
+            [self.specName, self.schemaName], 0)
+        changes = iter(watcher)
+        self.assertEqual(next(changes), [self.specName, self.schemaName])
+        self.assertEqual(watcher.poll(), [])
+        with open(self.specName, 'w') as specFile:
+            specFile.write('{"packets": {}}')
+        self.assertEqual(next(changes), [self.specName])
+        with open(self.schemaName, 'w') as schemaFile:
+            schemaFile.write('{"type": "object"}')
+        self.assertEqual(next(changes), [self.schemaName])
+
+    def test_missing(self):
+        """
+        Test that a file is not reported while it is missing.
+        """
+        with open(self.specName, 'w') as specFile:
+            specFile.write('{}')
+        watcher = structspec.watch.FileWatcher([self.specName])
+        remove(self.specName)
+        self.assertEqual(watcher.poll(), [])
+        with open(self.specName, 'w') as specFile:
+            specFile.write('{"packets": {}}')
+        self.assertEqual(watcher.poll(), [self.specName])
+
 if __name__ == '__main__':
     # When executed from the command line, run all the tests via unittest.
     from unittest import main
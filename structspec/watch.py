@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Input file watching
+
+Polls a set of files (normally the specification and its schema) for
+changes so that structspec can stay running and regenerate its
+output as soon as they are saved, without paying its start-up costs
+again each time. Polling is used rather than any platform's change
+notification so that it works the same everywhere; checking the
+status of a couple of files every tenth of a second costs next to
+nothing.
+"""
+
+from os import stat
+from time import sleep
+
+# The default time in seconds between checks
+defaultInterval = 0.1
+
+
+def getStamp(path):
+    """
+    Gets what is compared to tell whether a file has changed.
+
+    Args:
+        path (str): The name of the file.
+
+    Returns:
+        A tuple of the file's modification time and size, or None if
+        it does not currently exist.
+
+    Examples:
+        >>> getStamp('no-such-file.json') is None
+        True
+    """
+    try:
+        fileStat = stat(path)
+    except EnvironmentError:
+        return None
+    return (fileStat.st_mtime, fileStat.st_size)
+
+
+class FileWatcher(object):
+    """
+    Watches files for changes.
+
+    Iterating over a watcher first gives all of its paths (so that
+    everything is processed once at the start) and then, each time
+    any of them change, a list of those that did. A file that
+    disappears is not reported until it comes back, as many editors
+    briefly remove a file while saving it.
+
+    Examples:
+        >>> from os import remove
+        >>> from tempfile import mkstemp
+        >>> fileNum, path = mkstemp()
+        >>> watcher = FileWatcher([path])
+        >>> watcher.poll()
+        []
+        >>> with open(path, 'w') as watchedFile:
+        ...     _ = watchedFile.write('{}')
+        >>> watcher.poll() == [path]
+        True
+        >>> watcher.poll()
+        []
+        >>> from os import close
+        >>> close(fileNum)
+        >>> remove(path)
+    """
+
+    def __init__(self, paths, interval=defaultInterval):
+        """
+        Starts watching files.
+
+        Args:
+            paths (list):     The names of the files to watch.
+            interval (float): The time in seconds between checks.
+        """
+        self.paths = list(paths)
+        self.interval = interval
+        self.stamps = dict((path, getStamp(path)) for path in self.paths)
+
+    def poll(self):
+        """
+        Checks for changes since the last check.
+
+        Returns:
+            A list of the paths that have changed.
+        """
+        changed = []
+        for path in self.paths:
+            stamp = getStamp(path)
+            if stamp is not None and stamp != self.stamps[path]:
+                changed.append(path)
+            if stamp is not None:
+                self.stamps[path] = stamp
+        return changed
+
+    def __iter__(self):
+        """Gives all the paths, then those that change, forever."""
+        yield list(self.paths)
+        while True:
+            sleep(self.interval)
+            changed = self.poll()
+            if changed:
+                yield changed
+
+
+# Execute the following when run from the command line.
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Buffered packet writer
+
+Writes a stream of packets to a file, socket or file descriptor with
+as few system calls as possible. Packets are packed straight into one
+large preallocated buffer with a generated pack_<packet>_into
+function, and the buffer is written out in a single call once it
+fills, holds enough packets or has held its first packet long enough.
+
+Sockets are written with sendmsg and file descriptors with os.writev
+where available, so that raw data too big for what is left of the
+buffer goes out along with it in the same call; elsewhere each part
+is written in turn.
+"""
+
+from struct import error as StructError
+from time import time
+try:
+    from os import write as writeFile, writev
+except ImportError:
+    from os import write as writeFile
+    writev = None
+
+# The default size of the buffer, in bytes
+defaultBufferSize = 1 << 20
+
+
+class PacketWriter(object):
+    """
+    Writes packets through a buffer, flushing it in a single call.
+
+    Examples:
+        >>> from io import BytesIO
+        >>> outFile = BytesIO()
+        >>> def packInto(packet, buffer, offset):
+        ...     buffer[offset:offset + len(packet)] = packet
+        ...     return len(packet)
+        >>> writer = PacketWriter(outFile, 16, maxPackets=3)
+        >>> for packet in (b'one', b'two', b'three', b'four'):
+        ...     writer.write(packInto, packet)
+        >>> outFile.getvalue() == b'onetwothree'
+        True
+        >>> writer.close()
+        >>> outFile.getvalue() == b'onetwothreefour'
+        True
+        >>> writer.writes
+        2
+    """
+
+    def __init__(self, target, bufferSize=defaultBufferSize,
+                 maxPackets=None, maxDelay=None):
+        """
+        Starts writing packets.
+
+        Args:
+            target:           A file-like object, socket or file
+                              descriptor to write to; it is not
+                              closed along with the writer.
+            bufferSize (int): The size of the buffer, which is
+                              flushed whenever the next packet would
+                              not fit in it.
+            maxPackets (int): The most packets to hold before
+                              flushing; unlimited if None.
+            maxDelay (float): The longest time in seconds to hold a
+                              packet before flushing; unlimited if
+                              None. This is checked as each packet
+                              is written, so a writer left idle
+                              should be flushed by its caller.
+        """
+        self.target = target
+        self.buffer = bytearray(bufferSize)
+        self.view = memoryview(self.buffer)
+        self.maxPackets = maxPackets
+        self.maxDelay = maxDelay
+        self.used = 0
+        self.count = 0
+        self.started = None
+        self.writes = 0
+        if isinstance(target, int):
+            self._writeOut = self._writeDescriptor
+        elif hasattr(target, 'sendall'):
+            self._writeOut = self._writeSocket
+        else:
+            self._writeOut = self._writeFile
+
+    def write(self, packInto, packet):
+        """
+        Packs a packet straight into the buffer.
+
+        Args:
+            packInto (function): A function packing the packet into a
+                                 buffer at an offset and giving the
+                                 number of bytes packed, such as a
+                                 generated pack_<packet>_into.
+            packet:              The packet to pack.
+
+        Raises:
+            StructError: If the packet cannot be packed or is too big
+                         for even an empty buffer.
+        """
+        try:
+            self.used += packInto(packet, self.buffer, self.used)
+        except StructError:
+            if not self.used:
+                raise
+            self.flush()
+            self.used = packInto(packet, self.buffer, 0)
+        self.count += 1
+        if self.count == self.maxPackets:
+            self.flush()
+        elif self.maxDelay is not None:
+            self._checkDelay()
+
+    def writeMany(self, packInto, packets):
+        """
+        Packs a number of packets straight into the buffer.
+
+        This is the same as writing each in turn, only faster.
+
+        Args:
+            packInto (function): A function packing a packet into a
+                                 buffer at an offset and giving the
+                                 number of bytes packed.
+            packets (iterable):  The packets to pack.
+
+        Raises:
+            StructError: If a packet cannot be packed or is too big
+                         for even an empty buffer.
+        """
+        if self.maxPackets is not None or self.maxDelay is not None:
+            for packet in packets:
+                self.write(packInto, packet)
+            return
+        buffer = self.buffer
+        used = self.used
+        for packet in packets:
+            try:
+                used += packInto(packet, buffer, used)
+            except StructError:
+                if not used:
+                    raise
+                self.used = used
+                self.flush()
+                used = packInto(packet, buffer, 0)
+        self.used = used
+
+    def writeRaw(self, rawData):
+        """
+        Writes already packed data.
+
+        Data too big for what is left of the buffer is written out
+        along with it rather than copied.
+
+        Args:
+            rawData: The packed bytes.
+        """
+        if self.used + len(rawData) > len(self.buffer):
+            self.flush(rawData)
+            return
+        self.buffer[self.used:self.used + len(rawData)] = rawData
+        self.used += len(rawData)
+        self.count += 1
+        if self.count == self.maxPackets:
+            self.flush()
+        elif self.maxDelay is not None:
+            self._checkDelay()
+
+    def _checkDelay(self):
+        """Flushes the buffer if its first packet has waited long enough."""
+        now = time()
+        if self.started is None:
+            self.started = now
+        elif now - self.started >= self.maxDelay:
+            self.flush()
+
+    def flush(self, *extra):
+        """
+        Writes out everything held in the buffer.
+
+        Args:
+            *extra: Further data to write out straight after it in
+                    the same call.
+        """
+        parts = [self.view[:self.used]] if self.used else []
+        parts.extend([memoryview(part) for part in extra])
+        if parts:
+            self._writeOut(parts)
+            self.writes += 1
+        self.used = self.count = 0
+        self.started = None
+
+    def _writeFile(self, parts):
+        """Writes to a file-like object."""
+        for part in parts:
+            self.target.write(part)
+
+    def _writeSocket(self, parts):
+        """Sends to a socket, all in one call where possible."""
+        if not hasattr(self.target, 'sendmsg'):
+            for part in parts:
+                self.target.sendall(part)
+            return
+        while parts:
+            sent = self.target.sendmsg(parts)
+            parts = self._dropWritten(parts, sent)
+
+    def _writeDescriptor(self, parts):
+        """Writes to a file descriptor, all in one call where possible."""
+        while parts:
+            if writev is None:
+                sent = writeFile(self.target, parts[0])
+            else:
+                sent = writev(self.target, parts)
+            parts = self._dropWritten(parts, sent)
+
+    @staticmethod
+    def _dropWritten(parts, written):
+        """Gives what is left of some data after part was written."""
+        while parts and written >= len(parts[0]):
+            written -= len(parts[0])
+            parts = parts[1:]
+        if parts and written:
+            parts = [parts[0][written:]] + parts[1:]
+        return parts
+
+    def close(self):
+        """Flushes the buffer; the target is left open."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+
+# Execute the following when run from the command line.
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()